@@ -0,0 +1,250 @@
+"""Load test with simulated annotators against a running app.
+
+Every annotator is a process that talks to the Dash callback endpoint
+(`/_dash-update-component`) like a browser would: it opens the project, then
+clicks rows, labels some of the similar rows and saves every few labels, with
+a random think time between the actions. The requests are built from the
+callback definitions at `/_dash-dependencies`, so they carry the same inputs
+and states as the ones of the browser, including the whole arg table.
+
+    python benchmarks/stub_server.py      # or with gunicorn, see there
+    python benchmarks/loadtest.py --annotators 10 --duration 120
+
+At the end, the throughput and the latency percentiles of every action are
+printed and optionally written to JSON. For realistic numbers, run the load
+test on another machine than the server (`--url`).
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import http.client
+import urllib.parse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+PROJECT = 'loadtest'
+LABELS = ['positive', 'negative', 'neutral', 'off-topic']
+UPDATE_PATH = '/_dash-update-component'
+DEPENDENCIES_PATH = '/_dash-dependencies'
+# the actions and the output of the callback that serves them
+ACTIONS = {
+    'open_project': 'current_dataset.data',
+    'refresh_datatable': 'arg-list-box.children',
+    'select_row': 'arg-table.data',
+    'label_rows': 'arg-table.data',
+    'save_data': 'clean-bit.data-saved',
+}
+
+
+class DashClient:
+    """Sends callback requests to a Dash app over one keep-alive connection."""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=600)
+        self.callbacks = {}
+        for callback in self.request('GET', DEPENDENCIES_PATH):
+            for output in callback['output'].strip('.').split('...'):
+                self.callbacks[output] = callback
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # the server closed the connection, retry once on a new one
+            self.connection.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=600)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        content = response.read()
+        if response.status == 204:
+            return None
+        if response.status != 200:
+            raise RuntimeError(f'{path}: HTTP {response.status}')
+        return json.loads(content)
+
+    def update(self, output, changed, values):
+        """Triggers the callback with the given output.
+
+        Args:
+            output: one output of the callback, as `id.property`
+            changed: the input that changed, as `id.property`
+            values: dict with the values of inputs and states by `id.property`,
+                the others are sent as None.
+
+        Returns:
+            dict with the new values by `id.property`, empty if the callback
+            didn't update anything.
+        """
+        callback = self.callbacks[output]
+        outputs = [
+            dict(zip(('id', 'property'), name.rsplit('.', 1)))
+            for name in callback['output'].strip('.').split('...')
+        ]
+        body = {
+            'output': callback['output'],
+            'outputs': outputs if len(outputs) > 1 else outputs[0],
+            'inputs': [self.value(item, values) for item in callback['inputs']],
+            'changedPropIds': [changed],
+            'state': [self.value(item, values) for item in callback['state']],
+        }
+        response = self.request('POST', UPDATE_PATH, json.dumps(body))
+        if response is None:
+            return {}
+        return {
+            f'{component}.{prop}': value
+            for component, props in response['response'].items()
+            for prop, value in props.items()
+        }
+
+    @staticmethod
+    def value(item, values):
+        return dict(item, value=values.get(f'{item["id"]}.{item["property"]}'))
+
+
+def annotator(url, duration, think_time, save_every, seed):
+    """One simulated annotator, returns a list of (action, seconds, error)."""
+    rng = random.Random(seed)
+    client = DashClient(url)
+    samples = []
+
+    def timed(action, changed, values):
+        start = time.perf_counter()
+        try:
+            result = client.update(ACTIONS[action], changed, values)
+            samples.append((action, time.perf_counter() - start, None))
+            return result
+        except Exception as e:
+            samples.append((action, time.perf_counter() - start, repr(e)))
+            return None
+
+    result = timed('open_project', 'open-project-btn.n_clicks', {
+        'open-project-btn.n_clicks': 1,
+        'open-project-dd.value': PROJECT,
+    })
+    if not result:
+        return samples
+    current_dataset = result['current_dataset.data']
+    timed('refresh_datatable', 'current_dataset.data', {
+        'current_dataset.data': current_dataset})
+    arg_data, algo_data = current_dataset['data'], []
+    label_column = f'{PROJECT}_label'
+    state = {
+        'current_dataset.data': current_dataset,
+        'dirty-bit.data-changed': 0,
+        'suggest-hide-labeled.value': [],
+        'suggest-threshold.value': None,
+    }
+    label_list = [{'props': {}}] + [{'props': {'id': {'label': label}}} for label in LABELS]
+    labeled, saves = 0, 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        time.sleep(rng.expovariate(1 / think_time))
+        row = rng.randrange(len(arg_data))
+        active_cell = {
+            'row': row, 'column': 0, 'column_id': current_dataset['text_column'],
+            'row_id': arg_data[row]['id'],
+        }
+        result = timed('select_row', 'arg-table.active_cell', dict(
+            state, **{
+                'arg-table.active_cell': active_cell,
+                'arg-table.data': arg_data,
+                'algo-table.data': algo_data,
+            }))
+        if not result:
+            continue
+        algo_data = result['algo-table.data']
+        time.sleep(rng.expovariate(1 / think_time))
+        algo_data = [dict(item) for item in algo_data]
+        for item in rng.sample(algo_data, min(rng.randint(1, 3), len(algo_data))):
+            item[label_column] = rng.choice(LABELS)
+        result = timed('label_rows', 'algo-table.data', dict(
+            state, **{
+                'arg-table.active_cell': active_cell,
+                'arg-table.data': arg_data,
+                'algo-table.data': algo_data,
+            }))
+        if not result:
+            continue
+        arg_data, algo_data = result['arg-table.data'], result['algo-table.data']
+        state['dirty-bit.data-changed'] = result['dirty-bit.data-changed']
+        labeled += 1
+        if labeled % save_every == 0:
+            timed('save_data', 'btn-save-data.n_clicks', {
+                'btn-save-data.n_clicks': labeled // save_every,
+                'arg-table.data': arg_data,
+                'clean-bit.data-saved': saves,
+                'label-list.children': label_list,
+                'current_dataset.data': current_dataset,
+            })
+            saves += 1
+    return samples
+
+
+def report(samples, duration, annotators):
+    """Throughput and latency percentiles per action."""
+    results = {'annotators': annotators, 'duration': duration, 'actions': {}}
+    for action in ACTIONS:
+        timings = np.array([seconds for name, seconds, _ in samples if name == action])
+        errors = [error for name, _, error in samples if name == action and error]
+        if not len(timings):
+            continue
+        results['actions'][action] = {
+            'requests': len(timings),
+            'errors': len(errors),
+            'throughput': len(timings) / duration,
+            'p50': float(np.percentile(timings, 50)),
+            'p95': float(np.percentile(timings, 95)),
+            'p99': float(np.percentile(timings, 99)),
+            'max': float(timings.max()),
+        }
+        if errors:
+            results['actions'][action]['first error'] = errors[0]
+    results['throughput'] = len(samples) / duration
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--annotators', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument(
+        '--think-time', type=float, default=2.0, help='mean seconds between actions')
+    parser.add_argument(
+        '--save-every', type=int, default=10, help='labeling actions between saves')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    with ProcessPoolExecutor(args.annotators) as executor:
+        futures = [
+            executor.submit(
+                annotator, args.url, args.duration, args.think_time, args.save_every, seed)
+            for seed in range(args.annotators)
+        ]
+        samples = [sample for future in futures for sample in future.result()]
+    results = report(samples, time.monotonic() - start, args.annotators)
+
+    print(f'{args.annotators} annotators, {results["duration"]:.0f} s, '
+          f'{results["throughput"]:.2f} requests/s')
+    print(f'{"action":<20}{"requests":>9}{"errors":>8}{"req/s":>8}'
+          f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for action, stats in results['actions'].items():
+        print(f'{action:<20}{stats["requests"]:>9}{stats["errors"]:>8}'
+              f'{stats["throughput"]:>8.2f}{stats["p50"] * 1000:>10.0f}'
+              f'{stats["p95"] * 1000:>10.0f}{stats["p99"] * 1000:>10.0f}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if any(stats['errors'] for stats in results['actions'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
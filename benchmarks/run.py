@@ -0,0 +1,190 @@
+"""Benchmarks of the hot paths, on synthetic datasets of different sizes.
+
+Usage (from the repository root):
+
+    python benchmarks/run.py --sizes 10000 100000 1000000 --output results.json
+    python benchmarks/run.py --sizes 10000 --compare results.json
+
+Everything runs in a temporary working directory with the fake encoder from
+`fake_encoder`, so no model is downloaded and existing datasets are left
+alone. The timings of every benchmark and dataset size are written to a JSON
+file together with the git revision, so two versions can be compared with
+`--compare`.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import datasets
+import fake_encoder
+import synthetic
+
+SIZES = [10000, 100000, 1000000]
+REPEAT = 5
+SEARCH_QUERIES = 50
+SEARCH_RESULTS = 10
+LABELS = ['positive', 'negative', 'neutral', 'off-topic']
+# a benchmark is reported as slower or faster than the comparison beyond this
+# ratio of the medians
+TOLERANCE = 1.2
+
+
+def timed(function, *args, repeat=REPEAT, **kwargs):
+    """Runs a function `repeat` times and returns the timings and the result of
+    the last run."""
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def summary(timings):
+    timings = np.asarray(timings)
+    return {
+        'runs': len(timings),
+        'min': float(timings.min()),
+        'median': float(np.median(timings)),
+        'p95': float(np.percentile(timings, 95)),
+        'mean': float(timings.mean()),
+    }
+
+
+def run_size(n_rows, repeat):
+    """Runs all benchmarks on one dataset size, in the current directory."""
+    import cb_datatables
+
+    results = {}
+    name, project = f'bench{n_rows}', f'project{n_rows}'
+    data = synthetic.tweets(n_rows)
+    timings, _ = timed(
+        datasets.create_dataset, data, name, 'synthetic tweets', 'text',
+        encoder=fake_encoder.BACKEND, repeat=1)
+    results['create_dataset'] = summary(timings)
+
+    # the first query loads the index and the encoder, which is not searching
+    queries = synthetic.queries(SEARCH_QUERIES)
+    datasets.search_faiss_with_string(queries[0], name, SEARCH_RESULTS)
+    search_timings = []
+    for query in queries:
+        timings, _ = timed(
+            datasets.search_faiss_with_string, query, name, SEARCH_RESULTS, repeat=1)
+        search_timings.extend(timings)
+    results['search_faiss_with_string'] = summary(search_timings)
+
+    datasets.create_project(name, project)
+    timings, (dataframe, _, _) = timed(datasets.load_project, project, repeat=repeat)
+    results['load_project'] = summary(timings)
+
+    label_column = f'{project}_label'
+    rng = np.random.default_rng(0)
+    labeled = rng.random(n_rows) < 0.1
+    dataframe[label_column] = np.where(labeled, rng.choice(LABELS, n_rows), None)
+    arg_data = dataframe.to_dict('records')
+    timings, _ = timed(
+        datasets.update_project_columns, arg_data, project, name, repeat=repeat)
+    results['update_project_columns'] = summary(timings)
+
+    algo_rows = rng.choice(n_rows, SEARCH_RESULTS, replace=False)
+    algo_data = dataframe.iloc[algo_rows].to_dict('records')
+    timings, _ = timed(
+        cb_datatables.sync_dropdown_selection,
+        arg_data, algo_data, 'arg-table.data', None, 0, repeat=repeat)
+    results['sync_dropdown_selection (arg to algo)'] = summary(timings)
+    timings, _ = timed(
+        cb_datatables.sync_dropdown_selection,
+        arg_data, algo_data, 'algo-table.data', None, 0, repeat=repeat)
+    results['sync_dropdown_selection (algo to arg)'] = summary(timings)
+
+    # one label is deleted, its rows have to be reset
+    dropdown = {label_column: {'options': [{'label': label} for label in LABELS[1:]]}}
+    timings, _ = timed(
+        cb_datatables.sync_labels,
+        dropdown, [dict(row) for row in arg_data], [dict(row) for row in algo_data], project,
+        repeat=repeat)
+    results['sync_labels'] = summary(timings)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Prints the ratio of the median timings to the ones of a baseline run."""
+    print(f'\ncompared to {baseline["revision"]}:')
+    for size, benchmarks in results['results'].items():
+        for benchmark, timings in benchmarks.items():
+            old = baseline['results'].get(size, {}).get(benchmark)
+            if old is None:
+                continue
+            ratio = timings['median'] / old['median']
+            verdict = ''
+            if ratio > TOLERANCE:
+                verdict = 'slower'
+            elif ratio < 1 / TOLERANCE:
+                verdict = 'faster'
+            print(f'{size:>8} {benchmark:<40} {ratio:6.2f}x {verdict}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='results of an earlier run')
+    args = parser.parse_args()
+
+    fake_encoder.register()
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    results = {
+        'revision': git_revision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': {},
+    }
+    directory = tempfile.mkdtemp(prefix='anno_benchmark_')
+    cwd = os.getcwd()
+    try:
+        os.chdir(directory)
+        for path in (datasets.DATA_PATH, datasets.FAISS_PATH, datasets.EMBEDDINGS_PATH):
+            os.makedirs(path, exist_ok=True)
+        for size in args.sizes:
+            print(f'{size} rows')
+            results['results'][str(size)] = run_size(size, args.repeat)
+            for benchmark, timings in results['results'][str(size)].items():
+                print(f'  {benchmark:<40} {timings["median"] * 1000:10.1f} ms')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {output}')
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""The app with the fake encoder and a synthetic project, for load tests.
+
+The workspace (ANNO_LOADTEST_DIR, default `./loadtest_workspace`) gets a
+synthetic dataset of ANNO_LOADTEST_ROWS rows and the project `loadtest`, which
+are created on first start and reused afterwards. Run it with the dev server
+
+    python benchmarks/stub_server.py
+
+or, like in production, with gunicorn from the repository root:
+
+    gunicorn --config src/gunicorn.conf.py --pythonpath src,benchmarks stub_server:server
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import datasets
+import fake_encoder
+import synthetic
+
+WORKSPACE = os.path.abspath(os.environ.get('ANNO_LOADTEST_DIR', './loadtest_workspace'))
+ROWS = int(os.environ.get('ANNO_LOADTEST_ROWS', 100000))
+PROJECT = 'loadtest'
+LABELS = ['positive', 'negative', 'neutral', 'off-topic']
+
+
+def prepare(rows=ROWS):
+    """Creates the dataset and the project in the current directory, if they
+    don't exist yet."""
+    for path in (datasets.DATA_PATH, datasets.FAISS_PATH, datasets.EMBEDDINGS_PATH):
+        os.makedirs(path, exist_ok=True)
+    name = f'loadtest{rows}'
+    if not datasets.check_name_exists(name):
+        print(f'creating dataset {name}')
+        datasets.create_dataset(
+            synthetic.tweets(rows), name, 'synthetic tweets', 'text',
+            encoder=fake_encoder.BACKEND)
+    project = datasets.load_meta_file('projects_meta.yaml').get(PROJECT)
+    if project is None:
+        datasets.create_project(name, PROJECT)
+        datasets.save_labels(PROJECT, LABELS)
+    elif project['dataset'] != name:
+        raise SystemExit(
+            f'{WORKSPACE} has a project for another dataset size, use a new ANNO_LOADTEST_DIR')
+
+
+fake_encoder.register()
+os.makedirs(WORKSPACE, exist_ok=True)
+os.chdir(WORKSPACE)
+prepare()
+
+from index import app
+
+server = app.server
+
+if __name__ == '__main__':
+    app.run_server(port=int(os.environ.get('ANNO_LOADTEST_PORT', 8050)), threaded=True)
@@ -0,0 +1,102 @@
+"""Synthetic tweet-like datasets for the benchmarks.
+
+The texts are short, have a skewed word distribution, hashtags, mentions,
+links and retweets, so that tokenizing, deduplication and search behave
+roughly like they do on real social media data. Every row belongs to one of
+`TOPICS` topics, which favours a part of the vocabulary, so the data also has
+some cluster structure. The same seed always gives the same dataset.
+"""
+import numpy as np
+import pandas as pd
+
+VOCABULARY_SIZE = 20000
+TOPICS = 8
+# share of the words of a text drawn from the vocabulary of its topic
+TOPIC_SHARE = 0.5
+MIN_WORDS = 4
+MAX_WORDS = 30
+RETWEET_SHARE = 0.05
+HASHTAG_SHARE = 0.3
+MENTION_SHARE = 0.2
+LINK_SHARE = 0.1
+SYLLABLES = [
+    'ka', 'lo', 'mi', 're', 'su', 'ten', 'da', 'vo', 'ni', 'ber', 'sha', 'pol',
+    'qu', 'xi', 'ran', 'ge', 'fu', 'tor', 'wi', 'zen', 'el', 'an', 'us', 'or',
+]
+
+
+def vocabulary(size=VOCABULARY_SIZE, seed=0):
+    """Pronounceable, unique made-up words."""
+    rng = np.random.default_rng(seed)
+    words, seen = [], set()
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES, rng.integers(1, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return np.array(words)
+
+
+def zipf_ranks(rng, n, size, exponent=1.1):
+    """`n` word ranks below `size`, with a Zipf-like distribution."""
+    return (rng.zipf(exponent, n) - 1) % size
+
+
+def tweets(n_rows, seed=0):
+    """Creates a dataframe with `n_rows` synthetic tweets.
+
+    Args:
+        n_rows: number of rows
+        seed: seed of the random generator
+
+    Returns:
+        pandas dataframe with the columns `text`, `topic` and `user`.
+    """
+    rng = np.random.default_rng(seed)
+    words = vocabulary()
+    users = np.array([f'user{i}' for i in range(max(n_rows // 20, 10))])
+    topics = rng.integers(0, TOPICS, n_rows)
+    lengths = rng.integers(MIN_WORDS, MAX_WORDS + 1, n_rows)
+    n_words = int(lengths.sum())
+    ranks = zipf_ranks(rng, n_words, VOCABULARY_SIZE)
+    # words of the topic are a shifted window of the vocabulary
+    word_topics = np.repeat(topics, lengths)
+    topic_words = rng.random(n_words) < TOPIC_SHARE
+    shift = word_topics * (VOCABULARY_SIZE // TOPICS)
+    ranks[topic_words] = (ranks[topic_words] % (VOCABULARY_SIZE // TOPICS) + shift[topic_words])
+    tokens = words[ranks]
+    ends = np.cumsum(lengths)
+    texts = [' '.join(tokens[end - length:end]) for end, length in zip(ends, lengths)]
+
+    extras = rng.random((n_rows, 3))
+    mentions = users[rng.integers(0, len(users), n_rows)]
+    hashtags = words[zipf_ranks(rng, n_rows, VOCABULARY_SIZE)]
+    links = rng.integers(0, 16**6, n_rows)
+    for i in range(n_rows):
+        text = texts[i]
+        if extras[i, 0] < MENTION_SHARE:
+            text = f'@{mentions[i]} {text}'
+        if extras[i, 1] < HASHTAG_SHARE:
+            text = f'{text} #{hashtags[i]}'
+        if extras[i, 2] < LINK_SHARE:
+            text = f'{text} https://t.co/{links[i]:06x}'
+        texts[i] = text
+    # retweets repeat an earlier text, which gives exact and near-duplicates
+    retweets = np.flatnonzero(rng.random(n_rows) < RETWEET_SHARE)
+    retweets = retweets[retweets > 0]
+    originals = (rng.random(len(retweets)) * retweets).astype(int)
+    for row, original in zip(retweets, originals):
+        texts[row] = f'RT @{users[row % len(users)]}: {texts[original]}'
+    return pd.DataFrame({
+        'text': texts,
+        'topic': [f'topic{topic}' for topic in topics],
+        'user': users[rng.integers(0, len(users), n_rows)],
+    })
+
+
+def queries(n_queries, seed=1):
+    """Short search queries with words from the same vocabulary."""
+    rng = np.random.default_rng(seed)
+    words = vocabulary()
+    lengths = rng.integers(1, 6, n_queries)
+    return [' '.join(words[zipf_ranks(rng, length, VOCABULARY_SIZE)]) for length in lengths]
@@ -0,0 +1,189 @@
+"""Ranking of unlabeled rows for the annotation queue.
+
+The queue suggests the rows whose label would be most valuable next. A simple
+nearest centroid classifier on the sentence embeddings gives the uncertainty of
+every unlabeled row, the most uncertain candidates are then picked greedily so
+that they are also far from each other and from the labels that already exist
+(k-center greedy).
+The ranking is computed for a whole batch at once and cached per project and
+annotator, so clicking through the queue does not recompute anything.
+"""
+import numpy as np
+
+import datasets
+import memory
+
+QUEUE_SIZE = 50
+# number of uncertain candidates per queue slot from which the diverse subset
+# is picked
+CANDIDATE_FACTOR = 10
+# weight of the uncertainty against the diversity in the greedy selection
+UNCERTAINTY_WEIGHT = 0.5
+# sharpness of the softmax over the centroid similarities
+TEMPERATURE = 20
+BATCH_SIZE = 65536
+# bytes of a cached (row, score) tuple, for the memory accounting
+QUEUE_ENTRY_BYTES = 120
+
+# (project, annotator) -> (version of the candidates, ranking)
+_queue_cache = {}
+
+
+def labeled_mask(labels):
+    """Boolean array marking rows with a label. Missing labels may be `None` or
+    NaN, depending on whether they come from a datatable or a csv file."""
+    return np.array([isinstance(lbl, str) and lbl != '' for lbl in labels], dtype=bool)
+
+
+def label_centroids(embeddings, labels):
+    """Computes the normalized mean embedding of every label.
+
+    Args:
+        embeddings: embeddings of all rows of the dataset
+        labels: array with the label of every row, `None` for unlabeled rows
+
+    Returns:
+        list of label names and an array with one centroid per label.
+    """
+    classes = sorted(set(labels[labeled_mask(labels)]))
+    centroids = np.zeros((len(classes), embeddings.shape[1]), dtype='float32')
+    for i, lbl in enumerate(classes):
+        centroids[i] = np.asarray(
+            embeddings[np.flatnonzero(labels == lbl)], dtype='float32').mean(axis=0)
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return classes, centroids / norms
+
+
+def uncertainty(similarities, measure='margin'):
+    """Uncertainty of the classifier for every row.
+
+    Args:
+        similarities: cosine similarities of the rows to the label centroids
+        measure: 'margin' (1 - difference of the two most likely labels) or
+            'entropy' (normalized entropy of the label distribution)
+
+    Returns:
+        array with values between 0 (certain) and 1 (uncertain)
+    """
+    if similarities.shape[1] < 2:
+        return np.ones(similarities.shape[0], dtype='float32')
+    logits = similarities * TEMPERATURE
+    probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+    probs /= probs.sum(axis=1, keepdims=True)
+    if measure == 'entropy':
+        entropy = -(probs * np.log(np.clip(probs, 1e-12, None))).sum(axis=1)
+        return entropy / np.log(probs.shape[1])
+    top_two = np.partition(probs, -2, axis=1)[:, -2:]
+    return 1 - (top_two[:, 1] - top_two[:, 0])
+
+
+def k_center_greedy(candidates, scores, centers, size):
+    """Picks `size` rows that are uncertain and spread over the embedding space.
+
+    Args:
+        candidates: embeddings of the candidate rows
+        scores: uncertainty of the candidate rows
+        centers: embeddings the candidates should be far from (e.g. centroids)
+        size: number of rows to pick
+
+    Returns:
+        positions of the picked rows in `candidates`, in the order of picking.
+    """
+    if len(centers):
+        min_dist = (1 - candidates @ centers.T).min(axis=1) / 2
+    else:
+        min_dist = np.ones(len(candidates), dtype='float32')
+    picked = []
+    for _ in range(min(size, len(candidates))):
+        combined = UNCERTAINTY_WEIGHT * scores + (1 - UNCERTAINTY_WEIGHT) * min_dist
+        combined[picked] = -np.inf
+        best = int(np.argmax(combined))
+        picked.append(best)
+        min_dist = np.minimum(min_dist, (1 - candidates @ candidates[best]) / 2)
+    return picked
+
+
+def rank_rows(embeddings, labels, size=QUEUE_SIZE, measure='margin', candidates=None):
+    """Ranks the unlabeled rows of a dataset for annotation.
+
+    Args:
+        embeddings: embeddings of all rows of the dataset
+        labels: array with the label of every row, `None` for unlabeled rows
+        size: length of the queue
+        measure: uncertainty measure, see `uncertainty`
+        candidates: optional boolean array marking the rows that may be
+            ranked, e.g. the working set of the project
+
+    Returns:
+        list of (row position, uncertainty) tuples, best first.
+    """
+    classes, centroids = label_centroids(embeddings, labels)
+    unlabeled = ~labeled_mask(labels)
+    if candidates is not None:
+        unlabeled &= candidates
+    unlabeled = np.flatnonzero(unlabeled)
+    scores = np.empty(len(unlabeled), dtype='float32')
+    for start in range(0, len(unlabeled), BATCH_SIZE):
+        batch = unlabeled[start:start + BATCH_SIZE]
+        scores[start:start + BATCH_SIZE] = uncertainty(
+            np.asarray(embeddings[batch], dtype='float32') @ centroids.T, measure)
+    n_candidates = min(size * CANDIDATE_FACTOR, len(unlabeled))
+    if n_candidates < len(unlabeled):
+        top = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+    else:
+        top = np.arange(len(unlabeled))
+    candidates = np.asarray(embeddings[unlabeled[top]], dtype='float32')
+    picked = k_center_greedy(candidates, scores[top], centroids, size)
+    return [(int(unlabeled[top[i]]), float(scores[top[i]])) for i in picked]
+
+
+def candidates_version(candidates):
+    """Identifies a set of candidate rows, `None` for all rows."""
+    if candidates is None:
+        return None
+    return hash(np.packbits(np.asarray(candidates, dtype=bool)).tobytes())
+
+
+def get_queue(
+        project_name, dataset_name, labels, refresh=False, candidates=None, annotator=None):
+    """Returns the annotation queue of a project.
+
+    The ranking is only computed if there is none cached for the project and
+    annotator, if the candidates changed (e.g. a new working set) or if a
+    refresh is requested. Rows that were labeled since the ranking was computed
+    are filtered out.
+
+    Args:
+        project_name: name of the project
+        dataset_name: name of the dataset of the project
+        labels: current label of every row, `None` for unlabeled rows
+        refresh: whether to recompute the ranking
+        candidates: optional boolean array marking the rows that may be
+            queued
+        annotator: annotator whose labels `labels` are, `None` for the final
+            labels
+
+    Returns:
+        list of (row position, uncertainty) tuples, best first.
+    """
+    labels = np.asarray(labels, dtype=object)
+    key = (project_name, annotator)
+    version = candidates_version(candidates)
+    if refresh or key not in _queue_cache or _queue_cache[key][0] != version:
+        embeddings = datasets.load_embeddings(dataset_name)
+        _queue_cache[key] = (version, rank_rows(embeddings, labels, candidates=candidates))
+    labeled = labeled_mask(labels)
+    return [(row, score) for row, score in _queue_cache[key][1] if not labeled[row]]
+
+
+def invalidate(project_name):
+    """Removes the cached queues of a project, e.g. after its labels were saved."""
+    for key in [key for key in list(_queue_cache) if key[0] == project_name]:
+        _queue_cache.pop(key, None)
+
+
+memory.register('queues', lambda: {
+    key: len(queue) * QUEUE_ENTRY_BYTES
+    for key, (_, queue) in list(_queue_cache.items())},
+    lambda key: _queue_cache.pop(key, None))
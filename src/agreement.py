@@ -0,0 +1,167 @@
+"""Agreement between the annotators of a project.
+
+Every annotator of a project has their own label column in the project file
+(see `datasets.annotator_column`). The labels of all annotators are turned
+into one matrix of label codes (rows x annotators, -1 for no label), and all
+metrics are computed from it with numpy, without a loop over the rows:
+- Cohen's kappa for every pair of annotators, on the rows both labeled
+- Fleiss' kappa over all annotators, on the rows with at least two labels
+- the disagreement of every row, one minus the share of agreeing pairs of
+  labels
+The results are cached per project until the project is saved again.
+Rows on which the annotators disagree, and which have no final label yet, make
+up the adjudication queue, most disputed first.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+import datasets
+from active_learning import labeled_mask
+
+_cache = {}
+
+
+def label_matrix(columns, project_name, annotators):
+    """Codes of the labels of all annotators.
+
+    Args:
+        columns: dataframe of `datasets.load_project_columns`
+        project_name: name of the project
+        annotators: ids of the annotators
+
+    Returns:
+        int array of shape (rows, annotators) with the position of every label
+        in the categories, -1 for rows without label, and the categories.
+    """
+    labels = np.column_stack([
+        columns[datasets.annotator_column(project_name, annotator)].to_numpy(dtype=object)
+        if datasets.annotator_column(project_name, annotator) in columns
+        else np.full(len(columns), None, dtype=object)
+        for annotator in annotators
+    ]) if annotators else np.empty((len(columns), 0), dtype=object)
+    missing = pd.isna(labels)
+    categories, codes = np.unique(labels[~missing].astype(str), return_inverse=True)
+    matrix = np.full(labels.shape, -1, dtype=np.int64)
+    matrix[~missing] = codes
+    return matrix, categories
+
+
+def category_counts(matrix, n_categories):
+    """Number of labels of every category per row, shape (rows, categories)."""
+    rows, annotators = np.nonzero(matrix >= 0)
+    return np.bincount(
+        rows * n_categories + matrix[rows, annotators],
+        minlength=len(matrix) * n_categories
+    ).reshape(len(matrix), n_categories)
+
+
+def cohen_kappa(first, second, n_categories):
+    """Cohen's kappa of two annotators on the rows both of them labeled."""
+    both = (first >= 0) & (second >= 0)
+    if not both.any():
+        return np.nan
+    confusion = np.bincount(
+        first[both] * n_categories + second[both], minlength=n_categories**2
+    ).reshape(n_categories, n_categories) / both.sum()
+    observed = np.trace(confusion)
+    expected = confusion.sum(axis=1) @ confusion.sum(axis=0)
+    if expected == 1:
+        return np.nan
+    return (observed - expected) / (1 - expected)
+
+
+def pairwise_cohen_kappa(matrix, n_categories):
+    """Cohen's kappa of all pairs of annotators, NaN on the diagonal."""
+    n_annotators = matrix.shape[1]
+    kappas = np.full((n_annotators, n_annotators), np.nan)
+    for first in range(n_annotators):
+        for second in range(first + 1, n_annotators):
+            kappas[first, second] = kappas[second, first] = cohen_kappa(
+                matrix[:, first], matrix[:, second], n_categories)
+    return kappas
+
+
+def row_agreement(counts):
+    """Share of agreeing pairs among the labels of every row, NaN for rows
+    with less than two labels."""
+    n_labels = counts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        agreement = ((counts**2).sum(axis=1) - n_labels) / (n_labels * (n_labels - 1))
+    agreement[n_labels < 2] = np.nan
+    return agreement
+
+
+def fleiss_kappa(counts):
+    """Fleiss' kappa on the rows with at least two labels. The number of labels
+    may differ between rows."""
+    rated = counts.sum(axis=1) >= 2
+    if not rated.any():
+        return np.nan
+    observed = np.nanmean(row_agreement(counts[rated]))
+    shares = counts[rated].sum(axis=0) / counts[rated].sum()
+    expected = (shares**2).sum()
+    if expected == 1:
+        return np.nan
+    return (observed - expected) / (1 - expected)
+
+
+def project_agreement(project_name, dataset_name):
+    """Agreement of the annotators of a project, cached until the next save.
+
+    Args:
+        project_name: name of the project
+        dataset_name: name of the dataset of the project
+
+    Returns:
+        dict with the `annotators`, the label `categories`, the `fleiss` kappa,
+        the pairwise `cohen` kappas, the `disagreement` of every row (NaN with
+        less than two labels), the `majority` label of every row, the number
+        of `rated` rows (at least two labels) and the `final` labels.
+    """
+    project_file = datasets.project_file(project_name)
+    version = os.path.getmtime(project_file) if os.path.isfile(project_file) else None
+    if project_name in _cache and _cache[project_name][0] == version:
+        return _cache[project_name][1]
+    annotators = datasets.project_annotators(project_name)
+    columns = datasets.load_project_columns(project_name, dataset_name)
+    matrix, categories = label_matrix(columns, project_name, annotators)
+    counts = category_counts(matrix, len(categories))
+    labeled = counts.sum(axis=1) > 0
+    majority = np.full(len(matrix), None, dtype=object)
+    if len(categories):
+        majority[labeled] = categories[counts[labeled].argmax(axis=1)]
+    result = {
+        'annotators': annotators,
+        'categories': categories,
+        'fleiss': fleiss_kappa(counts),
+        'cohen': pairwise_cohen_kappa(matrix, len(categories)),
+        'disagreement': 1 - row_agreement(counts),
+        'majority': majority,
+        'rated': int((counts.sum(axis=1) >= 2).sum()),
+        'final': columns[f'{project_name}_label'].to_numpy(dtype=object),
+    }
+    _cache[project_name] = (version, result)
+    return result
+
+
+def adjudication_queue(project_name, dataset_name, final_labels=None):
+    """Rows on which the annotators disagree and that have no final label.
+
+    Args:
+        project_name: name of the project
+        dataset_name: name of the dataset of the project
+        final_labels: current final labels, e.g. from the table, the stored
+            ones if not given
+
+    Returns:
+        list of (row position, disagreement) tuples, most disputed first.
+    """
+    result = project_agreement(project_name, dataset_name)
+    if final_labels is None:
+        final_labels = result['final']
+    disputed = np.nan_to_num(result['disagreement']) > 0
+    disputed &= ~labeled_mask(final_labels)
+    rows = np.flatnonzero(disputed)
+    rows = rows[np.argsort(-result['disagreement'][rows], kind='stable')]
+    return [(row, result['disagreement'][row]) for row in rows]
@@ -4,6 +4,14 @@ giving suggestions for similar text units.
 import dash
 import dash_bootstrap_components as dbc
 
+import instrumentation
+import memory
+import export
+
 app = dash.Dash(external_stylesheets=[dbc.themes.JOURNAL, dbc.icons.BOOTSTRAP],
                 suppress_callback_exceptions=True
                 )
+# before any callback is registered, so that all of them are timed
+instrumentation.instrument(app)
+memory.instrument(app.server)
+export.register(app.server)
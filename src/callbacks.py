@@ -11,6 +11,7 @@ from dash.dependencies import Input, Output, State, ALL
 from dash import html
 import dash_bootstrap_components as dbc
 
+import active_learning
 import datasets
 import open_modal
 from layout import label_list_header
@@ -55,10 +56,12 @@ def save_data(n_clicks, current_table_data, clean_bit, label_list, current_datas
     datasets.update_project_columns(
         current_table_data,
         current_dataset['project_name'],
-        current_dataset['dataset_name']
+        current_dataset['dataset_name'],
+        current_dataset.get('annotator')
     )
     labels =[label['props']['id']['label'] for label in label_list[1:]]
     datasets.save_labels(current_dataset['project_name'], labels)
+    active_learning.invalidate(current_dataset['project_name'])
     return clean_bit + 1
 
 
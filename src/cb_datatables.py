@@ -1,6 +1,7 @@
 """Callbacks regarding the data tables
 """
 
+import numpy as np
 import pandas as pd
 from app import app
 import dash
@@ -9,6 +10,9 @@ from dash import dash_table
 import dash.html as html
 
 import datasets
+import sampling
+from active_learning import labeled_mask
+from layout import suggestion_controls
 # TODO: find a better place for these kind of settings.
 SIMILARITY_SEARCH_RESULTS = 10
 
@@ -36,13 +40,15 @@ def refresh_datatable(current_dataset):
     """
     if not dash.callback_context.triggered[0]['value']:
         raise dash.exceptions.PreventUpdate
-    header = html.Div(
-        f'Text data of {current_dataset["project_name"]} ',
-        id="arg-list-header"
-    )
-    df = pd.DataFrame(current_dataset['data'])
-    label_name = f'{current_dataset["project_name"]}_label'
-    labels = [lbl for lbl in df[label_name].unique() if lbl]
+    header_text = f'Text data of {current_dataset["project_name"]} '
+    if current_dataset.get('annotator'):
+        header_text += f'(annotator {current_dataset["annotator"]}) '
+    header = html.Div(header_text, id="arg-list-header")
+    labels = current_dataset.get('labels')
+    if labels is None:
+        df = pd.DataFrame(current_dataset['data'])
+        label_name = f'{current_dataset["project_name"]}_label'
+        labels = [lbl for lbl in df[label_name].unique() if lbl]
     columns = [
         {'name': 'Argument', 'id': current_dataset['text_column']},
         {'name': 'Label', 'id': f'{current_dataset["project_name"]}_label',
@@ -102,7 +108,7 @@ def refresh_datatable(current_dataset):
             }
         ]
     )
-    return [header, table, dirty_bit], [algo_header, algo_table]
+    return [header, table, dirty_bit], [algo_header, suggestion_controls, algo_table]
 
 
 @app.callback(
@@ -145,18 +151,25 @@ def update_dropdown_options(label_list, current_dataset):
     Input('arg-table', 'dropdown'),
     Input('arg-table', 'data'),
     Input('algo-table', 'data'),
+    Input('label-delta', 'data'),
+    Input('search-input', 'n_submit'),
     State('current_dataset', 'data'),
     State('dirty-bit', 'data-changed'),
+    State('suggest-hide-labeled', 'value'),
+    State('suggest-threshold', 'value'),
+    State('search-input', 'value'),
 )
 def handle_input_table_change(
         active_cell, dropdown, arg_data,
-        algo_data, current_dataset, n_data_changes):
+        algo_data, label_delta, n_search, current_dataset, n_data_changes,
+        hide_labeled, threshold, search_query):
     """handle changes to input table.
     There are a few scenarios how the data for the algo
     table can change.First, another item is clicked. This changes the output of
     the detail box as well as the algorithm output. For the algorithm output,
     the similarity search is conducted and the data of the most similar items
-    is put into the algo-table.
+    is put into the algo-table. Depending on the suggestion controls, labeled
+    rows are left out and only rows above a minimum similarity are shown.
     Second, a label is deleted and the dropdown options change. When this
     happens, the algo-table and the arg-table have to clear the dropdown value
     of all the items that have this label selected.
@@ -167,6 +180,11 @@ def handle_input_table_change(
     Fourth Case is when the entire table has to be changed due to a file Upload
     or due to loading a new dataset
     In this case, the data of the algo table has to change and rest needs to be reset.
+    Fifth, many rows were labeled at once on the server (label-delta), e.g. a
+    whole group of near duplicates. The change is already stored, so the tables
+    only have to show it.
+    Sixth, a search query was submitted. The algo-table then shows the best
+    matches of the hybrid keyword and semantic search.
     """
     if not dash.callback_context.triggered[0]['value']:
         raise dash.exceptions.PreventUpdate
@@ -178,7 +196,9 @@ def handle_input_table_change(
             arg_data,
             current_dataset['text_column'],
             current_dataset['dataset_name'],
-            SIMILARITY_SEARCH_RESULTS)
+            SIMILARITY_SEARCH_RESULTS,
+            f'{current_dataset["project_name"]}_label' if hide_labeled else None,
+            threshold)
         return arg_data, algo_table_data, n_data_changes
     # second case.
     elif trigger == 'arg-table.dropdown':
@@ -198,31 +218,116 @@ def handle_input_table_change(
             )
         else:
             return arg_data, algo_data, n_data_changes + 1
+    # fifth case.
+    elif trigger == 'label-delta.data':
+        new_arg_data, new_algo_data = apply_label_delta(
+            label_delta, arg_data, algo_data, current_dataset['project_name'])
+        return new_arg_data, new_algo_data, n_data_changes
+    # sixth case.
+    elif trigger == 'search-input.n_submit':
+        label_name = f'{current_dataset["project_name"]}_label'
+        ids = sampling.table_ids(arg_data)
+        rows = datasets.hybrid_search(
+            search_query or '',
+            current_dataset['dataset_name'],
+            SIMILARITY_SEARCH_RESULTS,
+            exclude=search_exclude(
+                ids, current_dataset['dataset_name'],
+                [row[label_name] for row in arg_data] if hide_labeled else None)
+        )
+        rows = sampling.table_rows(ids, rows)
+        return arg_data, [arg_data[row] for row in rows], n_data_changes
+
+
+def search_exclude(ids, dataset_name, labels=None):
+    """Rows of the dataset the suggestions leave out.
+
+    These are the rows that are not in the table (outside of the working set
+    of the project) and, if the labels of the table rows are given, the
+    labeled rows.
+
+    Args:
+        ids: ids of the rows of the table, see `sampling.table_ids`
+        dataset_name: name of the dataset
+        labels: labels of the rows of the table
+
+    Returns:
+        boolean array over the rows of the dataset, `None` if no row is left
+        out.
+    """
+    exclude = sampling.outside_mask(ids, dataset_name)
+    if labels is None:
+        return exclude
+    labeled = sampling.dataset_rows(ids, np.flatnonzero(labeled_mask(labels)))
+    if exclude is None:
+        exclude = np.zeros(len(labels), dtype=bool)
+    exclude[labeled] = True
+    return exclude
+
+
+def apply_label_delta(label_delta, arg_data, algo_data, project_name):
+    """Puts a label that was set on the server for many rows into the tables.
+
+    Args:
+        label_delta: dict with the dataset positions of the rows (`rows`) and
+            the `label`
+        arg_data: data from the arg table
+        algo_data: data from the algorithm table
+        project_name: name of the current project
+
+    Returns:
+        arg_data and algo_data with new label information
+    """
+    label_name = f'{project_name}_label'
+    rows = sampling.table_rows(sampling.table_ids(arg_data), label_delta['rows'])
+    for row in rows:
+        arg_data[row][label_name] = label_delta['label']
+    changed_ids = {arg_data[row]['id'] for row in rows}
+    for row in algo_data:
+        if row['id'] in changed_ids:
+            row[label_name] = label_delta['label']
+    return arg_data, algo_data
 
 
-def active_cell_change(active_cell, arg_data, text_column, search_index, SIMILARITY_SEARCH_RESULTS):
+def active_cell_change(
+        active_cell, arg_data, text_column, search_index, SIMILARITY_SEARCH_RESULTS,
+        label_name=None, threshold=None):
     """Provides similarity search and info data on cell click.
 
     When a text data from the arg-table is clicked, the similarity search is
     conducted and the argument info views is updated with the new data.
+    The clicked row itself is never part of the results.
 
     Args:
         active_cell: active cell object of the cell that was selected
         arg_data: data from the arg-table
         search_index: faiss index for similarity search
         SIMILARITY_SEARCH_RESULTS: number of similarity search results
+        label_name: if given, rows with a value in this column are left out
+        threshold: if given, the minimum similarity of the results
 
     Returns:
         The data for the similarity table
     """
     dff = pd.DataFrame(arg_data)
-    sentence_data = dff.iloc[active_cell['row_id']]
+    # the row id is the position of the row in the dataset, the table may only
+    # hold some rows of the dataset (see `sampling`)
+    ids = dff['id'].to_numpy(dtype=np.int64)
+    row = active_cell['row_id']
+    sentence_data = dff.iloc[sampling.table_rows(ids, [row])[0]]
     sentence = sentence_data[text_column]
+    exclude = search_exclude(ids, search_index, dff[label_name] if label_name else None)
+    if exclude is None:
+        exclude = np.zeros(len(dff), dtype=bool)
+    exclude[row] = True
     similarity_indices = datasets.search_faiss_with_string(
         sentence,
         search_index,
-        SIMILARITY_SEARCH_RESULTS
+        SIMILARITY_SEARCH_RESULTS,
+        exclude=exclude,
+        threshold=threshold
     )
+    similarity_indices = sampling.table_rows(ids, similarity_indices)
     similarity_table_data = dff.iloc[similarity_indices].to_dict('records')
     return similarity_table_data
 
@@ -246,7 +351,8 @@ def sync_dropdown_selection(arg_data, algo_data, trigger, active_cell, n_data_ch
     arg_df = pd.DataFrame(arg_data)
     algo_df = pd.DataFrame(algo_data)
     if trigger == 'arg-table.data':
-        algo_df = arg_df.iloc[algo_df['id']]
+        # by id, the table may only hold the working set of the project
+        algo_df = arg_df.iloc[pd.Index(arg_df['id']).get_indexer(algo_df['id'])]
     else:
         arg_df = arg_df.set_index('id')
         algo_df = algo_df.set_index('id')
@@ -6,6 +6,7 @@ import dash
 from dash.dependencies import Input, Output, State
 
 import datasets
+import sampling
 
 
 @app.callback(
@@ -74,8 +75,9 @@ def validate_dataset_upload(upload, filename):
     df = datasets.parse_contents(upload, filename)
     if df is not None:
         options = [{'label': key, 'value': key} for key in df.keys()]
+        stats = datasets.column_stats(df)
         label_options = [{
-            'label': f'{key} ({df[key].nunique()} unique items)',
+            'label': f'{key} ({stats[key]["unique"]} unique items)',
             'value': key}
             for key in df.keys()]
         return 'success', 'Dataset valid', df.to_dict('records'), False, options, label_options
@@ -83,6 +85,32 @@ def validate_dataset_upload(upload, filename):
         return 'danger', 'File was not readable', {}, True, [], []
 
 
+@app.callback(
+    Output('append-text', 'children'),
+    Output('append-text', 'color'),
+    Output('append-spinner', 'children'),
+    Input('append-dataset-btn', 'n_clicks'),
+    State('append-dataset-dd', 'value'),
+    State('append-file-input', 'contents'),
+    State('append-file-input', 'filename'),
+)
+def append_dataset(n_clicks, dataset, upload, filename):
+    """appends the rows of an uploaded file to an existing dataset"""
+    if not dash.callback_context.triggered[0]['value']:
+        raise dash.exceptions.PreventUpdate
+    if not dataset or not upload:
+        return 'select a dataset and upload a file first', 'danger', 'Append rows!'
+    df = datasets.parse_contents(upload, filename)
+    if df is None:
+        return 'File was not readable', 'danger', 'Append rows!'
+    try:
+        n_rows = datasets.append_to_dataset(df.to_dict('records'), dataset)
+    except KeyError as e:
+        return f'File does not fit the dataset: {e}', 'danger', 'Append rows!'
+    return (f'{n_rows} rows appended to {dataset}. Open projects again to see them.',
+            'success', 'Append rows!')
+
+
 @app.callback(
     Output('add-validator', 'data-upload-valid'),
     Output('submit-text', 'children'),
@@ -130,10 +158,15 @@ def validate_add_dataset(
     State('create-proj-name', 'valid'),
     State('create-project-label-checkbox', 'value'),
     State('create-project-label-selection-dd', 'value'),
-    State('create-project-dd', 'value')
+    State('create-project-dd', 'value'),
+    State('create-sample-method-dd', 'value'),
+    State('create-sample-size', 'value'),
+    State('create-sample-column-dd', 'value')
 
 )
-def validate_create_project(n_clicks, name_valid, label_checked, label_selection, proj_selection):
+def validate_create_project(
+        n_clicks, name_valid, label_checked, label_selection, proj_selection,
+        sample_method, sample_size, sample_column):
     """validates all inputs for the creation of a new project and displays error
     message if something is missing or not valid."""
     if not dash.callback_context.triggered[0]['value']:
@@ -143,6 +176,16 @@ def validate_create_project(n_clicks, name_valid, label_checked, label_selection
     if label_checked:
         validators.append(label_selection)
         invalid_item_names.append('Label Selection')
+    if sample_method and sample_method != 'all':
+        try:
+            sampling.parse_size(sample_size, 1)
+            validators.append(True)
+        except (TypeError, ValueError):
+            validators.append(False)
+        invalid_item_names.append('Sample size')
+        if sample_method == 'stratified':
+            validators.append(sample_column)
+            invalid_item_names.append('Sample column')
     if all(validators):
         return True, 'success', 'success'
     else:
@@ -200,15 +243,18 @@ def validate_ds_project_name(name):
 
 @app.callback(
     Output('create-project-label-selection-dd', 'options'),
+    Output('create-sample-column-dd', 'options'),
     Input('create-project-dd', 'value')
 )
 def get_label_options(dataset):
-    """populates dropdown for labels to pick from dataset as labels for new project"""
+    """populates the dropdowns for labels to pick from dataset as labels for new
+    project and for the column to stratify a sample by"""
     if not dash.callback_context.triggered[0]['value']:
         raise dash.exceptions.PreventUpdate
 
     columns = datasets.get_dataset_labels(dataset)
-    return [{'label': f'{key[0]} ({key[1]} unique items)', 'value': key[0]} for key in columns]
+    options = [{'label': f'{key[0]} ({key[1]} unique items)', 'value': key[0]} for key in columns]
+    return options, options
 
 
 @app.callback(
@@ -274,6 +320,8 @@ def check_project_creation_input(checked):
     State('ds-text-unit-dd', 'value'),
     State('ds-project-label-selection-dd', 'value'),
     State('ds-project-label-checkbox', 'value'),
+    State('ds-index-type-dd', 'value'),
+    State('ds-encoder-dd', 'value'),
 
     State('new-ds-proj-name', 'value'),
     State('ds-project-checkbox', 'value'),
@@ -283,17 +331,22 @@ def check_project_creation_input(checked):
     State('create-proj-name', 'valid'),
     State('create-project-label-checkbox', 'value'),
     State('create-project-label-selection-dd', 'value'),
+    State('create-sample-method-dd', 'value'),
+    State('create-sample-size', 'value'),
+    State('create-sample-column-dd', 'value'),
 
-    State('open-project-dd', 'value')
+    State('open-project-dd', 'value'),
+    State('open-annotator-input', 'value')
 )
 def finalize_data_dialogue(
         add_valid, create_valid, open_button, close_button,
         new_data, current_dataset,
         ds_name, ds_description, ds_text_unit_selection, ds_label_selection, label_checked,
-        ds_project_name, ds_project_name_checked,
+        ds_index_type, ds_encoder, ds_project_name, ds_project_name_checked,
         create_proj_dd_selection, create_project_name, create_project_name_valid,
         create_label_checked, create_proj_label_selection,
-        open_project_dd_selection):
+        create_sample_method, create_sample_size, create_sample_column,
+        open_project_dd_selection, open_annotator):
     """Creates Dataset (and project, if checked) or closes dialogue.
 
     First it is checked which button trigger the function. If it's the close
@@ -315,24 +368,26 @@ def finalize_data_dialogue(
         return add_dataset_cb(
             new_data, ds_project_name_checked,
             ds_name, ds_text_unit_selection, ds_label_selection if label_checked else False,
-            ds_description, ds_project_name, current_dataset
+            ds_description, ds_project_name, current_dataset, ds_index_type, ds_encoder
         )
     elif trigger == 'create-validator':
         return create_project_cb(
             create_project_name_valid, create_proj_dd_selection,
             create_project_name, current_dataset,
-            create_proj_label_selection if create_label_checked else False
+            create_proj_label_selection if create_label_checked else False,
+            create_sample_method, create_sample_size, create_sample_column
         )
     elif trigger == 'open-project-btn':
         if open_project_dd_selection:
-            return open_project_cb(open_project_dd_selection)
+            return open_project_cb(open_project_dd_selection, open_annotator)
         else:
             return True, current_dataset
 
 
 def create_project_cb(
         create_project_name_valid, create_proj_dd_selection,
-        create_project_name, current_dataset, label_column):
+        create_project_name, current_dataset, label_column,
+        sample_method=None, sample_size=None, sample_column=None):
     """callback for the create Project Button.
 
     Args:
@@ -340,7 +395,11 @@ def create_project_cb(
         create_proj_dd_selection: selected dataset for project creation
         create_project_name: name for new project
         current_dataset: currently loaded datasets
-        n_dataset_loads: number of datasets loads so far
+        label_column: dataset column with initial labels, or False
+        sample_method: restrict the project to a sample of the dataset, one of
+            `sampling.SAMPLE_METHODS` ('all' or None for all rows)
+        sample_size: size of the sample, see `sampling.parse_size`
+        sample_column: column to stratify the sample by
 
     Returns:
         The info about whether the Modal should
@@ -352,6 +411,12 @@ def create_project_cb(
             create_project_name,
             label_column
         )
+        if sample_method in sampling.SAMPLE_METHODS:
+            n_rows = datasets.load_meta_file('datasets_meta.yaml')[create_proj_dd_selection]['size']
+            sampling.create_sample(
+                create_project_name, sample_method,
+                sampling.parse_size(sample_size, n_rows), sample_column)
+            new_current_project, _, text_column = datasets.load_project(create_project_name)
         return False, {
             'dataset_name': create_proj_dd_selection,
             'project_name': create_project_name,
@@ -362,23 +427,32 @@ def create_project_cb(
         return True, current_dataset
 
 
-def open_project_cb(open_project_dd_selection):
+def open_project_cb(open_project_dd_selection, annotator=None):
     """Callback for the Open project button.
 
-    needs just the project that has to be opened
+    needs just the project that has to be opened. With an annotator id, the
+    labels of that annotator are shown and saved, otherwise the final labels of
+    the project.
 
     Args:
         open_project_dd_selection: project to open (from dropdown)
+        annotator: optional id of the annotator
 
     Returns:
         The info about whether the Modal should
         be closed and the updated current dataset
     """
-    new_current_project, dataset_name, text_column = datasets.load_project(open_project_dd_selection)
+    annotator = annotator.strip() if annotator else None
+    if annotator:
+        datasets.add_annotator(open_project_dd_selection, annotator)
+    new_current_project, dataset_name, text_column = datasets.load_project(
+        open_project_dd_selection, annotator)
     return False, {
         'dataset_name': dataset_name,
         'project_name': open_project_dd_selection,
+        'annotator': annotator,
         'text_column': text_column,
+        'labels': datasets.project_labels(open_project_dd_selection, annotator),
         'data': new_current_project.to_dict('records')
     }
 
@@ -386,13 +460,15 @@ def open_project_cb(open_project_dd_selection):
 def add_dataset_cb(
         new_data, project_name_checked, dataset_name,
         text_column, label_column, description,
-        project_name, current_dataset):
+        project_name, current_dataset, index_type='flat', encoder='torch'):
     """Callback for the add dataset button.
 
     The function assumes everything to be valid, since it can only be trigger if
     the validator is true.
     """
-    datasets.create_dataset(new_data, dataset_name, description, text_column)
+    datasets.create_dataset(
+        new_data, dataset_name, description, text_column,
+        index_type or 'flat', encoder or 'torch')
     if project_name_checked:
         new_current_project, text_column = datasets.create_project(dataset_name, project_name, label_column)
         return False, {
@@ -0,0 +1,393 @@
+"""Callbacks of the tools column next to the data tables.
+"""
+import re
+from collections import Counter
+from app import app
+import dash
+from dash.dependencies import Input, Output, State
+from dash import html
+
+import numpy as np
+
+import active_learning
+import agreement
+import datasets
+import embedding_map
+import propagation
+import rules
+import sampling
+
+
+@app.callback(
+    Output('queue-table', 'data'),
+    Input('btn-refresh-queue', 'n_clicks'),
+    Input('arg-table', 'data'),
+    Input('queue-kind', 'value'),
+    State('current_dataset', 'data'),
+)
+def update_queue(n_clicks, arg_data, queue_kind, current_dataset):
+    """Fills the queue of the next best rows to annotate.
+
+    The ranking itself is cached per project and annotator, so a change of
+    the arg-table data (e.g. a new label) only removes the rows that got
+    labeled from the queue. Only the refresh button, or another working set,
+    recomputes the ranking with the current labels.
+    The adjudication queue instead has the rows on which the annotators of the
+    project disagree, as of the last save, and that have no label in the table.
+
+    Args:
+        n_clicks: clicks of the refresh button
+        arg_data: data from the arg-table
+        queue_kind: `suggestions` or `disagreements`
+        current_dataset: current dataset info and data
+
+    Returns:
+        The data for the queue table.
+    """
+    if not dash.callback_context.triggered[0]['value'] or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    project_name = current_dataset['project_name']
+    dataset_name = current_dataset['dataset_name']
+    label_name = f'{project_name}_label'
+    ids = sampling.table_ids(arg_data)
+    labels = sampling.full_labels(ids, dataset_name, [row[label_name] for row in arg_data])
+    if queue_kind == 'disagreements':
+        # in the session of an annotator, the table has their labels, not the
+        # final ones, so the stored final labels are used
+        queue = agreement.adjudication_queue(
+            project_name, dataset_name,
+            None if current_dataset.get('annotator') else labels)
+    else:
+        outside = sampling.outside_mask(ids, dataset_name)
+        queue = active_learning.get_queue(
+            project_name,
+            dataset_name,
+            labels,
+            refresh=trigger == 'btn-refresh-queue',
+            candidates=None if outside is None else ~outside,
+            annotator=current_dataset.get('annotator')
+        )
+    # the queues hold dataset positions, which are the ids of the rows
+    scores = dict(queue)
+    rows = sampling.table_rows(ids, [row for row, _ in queue])
+    return [{
+        'id': arg_data[row]['id'],
+        'text': arg_data[row][current_dataset['text_column']],
+        'uncertainty': round(scores[arg_data[row]['id']], 3)
+    } for row in rows[:active_learning.QUEUE_SIZE]]
+
+
+@app.callback(
+    Output('arg-table', 'active_cell'),
+    Input('queue-table', 'active_cell'),
+    State('arg-table', 'derived_viewport_row_ids'),
+    State('current_dataset', 'data'),
+)
+def select_queue_row(active_cell, viewport_row_ids, current_dataset):
+    """Selects the clicked queue row in the arg-table.
+
+    This triggers the similarity search for the row, just like clicking it in
+    the arg-table itself, so it can be labeled together with its neighbours.
+    The cell is only highlighted if the row is on the visible page of the
+    arg-table, `row` is the position on that page.
+    """
+    if not active_cell or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    cell = {
+        'column': 0,
+        'column_id': current_dataset['text_column'],
+        'row_id': active_cell['row_id']
+    }
+    if active_cell['row_id'] in (viewport_row_ids or []):
+        cell['row'] = viewport_row_ids.index(active_cell['row_id'])
+    return cell
+
+
+@app.callback(
+    Output('propagation-result', 'children'),
+    Output('propagation-spinner', 'children'),
+    Input('btn-propagate', 'n_clicks'),
+    State('arg-table', 'data'),
+    State('current_dataset', 'data'),
+)
+def propagate_labels(n_clicks, arg_data, current_dataset):
+    """Spreads the current labels over the kNN graph of the dataset.
+
+    The predictions are stored in the dataset next to the labels of the
+    project, the tools column only shows how many rows got which label.
+    """
+    if not dash.callback_context.triggered[0]['value'] or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    label_name = f'{current_dataset["project_name"]}_label'
+    # all rows of the dataset are scored, also those outside of the working set
+    predictions, confidences = propagation.propagate_project(
+        current_dataset['project_name'],
+        current_dataset['dataset_name'],
+        sampling.full_labels(
+            sampling.table_ids(arg_data), current_dataset['dataset_name'],
+            [row[label_name] for row in arg_data])
+    )
+    counts = Counter(lbl for lbl in predictions if lbl)
+    if not counts:
+        return 'Label some rows first.', 'Propagate labels'
+    result = [html.Li(f'{lbl}: {count} rows') for lbl, count in counts.most_common()]
+    result.append(html.Li(f'mean confidence: {confidences[confidences > 0].mean():.2f}'))
+    return html.Ul(result), 'Propagate labels'
+
+
+@app.callback(
+    Output('agreement-info', 'children'),
+    Input('btn-agreement', 'n_clicks'),
+    Input('clean-bit', 'data-saved'),
+    State('current_dataset', 'data'),
+)
+def show_agreement(n_clicks, data_saved, current_dataset):
+    """Shows the agreement of the annotators of the project, as of the last
+    save."""
+    if not dash.callback_context.triggered[0]['value'] or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    result = agreement.project_agreement(
+        current_dataset['project_name'], current_dataset['dataset_name'])
+    annotators = result['annotators']
+    if len(annotators) < 2 or not result['rated']:
+        return 'Agreement needs labels of at least two annotators on the same rows.'
+    disputed = int((np.nan_to_num(result['disagreement']) > 0).sum())
+    items = [
+        html.Li(f'{len(annotators)} annotators, {result["rated"]} rows with 2+ labels'),
+        html.Li(f"Fleiss' kappa: {result['fleiss']:.3f}"),
+        html.Li(f'rows with disagreement: {disputed}'),
+    ]
+    for first in range(len(annotators)):
+        for second in range(first + 1, len(annotators)):
+            kappa = result['cohen'][first, second]
+            if not np.isnan(kappa):
+                items.append(html.Li(
+                    f"Cohen's kappa {annotators[first]} / {annotators[second]}: {kappa:.3f}"))
+    return html.Ul(items)
+
+
+@app.callback(
+    Output('cluster-label-dd', 'options'),
+    Output('rule-label-dd', 'options'),
+    Output('map-label-dd', 'options'),
+    Input('label-list', 'children'),
+)
+def update_tool_label_options(label_list):
+    """Offers the labels of the label list in the dropdowns of the tools."""
+    labels = [label['props']['id']['label'] for label in label_list[1:]]
+    options = [{'label': lbl, 'value': lbl} for lbl in labels]
+    return options, options, options
+
+
+@app.callback(
+    Output('map-modal', 'is_open'),
+    Input('btn-map', 'n_clicks'),
+)
+def open_map(n_clicks):
+    """Opens the embedding map, it is closed with the button of its header."""
+    if not dash.callback_context.triggered[0]['value']:
+        raise dash.exceptions.PreventUpdate
+    return True
+
+
+@app.callback(
+    Output('map-graph', 'figure'),
+    Output('map-view', 'data'),
+    Input('btn-map', 'n_clicks'),
+    Input('map-graph', 'relayoutData'),
+    Input('arg-table', 'data'),
+    State('map-view', 'data'),
+    State('map-modal', 'is_open'),
+    State('current_dataset', 'data'),
+)
+def update_map(n_clicks, relayout_data, arg_data, view, is_open, current_dataset):
+    """Draws the embedding map of the dataset, binned to the visible part.
+
+    Opening the map shows the whole dataset. Zooming or panning bins the
+    visible part again, and changed labels recolor the map while it is open.
+    The visible part is kept in the map-view store, since the relayout data
+    only has the last change.
+    """
+    if not dash.callback_context.triggered[0]['value'] or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == 'btn-map':
+        view = None
+    elif trigger == 'map-graph':
+        new_view = embedding_map.visible_range(relayout_data, view)
+        if new_view == embedding_map.visible_range(None, view):
+            raise dash.exceptions.PreventUpdate
+        view = new_view
+    elif not is_open:
+        raise dash.exceptions.PreventUpdate
+    label_name = f'{current_dataset["project_name"]}_label'
+    cells = embedding_map.bin_map(
+        table_map(current_dataset, arg_data), [row[label_name] for row in arg_data], view)
+    # a new revision on every opening, so that the zoom of the last time is reset
+    return embedding_map.map_figure(cells, f'{current_dataset["project_name"]}-{n_clicks}'), view
+
+
+def table_map(current_dataset, arg_data):
+    """The positions of the rows of the arg-table on the embedding map."""
+    projection = embedding_map.load_map(current_dataset['dataset_name'])
+    ids = sampling.table_ids(arg_data)
+    return projection if len(ids) == len(projection) else projection[ids]
+
+
+@app.callback(
+    Output('map-info', 'children'),
+    Input('map-graph', 'selectedData'),
+    State('arg-table', 'data'),
+    State('current_dataset', 'data'),
+)
+def show_map_selection(selected_data, arg_data, current_dataset):
+    """Shows how many rows are in the selected region of the map, and their
+    most frequent labels."""
+    if not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    rows = embedding_map.selected_rows(table_map(current_dataset, arg_data), selected_data)
+    if not len(rows):
+        return 'Draw a lasso around a region to select its rows.'
+    label_name = f'{current_dataset["project_name"]}_label'
+    labels = [arg_data[row][label_name] for row in rows]
+    labeled = active_learning.labeled_mask(labels)
+    counts = Counter(lbl for lbl, is_labeled in zip(labels, labeled) if is_labeled)
+    info = f'{len(rows)} rows selected, {len(rows) - int(labeled.sum())} of them unlabeled.'
+    if counts:
+        info += ' Labels: ' + ', '.join(f'{lbl} ({count})' for lbl, count in counts.most_common(5))
+    return info
+
+
+@app.callback(
+    Output('cluster-info', 'children'),
+    Input('arg-table', 'active_cell'),
+    State('arg-table', 'data'),
+    State('current_dataset', 'data'),
+)
+def show_cluster_info(active_cell, arg_data, current_dataset):
+    """Shows the size of the near-duplicate group of the selected row, within
+    the rows of the arg-table."""
+    if not active_cell or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    clusters = datasets.load_clusters(current_dataset['dataset_name'])
+    size = len(sampling.table_rows(
+        sampling.table_ids(arg_data),
+        np.flatnonzero(clusters == clusters[active_cell['row_id']])))
+    if size == 1:
+        return 'The selected row has no near duplicates.'
+    return f'The selected row is in a group of {size} near duplicates.'
+
+
+def find_rule_rows(current_dataset, arg_data, pattern, kind, case, overwrite):
+    """Evaluates a labeling rule on the text column of the current dataset.
+
+    The texts are read on the server, only the current labels come from the
+    arg-table, so that labels that are not saved yet are taken into account.
+    Only the rows of the arg-table are matched, the rows in the result are
+    dataset positions.
+    """
+    label_name = f'{current_dataset["project_name"]}_label'
+    texts = rules.load_texts(
+        f'{datasets.DATA_PATH}/{current_dataset["dataset_name"]}.csv',
+        current_dataset['text_column']
+    )
+    ids = sampling.table_ids(arg_data)
+    if len(ids) != len(texts):
+        texts = texts.iloc[ids].reset_index(drop=True)
+    labeled = active_learning.labeled_mask([row[label_name] for row in arg_data])
+    result = rules.rule_rows(texts, labeled, pattern, kind, case, overwrite)
+    result['rows'] = sampling.dataset_rows(ids, result['rows'])
+    return result
+
+
+@app.callback(
+    Output('rule-info', 'children'),
+    Input('btn-rule-preview', 'n_clicks'),
+    Input('label-delta', 'data'),
+    State('rule-pattern', 'value'),
+    State('rule-kind', 'value'),
+    State('rule-case', 'value'),
+    State('rule-overwrite', 'value'),
+    State('arg-table', 'data'),
+    State('current_dataset', 'data'),
+)
+def preview_rule(n_clicks, label_delta, pattern, kind, case, overwrite, arg_data, current_dataset):
+    """Shows how many rows a rule matches before it is applied, and how many
+    rows were labeled after it was applied."""
+    if not dash.callback_context.triggered[0]['value'] or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == 'label-delta':
+        return f'Labeled {len(label_delta["rows"])} rows as {label_delta["label"]}.'
+    if not pattern:
+        return 'Enter a pattern first.'
+    try:
+        result = find_rule_rows(current_dataset, arg_data, pattern, kind, case, overwrite)
+    except (re.error, ValueError) as error:
+        return f'Invalid pattern: {error}'
+    return (f'{result["matches"]} matching rows, {result["labeled"]} of them already '
+            f'labeled. Apply would label {len(result["rows"])} rows.')
+
+
+@app.callback(
+    Output('label-delta', 'data'),
+    Input('btn-label-cluster', 'n_clicks'),
+    Input('btn-rule-apply', 'n_clicks'),
+    Input('btn-label-map', 'n_clicks'),
+    State('arg-table', 'active_cell'),
+    State('cluster-label-dd', 'value'),
+    State('rule-pattern', 'value'),
+    State('rule-kind', 'value'),
+    State('rule-case', 'value'),
+    State('rule-overwrite', 'value'),
+    State('rule-label-dd', 'value'),
+    State('map-graph', 'selectedData'),
+    State('map-label-dd', 'value'),
+    State('arg-table', 'data'),
+    State('current_dataset', 'data'),
+)
+def apply_bulk_label(
+        cluster_clicks, rule_clicks, map_clicks, active_cell, cluster_label,
+        pattern, kind, case, overwrite, rule_label, map_selection, map_label,
+        arg_data, current_dataset):
+    """Labels many rows at once.
+
+    Either the whole near-duplicate group of the selected row, all rows that
+    match a labeling rule or the unlabeled rows in the selected region of the
+    embedding map get a label. The labels are written to the dataset in one go
+    on the server, the tables get the change through the label-delta store.
+    """
+    if not dash.callback_context.triggered[0]['value'] or not current_dataset:
+        raise dash.exceptions.PreventUpdate
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == 'btn-label-cluster':
+        if not active_cell or not cluster_label:
+            raise dash.exceptions.PreventUpdate
+        clusters = datasets.load_clusters(current_dataset['dataset_name'])
+        ids = sampling.table_ids(arg_data)
+        rows = sampling.dataset_rows(ids, sampling.table_rows(
+            ids, np.flatnonzero(clusters == clusters[active_cell['row_id']])))
+        label = cluster_label
+    elif trigger == 'btn-label-map':
+        if not map_label:
+            raise dash.exceptions.PreventUpdate
+        label_name = f'{current_dataset["project_name"]}_label'
+        rows = embedding_map.selected_rows(table_map(current_dataset, arg_data), map_selection)
+        rows = rows[~active_learning.labeled_mask([arg_data[row][label_name] for row in rows])]
+        if not len(rows):
+            raise dash.exceptions.PreventUpdate
+        rows = sampling.dataset_rows(sampling.table_ids(arg_data), rows)
+        label = map_label
+    else:
+        if not pattern or not rule_label:
+            raise dash.exceptions.PreventUpdate
+        try:
+            rows = find_rule_rows(current_dataset, arg_data, pattern, kind, case, overwrite)['rows']
+        except (re.error, ValueError):
+            raise dash.exceptions.PreventUpdate
+        label = rule_label
+    datasets.apply_label_delta(
+        current_dataset['dataset_name'], current_dataset['project_name'], rows, label,
+        current_dataset.get('annotator'))
+    return {'rows': rows.tolist(), 'label': label}
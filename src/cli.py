@@ -0,0 +1,182 @@
+"""Command line interface for the data management without the web app.
+
+Large files can be ingested from disk chunk by chunk, which is not limited by
+what a browser can upload, and long running jobs can run under cron or on
+other machines. Run it from the repository root, like the app, or point it to
+the folder with the data folders with `--workdir`:
+
+    python src/cli.py ingest tweets.csv tweets --text-column text --index-type sq8
+    python src/cli.py create-project tweets stance
+    python src/cli.py sample stance --method diverse --size 5%
+    python src/cli.py export stance stance_labels.parquet --labeled
+    python src/cli.py list
+
+See `python src/cli.py <command> --help` for the options of every command.
+"""
+import os
+import sys
+import argparse
+import pandas as pd
+
+import datasets
+import encoders
+import export
+import sampling
+
+
+def ingest(args):
+    if datasets.check_name_exists(args.name):
+        raise SystemExit(f'dataset {args.name} exists already')
+    rows = datasets.ingest_csv(
+        args.file, args.name, args.description or '', args.text_column, args.index_type,
+        args.encoder, args.chunk_size, sep=args.sep)
+    print(f'created dataset {args.name} with {rows} rows')
+    if args.project:
+        create_project(argparse.Namespace(
+            dataset=args.name, project=args.project, label_column=args.label_column))
+
+
+def append(args):
+    require_dataset(args.name)
+    rows = datasets.append_to_dataset(pd.read_csv(args.file, sep=args.sep), args.name)
+    print(f'appended {rows} rows to dataset {args.name}')
+
+
+def reindex(args):
+    require_dataset(args.name)
+    index_type = datasets.rebuild_index(args.name, args.index_type, args.encoder, args.chunk_size)
+    print(f'built a {index_type} index for dataset {args.name}')
+
+
+def create_project(args):
+    require_dataset(args.dataset)
+    if datasets.check_name_exists(args.project, False):
+        raise SystemExit(f'project {args.project} exists already')
+    datasets.create_project(args.dataset, args.project, args.label_column or False)
+    print(f'created project {args.project} on dataset {args.dataset}')
+
+
+def sample(args):
+    projects = datasets.load_meta_file('projects_meta.yaml') or {}
+    if args.project not in projects:
+        raise SystemExit(f'no project {args.project}')
+    if args.method == 'all':
+        sampling.remove_sample(args.project)
+        print(f'project {args.project} works on all rows again')
+        return
+    dataset_name = projects[args.project]['dataset']
+    n_rows = datasets.load_meta_file('datasets_meta.yaml')[dataset_name]['size']
+    try:
+        rows = sampling.create_sample(
+            args.project, args.method, sampling.parse_size(args.size, n_rows), args.column,
+            args.seed)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f'project {args.project} works on a {args.method} sample of {rows} rows')
+
+
+def export_data(args):
+    if not datasets.check_name_exists(args.project, False):
+        raise SystemExit(f'no project {args.project}')
+    try:
+        rows = export.export_project(
+            args.project, args.output, args.format, annotator=args.annotator,
+            labeled_only=args.labeled, min_confidence=args.min_confidence,
+            chunk_size=args.chunk_size)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f'exported {rows} rows of project {args.project} to {args.output}')
+
+
+def list_data(args):
+    for name, meta in (datasets.load_meta_file('datasets_meta.yaml') or {}).items():
+        print(f'dataset {name}: {meta["size"]} rows, text column {meta["text column"]}, '
+              f'{meta.get("index type", "flat")} index, {meta.get("encoder", "torch")} encoder')
+    for name, meta in (datasets.load_meta_file('projects_meta.yaml') or {}).items():
+        annotators = ', '.join(meta.get('annotators', [])) or 'none'
+        print(f'project {name}: dataset {meta["dataset"]}, annotators {annotators}')
+
+
+def require_dataset(name):
+    if not datasets.check_name_exists(name):
+        raise SystemExit(f'no dataset {name}')
+
+
+def parser():
+    main_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    main_parser.add_argument(
+        '--workdir', default='.', help='folder with the datasets and faiss_indexes folders')
+    commands = main_parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('ingest', help='create a dataset from a csv file')
+    command.add_argument('file')
+    command.add_argument('name', help='name of the new dataset')
+    command.add_argument('--text-column', required=True)
+    command.add_argument('--description')
+    command.add_argument('--index-type', choices=datasets.INDEX_TYPES, default='flat')
+    command.add_argument(
+        '--encoder', choices=list(encoders.BACKENDS), default=encoders.DEFAULT_BACKEND)
+    command.add_argument('--chunk-size', type=int, default=datasets.INGEST_CHUNK_SIZE)
+    command.add_argument('--sep', default=',', help='column separator of the file')
+    command.add_argument('--project', help='also create a project with this name')
+    command.add_argument('--label-column', help='column with labels for the project')
+    command.set_defaults(function=ingest)
+
+    command = commands.add_parser('append', help='append the rows of a csv file to a dataset')
+    command.add_argument('file')
+    command.add_argument('name', help='name of the dataset')
+    command.add_argument('--sep', default=',', help='column separator of the file')
+    command.set_defaults(function=append)
+
+    command = commands.add_parser(
+        'reindex', help='build the index of a dataset again, optionally with new embeddings')
+    command.add_argument('name', help='name of the dataset')
+    command.add_argument('--index-type', choices=datasets.INDEX_TYPES, default='flat')
+    command.add_argument(
+        '--encoder', choices=list(encoders.BACKENDS), help='encode all texts again first')
+    command.add_argument('--chunk-size', type=int, default=datasets.INGEST_CHUNK_SIZE)
+    command.set_defaults(function=reindex)
+
+    command = commands.add_parser('create-project', help='create a project on a dataset')
+    command.add_argument('dataset')
+    command.add_argument('project')
+    command.add_argument('--label-column', help='dataset column with initial labels')
+    command.set_defaults(function=create_project)
+
+    command = commands.add_parser(
+        'sample', help='restrict a project to a sample of the rows of its dataset')
+    command.add_argument('project')
+    command.add_argument(
+        '--method', choices=sampling.SAMPLE_METHODS + ['all'], default='random',
+        help='all removes the sample')
+    command.add_argument(
+        '--size', default='10%', help='number of rows, share (0.1) or percentage (10%%)')
+    command.add_argument('--column', help='column to stratify by')
+    command.add_argument('--seed', type=int, default=0)
+    command.set_defaults(function=sample)
+
+    command = commands.add_parser('export', help='export the labels of a project')
+    command.add_argument('project')
+    command.add_argument('output', help='csv, jsonl or parquet file')
+    command.add_argument(
+        '--format', choices=export.FORMATS, help='format of the file, from its suffix by default')
+    command.add_argument('--annotator', help='labels of this annotator instead of the final ones')
+    command.add_argument('--labeled', action='store_true', help='only rows with a label')
+    command.add_argument(
+        '--min-confidence', type=float, help='only rows with a prediction of higher confidence')
+    command.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE)
+    command.set_defaults(function=export_data)
+
+    command = commands.add_parser('list', help='list the datasets and projects')
+    command.set_defaults(function=list_data)
+    return main_parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    os.chdir(args.workdir)
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
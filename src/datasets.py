@@ -4,20 +4,96 @@ input data is more specific
 import os
 import base64
 import io
+import shutil
+import threading
+import functools
+import collections
+import copy
+import pickle
 import yaml
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-from sentence_transformers.models import Normalize
 import numpy as np
 import faiss
+import encoders
+import lexical
+import memory
+import storage
+import search_client
+import sharding
+from scipy import sparse
+from scipy.sparse import csgraph
 
-embedding_model = SentenceTransformer('paraphrase-mpnet-base-v2')
-
-model = SentenceTransformer(modules=[embedding_model, Normalize()])
+try:
+    # optional, the 2-D maps of the datasets are PCA projections without it
+    import umap
+except ImportError:
+    umap = None
 
 FAISS_PATH = './faiss_indexes'
 DATA_PATH = './datasets'
 EMBEDDINGS_PATH = './embeddings'
+# neighbours per row in the stored kNN graph of a dataset
+KNN_NEIGHBOURS = 10
+# minimum cosine similarity of two rows to be in the same near-duplicate group
+DUPLICATE_THRESHOLD = 0.95
+SEARCH_BATCH_SIZE = 4096
+# growth of the number of fetched results while too many of them are excluded
+OVERFETCH_FACTOR = 4
+# weight of the semantic similarity against the keyword score in hybrid search
+SEMANTIC_WEIGHT = 0.5
+# results of each search that are fused in hybrid search
+HYBRID_CANDIDATES = 100
+# embeddings are stored with half precision, the similarities barely change
+EMBEDDINGS_DTYPE = 'float16'
+# faiss index types for the datasets:
+# flat: exact search, 4 bytes per dimension and row
+# sq8: 8 bit scalar quantizer, 1 byte per dimension and row
+# pq: product quantizer, 1 byte per PQ_SUBQUANTIZERS dimensions and row
+INDEX_TYPES = ['flat', 'sq8', 'pq']
+PQ_SUBQUANTIZERS = 96
+# quantizers are trained on a sample of the embeddings
+TRAIN_SAMPLE_SIZE = 100000
+# datasets with less rows always get a flat index, training needs enough data
+MIN_TRAIN_ROWS = 10000
+# datasets with more rows get a sharded index, with one index file per shard
+SHARD_SIZE = 1000000
+# read indexes memory mapped, so that all worker processes share them. faiss
+# only supports this for some index types and ignores the flag for the others.
+INDEX_IO_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+# columns of a project, `{project}_{suffix}`, stored in the project file
+PROJECT_COLUMN_SUFFIXES = ['label', 'prediction', 'confidence']
+# rows per chunk when a dataset is ingested from a file
+INGEST_CHUNK_SIZE = 50000
+# column that keeps the ids of appended rows, whose ids are their positions
+SOURCE_ID_COLUMN = 'source_id'
+# the kNN graph of larger datasets is searched approximately, with an inverted
+# file index probing GRAPH_NPROBE of its lists per row
+EXACT_GRAPH_ROWS = 50000
+GRAPH_NPROBE = 16
+# the 2-D map of a dataset is fitted on a sample of its embeddings
+MAP_SAMPLE_SIZE = 20000
+# number of opened projects kept in memory, and the projects loaded at start
+# (comma separated names, or `all`)
+PROJECT_CACHE_SIZE = int(os.environ.get('ANNO_PROJECT_CACHE_SIZE', 8))
+PRELOAD_PROJECTS = os.environ.get('ANNO_PRELOAD_PROJECTS', '')
+
+# host:port of the search service, see search_service.py. Without it, texts are
+# encoded and searched in this process.
+SEARCH_SERVICE = os.environ.get('ANNO_SEARCH_SERVICE')
+_search_client = search_client.SearchClient(SEARCH_SERVICE) if SEARCH_SERVICE else None
+
+# loaded faiss indexes by dataset name, with the modification time of their
+# file, least recently used first
+_index_cache = collections.OrderedDict()
+_index_lock = threading.Lock()
+# opened projects by (project, annotator), with the versions of their files,
+# least recently used first
+_project_cache = collections.OrderedDict()
+_project_lock = threading.Lock()
+# one lock per project and annotator, held while the project is read
+_project_read_locks = {}
+# parsed meta files by name, with the version of the file
+_meta_cache = {}
 
 
 def dataset_from_csv(filename):
@@ -33,7 +109,9 @@ def dataset_from_csv(filename):
     return create_dataset(pd_data, filename)
 
 
-def create_dataset(data, name, description, text_column):
+def create_dataset(
+        data, name, description, text_column, index_type='flat',
+        encoder=encoders.DEFAULT_BACKEND):
     """ Creates a dataset from a pandas Dataframe.
 
     Takes a dict('records') as input and create a dataframe from it
@@ -47,6 +125,8 @@ def create_dataset(data, name, description, text_column):
         name: dataset name
         description: dataset description
         text_column: dataset column from which to extract text data
+        index_type: type of the faiss index, one of `INDEX_TYPES`
+        encoder: encoder backend, one of `encoders.BACKENDS`
 
     Returns:
         dataframe and search index of the dataset
@@ -54,42 +134,354 @@ def create_dataset(data, name, description, text_column):
     pd_data = pd.DataFrame(data)
     if 'id' not in pd_data:
         pd_data.insert(0, 'id', pd_data.index)
-    add_ds_metadata(pd_data, name, description, text_column)
-    search_index = None
-    if os.path.isfile(f'{FAISS_PATH}/{name}.faiss'):
-        search_index = faiss.read_index(f'{FAISS_PATH}/{name}.faiss')
-    elif os.path.isfile(f'{EMBEDDINGS_PATH}/{name}.npy'):
-        sentence_embeddings = np.load(f'{EMBEDDINGS_PATH}/{name}.npy')
-    else:
-        sentence_embeddings = model.encode(pd_data[text_column], convert_to_numpy=True)
-    if not search_index:
-        search_index = create_faiss_index(sentence_embeddings, name)
-    pd_data.to_csv(f'{DATA_PATH}/{name}.csv', index=False)
+    with dataset_lock(name):
+        _create_dataset(pd_data, name, description, text_column, index_type, encoder)
     return True
 
 
+def _create_dataset(pd_data, name, description, text_column, index_type, encoder):
+    """Creates the files of a dataset, while its lock is held."""
+    if not index_exists(name) and not os.path.isfile(f'{EMBEDDINGS_PATH}/{name}.npy'):
+        store_embeddings(encoders.encode(pd_data[text_column], encoder), name)
+    index_type, index_stats = index_dataset(name, len(pd_data), index_type)
+    add_ds_metadata(
+        pd_data, name, description, text_column, index_type, index_stats, encoder,
+        column_stats(pd_data))
+    load_clusters(name)
+    load_projection(name)
+    lexical.create_index(f'{FAISS_PATH}/{name}_fts.sqlite', pd_data[text_column])
+    write_csv(pd_data, f'{DATA_PATH}/{name}.csv')
+
+
+def index_dataset(name, n_rows, index_type='flat'):
+    """Creates the faiss index of a dataset from its stored embeddings, unless
+    there is one already.
+
+    Args:
+        name: name of the dataset
+        n_rows: number of rows of the dataset
+        index_type: one of `INDEX_TYPES`, small datasets always get a flat index
+
+    Returns:
+        the index type and the recall and memory of the index (`None` for flat
+        and existing indexes), see `evaluate_index_types`.
+    """
+    if n_rows < MIN_TRAIN_ROWS:
+        index_type = 'flat'
+    if index_exists(name):
+        return index_type, None
+    sentence_embeddings = load_embeddings(name)
+    create_faiss_index(sentence_embeddings, name, index_type)
+    if index_type == 'flat':
+        return index_type, None
+    return index_type, evaluate_index_types(sentence_embeddings, [index_type])[index_type]
+
+
+def ingest_csv(
+        path, name, description, text_column, index_type='flat',
+        encoder=encoders.DEFAULT_BACKEND, chunk_size=INGEST_CHUNK_SIZE, **read_options):
+    """Creates a dataset from a csv file on disk, chunk by chunk.
+
+    Unlike `create_dataset`, the file is never loaded at once. Every chunk is
+    encoded, added to the full text index and appended to the dataset file,
+    and its embeddings are written to disk right away. The memory needed thus
+    depends on the chunk size, not on the size of the file. Only the value
+    counts for the column statistics grow with the number of distinct values.
+    The dataset file and the full text index replace existing files only when
+    the whole file was read. If the ingest fails, the files created for the
+    dataset so far are removed, so that it can be ingested again.
+
+    Args:
+        path: csv file
+        name: dataset name
+        description: dataset description
+        text_column: column with the text units
+        index_type: type of the faiss index, one of `INDEX_TYPES`
+        encoder: encoder backend, one of `encoders.BACKENDS`
+        chunk_size: rows per chunk
+        read_options: passed on to `pandas.read_csv`, e.g. `sep`
+
+    Returns:
+        number of rows of the dataset
+
+    Raises:
+        KeyError: if the file has no column `text_column`
+    """
+    counts, dtypes, n_rows = {}, {}, 0
+    with dataset_lock(name):
+        try:
+            fts_path = f'{FAISS_PATH}/{name}_fts.sqlite'
+            with storage.atomic_path(f'{DATA_PATH}/{name}.csv') as dataset_file:
+                with storage.atomic_path(fts_path) as fts_file:
+                    def encoded_chunks():
+                        nonlocal n_rows
+                        for chunk in pd.read_csv(path, chunksize=chunk_size, **read_options):
+                            if text_column not in chunk:
+                                raise KeyError(f'{path} has no column {text_column}')
+                            if 'id' not in chunk:
+                                chunk.insert(0, 'id', np.arange(n_rows, n_rows + len(chunk)))
+                            chunk.to_csv(dataset_file, mode='a', header=n_rows == 0, index=False)
+                            lexical.create_index(fts_file, chunk[text_column], n_rows)
+                            add_value_counts(counts, dtypes, chunk)
+                            n_rows += len(chunk)
+                            yield encoders.encode(chunk[text_column], encoder)
+                    store_embedding_chunks(encoded_chunks(), name)
+            index_type, index_stats = index_dataset(name, n_rows, index_type)
+        except BaseException:
+            remove_dataset_files(name)
+            raise
+        add_ds_metadata(
+            None, name, description, text_column, index_type, index_stats, encoder,
+            stats_from_counts(counts, dtypes), size=n_rows)
+        load_clusters(name)
+        load_projection(name)
+    return n_rows
+
+
+def rebuild_index(name, index_type='flat', encoder=None, chunk_size=INGEST_CHUNK_SIZE):
+    """Builds the faiss index of a dataset again, e.g. with another index type.
+
+    With an encoder, the texts are encoded again first, chunk by chunk, and
+    the kNN graph and the near-duplicate groups are built again as well, since
+    they depend on the embeddings.
+    The new embeddings and the new index are built next to the old ones and
+    only replace them when they are complete, so searches keep working during
+    the rebuild and a failed rebuild leaves the dataset as it was.
+
+    Args:
+        name: name of the dataset
+        index_type: type of the new index, one of `INDEX_TYPES`
+        encoder: encoder backend to encode the texts with again, optional
+        chunk_size: rows per chunk when encoding
+
+    Returns:
+        the index type, which is flat for small datasets
+    """
+    meta = load_meta_file('datasets_meta.yaml')[name]
+    if meta['size'] < MIN_TRAIN_ROWS:
+        index_type = 'flat'
+    embeddings_file = f'{EMBEDDINGS_PATH}/.{name}.rebuild.npy'
+    build_path = f'{FAISS_PATH}/.{name}.rebuild'
+    with dataset_lock(name):
+        remove_faiss_index(build_path)
+        try:
+            if encoder:
+                store_embedding_chunks((
+                    encoders.encode(chunk[meta['text column']], encoder)
+                    for chunk in pd.read_csv(
+                        f'{DATA_PATH}/{name}.csv', usecols=[meta['text column']],
+                        chunksize=chunk_size)
+                ), name, embeddings_file)
+                sentence_embeddings = np.load(embeddings_file, mmap_mode='r')
+            else:
+                sentence_embeddings = load_embeddings(name)
+            create_faiss_index(sentence_embeddings, name, index_type, build_path)
+            index_stats = None if index_type == 'flat' else evaluate_index_types(
+                sentence_embeddings, [index_type])[index_type]
+            if encoder:
+                os.replace(embeddings_file, f'{EMBEDDINGS_PATH}/{name}.npy')
+            replace_faiss_index(name, build_path)
+        finally:
+            remove_faiss_index(build_path)
+            if os.path.isfile(embeddings_file):
+                os.remove(embeddings_file)
+        values = {'index_type': index_type, 'index_stats': index_stats}
+        if encoder:
+            values['encoder'] = encoder
+            remove_derived_files(name)
+        update_ds_metadata(name, **values)
+        load_clusters(name)
+        load_projection(name)
+    return index_type
+
+
+def remove_derived_files(name):
+    """Removes the files that are computed from the embeddings of a dataset."""
+    for suffix in [
+            f'_knn{KNN_NEIGHBOURS}.npz', '_graph.faiss', '_clusters.npy', '_map.npy',
+            '_map_model.pkl']:
+        if os.path.isfile(f'{FAISS_PATH}/{name}{suffix}'):
+            os.remove(f'{FAISS_PATH}/{name}{suffix}')
+
+
+def remove_dataset_files(name):
+    """Removes the embeddings, indexes and derived files of a dataset."""
+    remove_derived_files(name)
+    remove_faiss_index(f'{FAISS_PATH}/{name}')
+    for path in [f'{EMBEDDINGS_PATH}/{name}.npy', f'{FAISS_PATH}/{name}_fts.sqlite']:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def append_to_dataset(data, name):
+    """Appends new rows to an existing dataset.
+
+    Only the new rows are encoded. Their embeddings are appended to the stored
+    ones and added to the faiss index, as a new shard for sharded indexes. The
+    full text index, the kNN graph and the near-duplicate groups are extended
+    as well, and the new rows are placed on the 2-D map with its stored
+    projection. The new rows get the next positions of the dataset as ids. An
+    `id` column of the new rows is kept as `SOURCE_ID_COLUMN`, and rows whose
+    source id is already in the dataset are skipped. All label columns of the
+    projects are empty for the new rows.
+
+    Args:
+        data: data records of the new rows, must contain the text column of the
+            dataset
+        name: name of the dataset
+
+    Returns:
+        number of appended rows
+
+    Raises:
+        KeyError: if the text column of the dataset is missing in the data
+    """
+    with dataset_lock(name):
+        return _append_to_dataset(data, name)
+
+
+def _append_to_dataset(data, name):
+    """Appends the rows, while the lock of the dataset is held."""
+    meta = load_meta_file('datasets_meta.yaml')[name]
+    text_column = meta['text column']
+    dataset = pd.read_csv(f'{DATA_PATH}/{name}.csv')
+    new_rows = pd.DataFrame(data)
+    if text_column not in new_rows:
+        raise KeyError(f'new rows have no column {text_column}')
+    if 'id' in new_rows:
+        new_rows = new_rows.rename(columns={'id': SOURCE_ID_COLUMN})
+    if SOURCE_ID_COLUMN in new_rows:
+        new_rows = new_rows.drop_duplicates(SOURCE_ID_COLUMN)
+        if SOURCE_ID_COLUMN in dataset:
+            new_rows = new_rows[~new_rows[SOURCE_ID_COLUMN].isin(dataset[SOURCE_ID_COLUMN])]
+    if new_rows.empty:
+        return 0
+    start = len(dataset)
+    new_rows.insert(0, 'id', np.arange(start, start + len(new_rows)))
+    embeddings = encoders.encode(
+        new_rows[text_column], meta.get('encoder', encoders.DEFAULT_BACKEND))
+    append_embeddings(embeddings, name)
+    search_index = load_faiss_index(name, writable=True)
+    if isinstance(search_index, sharding.ShardedIndex):
+        search_index.add_shard(embeddings)
+    else:
+        fill_faiss_index(search_index, embeddings)
+        write_faiss_index(search_index, f'{FAISS_PATH}/{name}.faiss')
+    lexical.create_index(f'{FAISS_PATH}/{name}_fts.sqlite', new_rows[text_column], start)
+    extend_knn_graph(name, start)
+    if os.path.isfile(f'{FAISS_PATH}/{name}_clusters.npy'):
+        os.remove(f'{FAISS_PATH}/{name}_clusters.npy')
+        load_clusters(name)
+    extend_projection(name, start)
+    dataset = pd.concat([dataset, new_rows], ignore_index=True)
+    write_csv(dataset, f'{DATA_PATH}/{name}.csv')
+    update_ds_metadata(
+        name, size=len(dataset),
+        columns=column_stats(dataset[[key for key in meta.get('columns', dataset.keys())
+                                      if key in dataset]]))
+    return len(new_rows)
+
+
+def column_stats(dataframe, n_top_values=5):
+    """Gathers statistics about every column of a dataset.
+
+    One `value_counts` per column gives all of them at once.
+
+    Args:
+        dataframe: the data
+        n_top_values: number of most frequent values to keep per column
+
+    Returns:
+        dict with a dict of `dtype`, number of `unique` values, number of
+        `nulls` and the `top values` (list of [value, count]) for every column.
+    """
+    counts, dtypes = {}, {}
+    add_value_counts(counts, dtypes, dataframe)
+    return stats_from_counts(counts, dtypes, n_top_values)
+
+
+def add_value_counts(counts, dtypes, dataframe):
+    """Adds the value counts and dtypes of the columns of a dataframe to the
+    ones of the data before, for the statistics of data that comes in chunks.
+
+    Args:
+        counts: dict with the value counts (including NaN) of every column
+        dtypes: dict with the dtype of every column, `object` if it differed
+            between chunks
+        dataframe: the next chunk of data
+    """
+    for key in dataframe.keys():
+        chunk_counts = dataframe[key].value_counts(dropna=False)
+        if key in counts:
+            counts[key] = counts[key].add(chunk_counts, fill_value=0)
+        else:
+            counts[key] = chunk_counts
+        dtype = str(dataframe[key].dtype)
+        dtypes[key] = dtype if dtypes.get(key, dtype) == dtype else 'object'
+
+
+def plain_value(value):
+    """A value as str, int, float or bool, so that the meta files stay loadable
+    with `yaml.safe_load`. Anything else (e.g. timestamps from spreadsheets)
+    is stored as text."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def stats_from_counts(counts, dtypes, n_top_values=5):
+    """Column statistics (see `column_stats`) from the value counts."""
+    stats = {}
+    for key, key_counts in counts.items():
+        nulls = key_counts[key_counts.index.isna()]
+        key_counts = key_counts[key_counts.index.notna()].sort_values(
+            ascending=False, kind='stable')
+        stats[key] = {
+            'dtype': dtypes[key],
+            'unique': int(len(key_counts)),
+            'nulls': int(nulls.sum()),
+            'top values': [
+                [plain_value(value), int(count)]
+                for value, count in key_counts.head(n_top_values).items()
+            ],
+        }
+    return stats
+
+
 def get_dataset_labels(dataset_name):
     """returns the column names of a dataset and their number of unique items.
 
+    The numbers come from the column statistics in the dataset metadata.
+    Datasets from before there were statistics get them here, once.
+
     Args:
         dataset_name: name of the dataset
 
     Returns:
         list of tuples: (column name, number of unique items in column)
     """
-    df = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv')
-    return [(key, df[key].nunique()) for key in df.keys() if not key.endswith('_label')]
+    meta = load_meta_file('datasets_meta.yaml')[dataset_name]
+    if 'columns' not in meta:
+        df = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv')
+        meta['columns'] = column_stats(df[[key for key in df.keys() if not key.endswith('_label')]])
+        update_ds_metadata(dataset_name, columns=meta['columns'])
+    return [(key, stats['unique']) for key, stats in meta['columns'].items()
+            if not key.endswith('_label')]
 
 
 def create_project(dataset_name, project_name, label_column=False):
     meta = load_meta_file('datasets_meta.yaml')
     text_column = meta[dataset_name]['text column']
-    dataset = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv')
+    usecols = ['id', text_column] + ([label_column] if label_column else [])
+    dataset = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv', usecols=usecols)
     if label_column:
         dataset[f'{project_name}_label'] = dataset[label_column]
     else:
         dataset[f'{project_name}_label'] = None
-    dataset.to_csv(f'{DATA_PATH}/{dataset_name}.csv', index=False)
+    with project_lock(project_name):
+        write_csv(dataset[['id', f'{project_name}_label']], project_file(project_name))
     project_dict = {
         project_name: {
             'dataset': dataset_name,
@@ -97,56 +489,1077 @@ def create_project(dataset_name, project_name, label_column=False):
             'progress': 0
         }
     }
-    with open(f'{DATA_PATH}/projects_meta.yaml', 'a') as f:
-        f.write(yaml.dump(project_dict))
+    with storage.locked(DATA_PATH, 'meta'):
+        meta = load_meta_file('projects_meta.yaml') or {}
+        meta.update(project_dict)
+        storage.write_text(f'{DATA_PATH}/projects_meta.yaml', yaml.dump(meta))
     return dataset[["id", text_column, f'{project_name}_label']], text_column
 
 
-def load_project(project_name):
-    existing_projects = load_meta_file('projects_meta.yaml')
-    dataset_meta = load_meta_file('datasets_meta.yaml')
-    if project_name in existing_projects.keys():
-        dataset_name = existing_projects[project_name]["dataset"]
-        text_column = dataset_meta[dataset_name]['text column']
-        dataset = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv')
-        return dataset[["id", text_column, f'{project_name}_label']], dataset_name, text_column
+def load_project(project_name, annotator=None):
+    """Loads the rows of a project with the labels of one annotator.
+
+    The labels are always in the column `{project_name}_label`, whichever
+    annotator they belong to. Without an annotator, these are the final labels
+    of the project. The rows come from the cache of opened projects, see
+    `cached_project`.
+    """
+    state = cached_project(project_name, annotator)
+    if state is not None:
+        rows, dataset_name, text_column, _ = state
+        return rows.copy(), dataset_name, text_column
+
+
+def read_project(project_name, dataset_name, annotator=None):
+    """Reads the rows of a project from its files, only the rows of its
+    working set if it has one (see `load_sample`).
+
+    Returns:
+        tuple of the rows (id, text and label column), the dataset name, the
+        text column and the labels used so far, in order of appearance.
+    """
+    text_column = load_meta_file('datasets_meta.yaml')[dataset_name]['text column']
+    dataset = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv', usecols=['id', text_column])
+    sample = load_sample(project_name)
+    if sample is not None:
+        dataset = dataset.iloc[sample].reset_index(drop=True)
+    columns = load_project_columns(project_name, dataset_name, dataset['id'])
+    label_column = annotator_column(project_name, annotator)
+    dataset[f'{project_name}_label'] = (
+        columns[label_column].values if label_column in columns else None)
+    labels = [label for label in dataset[f'{project_name}_label'].dropna().unique() if label]
+    return (
+        dataset[["id", text_column, f'{project_name}_label']], dataset_name, text_column, labels)
+
+
+def project_version(project_name, dataset_name):
+    """Version of the files of a project, changes whenever one is written."""
+    return (file_version(f'{DATA_PATH}/{dataset_name}.csv'),
+            file_version(project_file(project_name)),
+            file_version(sample_file(project_name)))
+
+
+def file_version(path):
+    """Modification time, size and inode of a file, `None` if it is missing.
+    The inode changes with every atomic write, even within the resolution of
+    the modification time."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def cached_project(project_name, annotator=None):
+    """The state of an opened project, read again only if its files changed.
+
+    The last PROJECT_CACHE_SIZE opened projects are kept, and they are
+    accounted as `projects` by `memory`, which evicts the least recently used
+    ones when they exceed the budget. A project is read with only its own lock
+    held, so reading one project doesn't hold up cache hits of the others, and
+    a project that is opened twice at once is read once.
+
+    Returns:
+        the tuple of `read_project`, `None` if there is no such project. The
+        rows must not be changed.
+    """
+    projects = load_meta_file('projects_meta.yaml') or {}
+    if project_name not in projects:
+        return None
+    dataset_name = projects[project_name]['dataset']
+    key = (project_name, annotator or None)
+    version = project_version(project_name, dataset_name)
+    with _project_lock:
+        state = cache_hit(key, version)
+        if state is not None:
+            return state
+        read_lock = _project_read_locks.setdefault(key, threading.Lock())
+    with read_lock:
+        with _project_lock:
+            # read by another thread while this one waited for the lock
+            state = cache_hit(key, version)
+        if state is not None:
+            return state
+        state = read_project(project_name, dataset_name, annotator)
+        with _project_lock:
+            _project_cache.pop(key, None)
+            try:
+                memory.reserve('projects', key, project_memory(state))
+            except memory.MemoryBudgetError:
+                return state
+            _project_cache[key] = (version, state)
+            while len(_project_cache) > PROJECT_CACHE_SIZE:
+                _project_cache.popitem(last=False)
+        return state
+
+
+def cache_hit(key, version):
+    """The cached state of a project if it is still current, call with
+    `_project_lock` held."""
+    if key in _project_cache and _project_cache[key][0] == version:
+        _project_cache.move_to_end(key)
+        return _project_cache[key][1]
+    return None
+
+
+def project_labels(project_name, annotator=None):
+    """The labels used so far in a project, in order of appearance."""
+    state = cached_project(project_name, annotator)
+    return state[3] if state is not None else []
+
+
+def project_memory(state):
+    """Bytes of the rows of a cached project."""
+    return int(state[0].memory_usage(deep=True).sum())
+
+
+def cached_project_sizes():
+    return {
+        '@'.join(filter(None, key)): project_memory(state)
+        for key, (_, state) in list(_project_cache.items())
+    }
+
+
+def evict_project(name):
+    """Removes a project from the cache, by `project` or `project@annotator`."""
+    project_name, _, annotator = name.partition('@')
+    _project_cache.pop((project_name, annotator or None), None)
+
+
+memory.register('projects', cached_project_sizes, evict_project)
+
+
+def preload_projects(names=PRELOAD_PROJECTS):
+    """Loads projects and the indexes of their datasets into memory.
+
+    Args:
+        names: comma separated names of projects, or `all`
+    """
+    projects = load_meta_file('projects_meta.yaml') or {}
+    if names.strip() == 'all':
+        names = list(projects)
+    else:
+        names = [name.strip() for name in names.split(',') if name.strip() in projects]
+    for name in names:
+        cached_project(name)
+        if not _search_client and index_exists(projects[name]['dataset']):
+            load_faiss_index(projects[name]['dataset'])
+
+
+def annotator_column(project_name, annotator=None):
+    """The label column of an annotator in the project file. Without an
+    annotator, the column of the final labels."""
+    if annotator:
+        return f'{project_name}_label@{annotator}'
+    return f'{project_name}_label'
+
+
+def project_annotators(project_name):
+    """The ids of the annotators of a project."""
+    return load_meta_file('projects_meta.yaml')[project_name].get('annotators', [])
+
+
+def add_annotator(project_name, annotator):
+    """Adds an annotator to a project, if they are not part of it yet."""
+    with storage.locked(DATA_PATH, 'meta'):
+        meta = load_meta_file('projects_meta.yaml')
+        annotators = meta[project_name].setdefault('annotators', [])
+        if annotator not in annotators:
+            annotators.append(annotator)
+            storage.write_text(f'{DATA_PATH}/projects_meta.yaml', yaml.dump(meta))
+
+
+def project_file(project_name):
+    """The file with the columns of a project, see `load_project_columns`."""
+    return f'{DATA_PATH}/{project_name}_project.csv'
+
+
+def sample_file(project_name):
+    """The file with the working set of a project, see `load_sample`."""
+    return f'{DATA_PATH}/{project_name}_sample.npy'
+
+
+def load_sample(project_name):
+    """Loads the working set of a project.
+
+    A project can be restricted to a sample of the rows of its dataset (see
+    `sampling`), then only these rows are loaded into the tables. The ids of
+    the rows stay their positions in the dataset.
+
+    Returns:
+        sorted array with the positions of the rows of the working set, `None`
+        if the project works on all rows.
+    """
+    if os.path.isfile(sample_file(project_name)):
+        return np.load(sample_file(project_name))
+    return None
+
+
+def save_sample(project_name, rows):
+    """Stores the working set of a project, `None` to work on all rows."""
+    if rows is None:
+        if os.path.isfile(sample_file(project_name)):
+            os.remove(sample_file(project_name))
+        return
+    with storage.atomic_path(sample_file(project_name)) as temporary:
+        np.save(temporary, np.sort(np.asarray(rows, dtype=np.int64)))
+
+
+def load_project_columns(project_name, dataset_name, ids=None):
+    """Loads the columns of a project (labels, predictions).
+
+    Every project keeps its columns in its own file, with the id of every row,
+    so that saving one project never rewrites the dataset or the files of the
+    other projects. Projects from before have their columns in the dataset
+    file, they are read from there until the project is saved the first time.
+
+    Args:
+        project_name: name of the project
+        dataset_name: name of the dataset of the project
+        ids: ids of the rows of the dataset, read from the dataset if not given
+
+    Returns:
+        dataframe with the columns of the project, with one row per row of the
+        dataset, in the same order. Rows that are missing in the project file,
+        e.g. appended later, have no values.
+    """
+    dataset_file = f'{DATA_PATH}/{dataset_name}.csv'
+    if ids is None:
+        ids = pd.read_csv(dataset_file, usecols=['id'])['id']
+    ids = np.asarray(ids)
+    if os.path.isfile(project_file(project_name)):
+        columns = pd.read_csv(project_file(project_name))
+    else:
+        legacy_columns = [f'{project_name}_{suffix}' for suffix in PROJECT_COLUMN_SUFFIXES]
+        columns = pd.read_csv(
+            dataset_file, usecols=lambda column: column == 'id' or column in legacy_columns)
+    if f'{project_name}_label' not in columns:
+        columns[f'{project_name}_label'] = None
+    if len(columns) != len(ids) or not np.array_equal(columns['id'].values, ids):
+        columns = pd.DataFrame({'id': ids}).merge(columns, on='id', how='left')
+    return columns.drop(columns='id')
+
+
+def update_project_file(project_name, dataset_name, update):
+    """Changes the columns of a project and stores them.
+
+    The project is locked from reading to writing, so concurrent changes of the
+    same project (e.g. saving the table while a cluster is labeled) are not
+    lost.
+
+    Args:
+        project_name: name of the project
+        dataset_name: name of the dataset of the project
+        update: function that changes the dataframe of `load_project_columns`
+            in place, its index are the ids of the rows
+    """
+    with project_lock(project_name):
+        ids = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv', usecols=['id'])['id']
+        columns = load_project_columns(project_name, dataset_name, ids)
+        columns.index = ids.values
+        update(columns)
+        columns = columns.reset_index(drop=True)
+        columns.insert(0, 'id', ids.values)
+        write_csv(columns, project_file(project_name))
+
+
+def dataset_lock(name):
+    """Lock for changes of the files of a dataset."""
+    return storage.locked(DATA_PATH, f'dataset_{name}')
+
+
+def project_lock(name):
+    """Lock for changes of the file of a project."""
+    return storage.locked(DATA_PATH, f'project_{name}')
+
+
+def write_csv(dataframe, path):
+    """Writes a dataframe as csv file, atomically."""
+    with storage.atomic_path(path) as temporary:
+        dataframe.to_csv(temporary, index=False)
+
+
+def write_faiss_index(index, path):
+    """Writes a faiss index atomically. Other processes may have the old file
+    memory mapped, it must not change under their feet."""
+    with storage.atomic_path(path) as temporary:
+        faiss.write_index(index, temporary)
 
 
 def store_embeddings(embeddings, filename):
     """Stores embeddings on disk.
     If these are corespondend to a data set in the data sets folder, give it the
     same name for loading.
+    They are stored as `EMBEDDINGS_DTYPE`, which halves the size on disk and in
+    memory compared to float32.
+    """
+    with storage.atomic_path(f'{EMBEDDINGS_PATH}/{filename}.npy') as temporary:
+        np.save(temporary, embeddings.astype(EMBEDDINGS_DTYPE, copy=False))
+
+
+def store_embedding_chunks(chunks, name, path=None):
+    """Stores embeddings that come chunk by chunk, e.g. from a generator.
+
+    The chunks are appended to a raw file first, since the number of rows is
+    only known at the end, and then copied into the `.npy` file batch by batch.
+
+    Args:
+        chunks: iterable of embedding arrays
+        name: name of the dataset
+        path: `.npy` file to store them in instead of the embeddings file of
+            the dataset
+
+    Returns:
+        number of stored rows
+
+    Raises:
+        ValueError: if there are no embeddings at all
+    """
+    path = path or f'{EMBEDDINGS_PATH}/{name}.npy'
+    raw_file = f'{path}.raw'
+    n_rows, dimensions = 0, None
+    try:
+        with open(raw_file, 'wb') as f:
+            for chunk in chunks:
+                f.write(np.ascontiguousarray(chunk, dtype=EMBEDDINGS_DTYPE).tobytes())
+                n_rows += len(chunk)
+                dimensions = chunk.shape[1]
+        if not n_rows:
+            raise ValueError(f'no rows for dataset {name}')
+        raw = np.memmap(raw_file, dtype=EMBEDDINGS_DTYPE, mode='r', shape=(n_rows, dimensions))
+        with storage.atomic_path(path) as temporary:
+            embeddings = np.lib.format.open_memmap(
+                temporary, mode='w+', dtype=EMBEDDINGS_DTYPE, shape=(n_rows, dimensions))
+            for start in range(0, n_rows, SEARCH_BATCH_SIZE):
+                embeddings[start:start + SEARCH_BATCH_SIZE] = raw[start:start + SEARCH_BATCH_SIZE]
+            embeddings.flush()
+            del embeddings, raw
+    finally:
+        if os.path.exists(raw_file):
+            os.remove(raw_file)
+    return n_rows
+
+
+def load_embeddings(name):
+    """Loads the sentence embeddings of a dataset.
+
+    The file is memory mapped, so only the parts that are used are read from
+    disk and the operating system can drop them again when memory gets scarce.
+    Users of the embeddings convert the rows they need to float32.
+    Datasets created before the embeddings were stored on disk only have their
+    faiss index. They are reconstructed from there in that case, which is exact
+    for flat indexes.
+
+    Args:
+        name: name of the dataset
+
+    Returns:
+        numpy array with one embedding per row of the dataset.
+    """
+    if os.path.isfile(f'{EMBEDDINGS_PATH}/{name}.npy'):
+        return np.load(f'{EMBEDDINGS_PATH}/{name}.npy', mmap_mode='r')
+    search_index = load_faiss_index(name)
+    return search_index.reconstruct_n(0, search_index.ntotal)
+
+
+def append_embeddings(embeddings, name):
+    """Appends embeddings of new rows to the stored embeddings of a dataset.
+
+    A new file with the combined embeddings is written chunk by chunk and then
+    replaces the old one, so the old embeddings never have to be loaded at once.
+
+    Args:
+        embeddings: embeddings of the new rows
+        name: name of the dataset
+
+    Returns:
+        the combined embeddings (memory mapped)
     """
-    np.save(f'{EMBEDDINGS_PATH}/{filename}.npy', embeddings)
+    old_embeddings = load_embeddings(name)
+    n_old = len(old_embeddings)
+    with storage.atomic_path(f'{EMBEDDINGS_PATH}/{name}.npy') as temporary:
+        combined = np.lib.format.open_memmap(
+            temporary, mode='w+', dtype=EMBEDDINGS_DTYPE,
+            shape=(n_old + len(embeddings), old_embeddings.shape[1]))
+        for start in range(0, n_old, SEARCH_BATCH_SIZE):
+            end = min(start + SEARCH_BATCH_SIZE, n_old)
+            combined[start:end] = old_embeddings[start:end]
+        combined[n_old:] = embeddings
+        combined.flush()
+        del combined, old_embeddings
+    return load_embeddings(name)
 
 
-def create_faiss_index(sentence_embeddings, name):
+def new_faiss_index(dimensions, index_type='flat'):
+    """Creates an empty faiss index for cosine similarity on normalized vectors.
+
+    Args:
+        dimensions: dimensions of the embeddings
+        index_type: one of `INDEX_TYPES`
+
+    Returns:
+        The index, not trained yet for the quantized types.
+    """
+    if index_type == 'sq8':
+        return faiss.IndexScalarQuantizer(
+            dimensions, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'pq':
+        return faiss.IndexPQ(dimensions, PQ_SUBQUANTIZERS, 8, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'flat':
+        return faiss.IndexFlatIP(dimensions)
+    raise ValueError(f'unknown index type {index_type}')
+
+
+def train_faiss_index(index, sentence_embeddings):
+    """Trains the index on a sample of the embeddings, if it needs training."""
+    if not index.is_trained:
+        sample = np.random.default_rng(0).choice(
+            len(sentence_embeddings),
+            min(TRAIN_SAMPLE_SIZE, len(sentence_embeddings)),
+            replace=False
+        )
+        index.train(np.asarray(sentence_embeddings[np.sort(sample)], dtype='float32'))
+    return index
+
+
+def fill_faiss_index(index, sentence_embeddings):
+    """Trains the index if needed and adds the embeddings batch by batch, so
+    there is never a float32 copy of all embeddings in memory."""
+    train_faiss_index(index, sentence_embeddings)
+    for start in range(0, len(sentence_embeddings), SEARCH_BATCH_SIZE):
+        index.add(np.asarray(
+            sentence_embeddings[start:start + SEARCH_BATCH_SIZE], dtype='float32'))
+    return index
+
+
+def create_faiss_index(sentence_embeddings, name, index_type='flat', path=None):
     """creates and stores faiss index from sentence embeddings.
     The normalization is done because it was recommended in the docs when I
     first used the package (edit: and it still is, on another site in the docs).
+    Quantized indexes need training data, small datasets always get a flat
+    index, which is small enough anyway. Datasets with more than `SHARD_SIZE`
+    rows get a sharded index, see `sharding.ShardedIndex`.
     Args:
         sentence_embeddings: sentence embeddings to be put into the index.
         name: name of the index for storing it.
+        index_type: one of `INDEX_TYPES`
+        path: where to store the index instead, without suffix, see
+            `replace_faiss_index`
 
     Returns:
         The index.
     """
-    index = faiss.IndexFlatIP(768)
-    index.add(sentence_embeddings)
-    faiss.write_index(index, f'{FAISS_PATH}/{name}.faiss')
+    path = path or f'{FAISS_PATH}/{name}'
+    if len(sentence_embeddings) < MIN_TRAIN_ROWS:
+        index_type = 'flat'
+    index = new_faiss_index(sentence_embeddings.shape[1], index_type)
+    if len(sentence_embeddings) > SHARD_SIZE:
+        train_faiss_index(index, sentence_embeddings)
+        sharded_index = sharding.ShardedIndex.create(path, index)
+        for start in range(0, len(sentence_embeddings), SHARD_SIZE):
+            sharded_index.add_shard(sentence_embeddings[start:start + SHARD_SIZE])
+        return sharded_index
+    fill_faiss_index(index, sentence_embeddings)
+    write_faiss_index(index, f'{path}.faiss')
+    return index
+
+
+def remove_faiss_index(path):
+    """Removes an index stored at `path` (without suffix), sharded or not."""
+    if os.path.isfile(f'{path}.faiss'):
+        os.remove(f'{path}.faiss')
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def replace_faiss_index(name, path):
+    """Puts an index that was built at `path` in place of the index of a dataset.
+
+    Readers find the old or the new index at any time: a flat index file is
+    replaced atomically and is found before a sharded index, and a sharded
+    directory is only missing between two renames.
+    """
+    target = f'{FAISS_PATH}/{name}'
+    if os.path.isfile(f'{path}.faiss'):
+        os.replace(f'{path}.faiss', f'{target}.faiss')
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        return
+    old = f'{FAISS_PATH}/.{name}.old'
+    remove_faiss_index(old)
+    if os.path.isdir(target):
+        os.replace(target, old)
+    os.replace(path, target)
+    if os.path.isfile(f'{target}.faiss'):
+        os.remove(f'{target}.faiss')
+    remove_faiss_index(old)
+
+
+def index_bytes_per_row(index):
+    """Memory a row of the embeddings needs in an index."""
+    if isinstance(index, faiss.IndexFlat):
+        return index.d * 4
+    return index.sa_code_size()
+
+
+def evaluate_index_types(
+        sentence_embeddings, index_types=INDEX_TYPES,
+        sample_size=50000, n_queries=500, k=10):
+    """Measures recall against memory for the index types on a sample.
+
+    Each index type is built on a sample of the embeddings and searched with
+    rows of the sample. The recall is the share of the exact k nearest
+    neighbours (flat index) that the index finds.
+
+    Args:
+        sentence_embeddings: embeddings of a dataset
+        index_types: index types to evaluate
+        sample_size: rows in the sample
+        n_queries: number of queries
+        k: number of neighbours per query
+
+    Returns:
+        dict with a dict with `recall`, `bytes per row` and the estimated `size`
+        of the index for the full dataset in MB for every index type.
+    """
+    rng = np.random.default_rng(0)
+    sample_rows = np.sort(rng.choice(
+        len(sentence_embeddings), min(sample_size, len(sentence_embeddings)), replace=False))
+    sample = np.asarray(sentence_embeddings[sample_rows], dtype='float32')
+    queries = sample[rng.choice(len(sample), min(n_queries, len(sample)), replace=False)]
+    exact = fill_faiss_index(new_faiss_index(sample.shape[1]), sample)
+    _, true_neighbours = exact.search(queries, k)
+    stats = {}
+    for index_type in index_types:
+        index = fill_faiss_index(new_faiss_index(sample.shape[1], index_type), sample)
+        _, neighbours = index.search(queries, k)
+        hits = sum(len(np.intersect1d(found, true))
+                   for found, true in zip(neighbours, true_neighbours))
+        stats[index_type] = {
+            'recall': round(float(hits / true_neighbours.size), 4),
+            'bytes per row': int(index_bytes_per_row(index)),
+            'size': round(index_bytes_per_row(index) * len(sentence_embeddings) / 2**20, 1),
+        }
+    return stats
+
+
+def index_exists(name):
+    """Checks whether a dataset has a faiss index, sharded or not."""
+    manifest = f'{FAISS_PATH}/{name}/{sharding.MANIFEST}'
+    return os.path.isfile(f'{FAISS_PATH}/{name}.faiss') or os.path.isfile(manifest)
+
+
+def read_index_file(path, name=None):
+    """Reads a faiss index read only and memory mapped where faiss supports it.
+
+    The size of the file is reserved in the memory budget of the indexes
+    first, which may evict other indexes, but not the one of dataset `name`.
+    """
+    memory.reserve('indexes', name, os.path.getsize(path))
+    try:
+        return faiss.read_index(path, INDEX_IO_FLAGS)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def index_file(name):
+    """The file that changes whenever the faiss index of a dataset changes.
+
+    Raises:
+        FileNotFoundError: if there is no index for the dataset.
+    """
+    if os.path.isfile(f'{FAISS_PATH}/{name}.faiss'):
+        return f'{FAISS_PATH}/{name}.faiss'
+    elif os.path.isfile(f'{FAISS_PATH}/{name}/{sharding.MANIFEST}'):
+        return f'{FAISS_PATH}/{name}/{sharding.MANIFEST}'
+    else:
+        raise FileNotFoundError(f'no faiss index for name {name}')
+
+
+def load_faiss_index(name, writable=False):
+    """loads the faiss index of a dataset.
+
+    Indexes are read once per process and kept in memory. If the index file
+    changed since (e.g. rows were appended by another worker process), it is
+    read again. For sharded indexes, only the manifest is read here, the
+    shards are read when they are searched.
+
+    Args:
+        name: name of the dataset
+        writable: read a private, writable copy of the index instead of the
+            shared, read only one. Needed to add rows to the index.
+
+    Raises:
+        FileNotFoundError: if there is no index for the dataset.
+    """
+    path = index_file(name)
+    if writable:
+        if path.endswith(sharding.MANIFEST):
+            return sharding.ShardedIndex(os.path.dirname(path))
+        return faiss.read_index(path)
+    version = os.path.getmtime(path)
+    with _index_lock:
+        if name in _index_cache and _index_cache[name][0] == version:
+            _index_cache.move_to_end(name)
+            return _index_cache[name][1]
+        if path.endswith(sharding.MANIFEST):
+            search_index = sharding.ShardedIndex(
+                os.path.dirname(path), functools.partial(read_index_file, name=name))
+        else:
+            search_index = read_index_file(path, name)
+        _index_cache[name] = (version, search_index)
+        return search_index
+
+
+def index_memory(search_index):
+    """Estimated bytes of the rows of an index that are in memory."""
+    if isinstance(search_index, sharding.ShardedIndex):
+        return sum(index_memory(shard) for shard in search_index.shards if shard is not None)
+    return search_index.ntotal * index_bytes_per_row(search_index)
+
+
+def cached_index_sizes():
+    return {
+        name: index_memory(search_index)
+        for name, (_, search_index) in list(_index_cache.items())
+    }
+
+
+def evict_index(name):
+    """Removes an index from the cache, it is read again on next use."""
+    _index_cache.pop(name, None)
+
+
+memory.register('indexes', cached_index_sizes, evict_index)
+
+
+def preload_indexes():
+    """Loads the faiss indexes and the encoders of all datasets.
+
+    Called in the server process before the worker processes are forked, so all
+    workers share the memory of the indexes instead of loading their own copy.
+    """
+    for name, meta in load_meta_file('datasets_meta.yaml').items():
+        if not _search_client:
+            encoders.get_encoder(meta.get('encoder', encoders.DEFAULT_BACKEND))
+        if index_exists(name):
+            search_index = load_faiss_index(name)
+            if isinstance(search_index, sharding.ShardedIndex):
+                for number in range(len(search_index.shards)):
+                    search_index.shard(number)
+
+
+def knn_graph_rows(search_index, embeddings, start, k=KNN_NEIGHBOURS):
+    """Searches the k nearest neighbours of the rows from `start` on.
+
+    Args:
+        search_index: faiss index of the dataset
+        embeddings: embeddings of all rows of the dataset
+        start: position of the first row to search neighbours for
+        k: number of neighbours per row
+
+    Returns:
+        scipy.sparse csr matrix of shape (rows - start, rows) with the
+        similarities to the neighbours.
+    """
+    n_rows = search_index.ntotal
+    row_ids, neighbour_ids, similarities = [], [], []
+    for batch_start in range(start, n_rows, SEARCH_BATCH_SIZE):
+        batch = np.asarray(
+            embeddings[batch_start:batch_start + SEARCH_BATCH_SIZE], dtype='float32')
+        sims, neighbours = search_index.search(batch, k + 1)
+        rows = np.arange(batch_start, batch_start + len(batch))[:, None].repeat(k + 1, axis=1)
+        # the row itself is usually, but not always (duplicates!), the first hit
+        keep = (neighbours != rows) & (neighbours >= 0)
+        row_ids.append(rows[keep] - start)
+        neighbour_ids.append(neighbours[keep])
+        similarities.append(sims[keep])
+    return sparse.csr_matrix(
+        (np.concatenate(similarities),
+         (np.concatenate(row_ids), np.concatenate(neighbour_ids))),
+        shape=(n_rows - start, n_rows),
+        dtype='float32'
+    )
+
+
+def load_knn_graph(name, k=KNN_NEIGHBOURS):
+    """Loads the kNN graph of a dataset, or creates it from the faiss index.
+
+    The graph is a sparse matrix with the cosine similarity of every row to its
+    `k` nearest neighbours. It is created by searching the existing index with
+    the stored embeddings batch by batch, so nothing has to be encoded again.
+    The graph is stored next to the index, since it's expensive for large
+    datasets.
+
+    Args:
+        name: name of the dataset
+        k: number of neighbours per row
+
+    Returns:
+        scipy.sparse csr matrix of shape (rows, rows)
+    """
+    graph_file = f'{FAISS_PATH}/{name}_knn{k}.npz'
+    if os.path.isfile(graph_file):
+        return sparse.load_npz(graph_file)
+    embeddings = load_embeddings(name)
+    graph = knn_graph_rows(graph_search_index(name, embeddings), embeddings, 0, k)
+    with storage.atomic_path(graph_file) as temporary:
+        sparse.save_npz(temporary, graph)
+    return graph
+
+
+def graph_search_index(name, embeddings):
+    """The index the kNN graph of a dataset is searched with.
+
+    Searching every row in a flat index is quadratic in the number of rows, so
+    datasets with more than `EXACT_GRAPH_ROWS` rows get an IVF index with an 8
+    bit scalar quantizer instead. It finds almost all of the close neighbours,
+    which are the ones that matter for the near-duplicate groups and label
+    propagation. The index is stored as `{name}_graph.faiss`, so that appended
+    rows are searched with the same index as the others, see
+    `extend_knn_graph`. Smaller datasets use the index of the dataset.
+
+    Args:
+        name: name of the dataset
+        embeddings: embeddings of all rows of the dataset
+
+    Returns:
+        faiss index with the rows of the dataset
+    """
+    graph_index_file = f'{FAISS_PATH}/{name}_graph.faiss'
+    if len(embeddings) <= EXACT_GRAPH_ROWS:
+        if os.path.isfile(graph_index_file):
+            os.remove(graph_index_file)
+        return load_faiss_index(name)
+    dimensions = embeddings.shape[1]
+    n_lists = int(4 * np.sqrt(len(embeddings)))
+    index = faiss.IndexIVFScalarQuantizer(
+        faiss.IndexFlatIP(dimensions), dimensions, n_lists,
+        faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    fill_faiss_index(index, embeddings)
+    index.nprobe = GRAPH_NPROBE
+    write_faiss_index(index, graph_index_file)
     return index
 
 
-def search_faiss_with_string(text, index_name, k):
+def extend_knn_graph(name, start, k=KNN_NEIGHBOURS):
+    """Adds the neighbours of appended rows to a stored kNN graph.
+
+    Only the new rows are searched. The neighbour lists of the old rows stay as
+    they are, but since the graph is used as an undirected graph, old rows are
+    still connected to new rows that are close to them.
+    The new rows are searched with the index the graph was built with (see
+    `graph_search_index`), so the graph stays exact or approximate throughout.
+    If there is no stored graph, nothing happens, it is created on first use.
+
+    Args:
+        name: name of the dataset
+        start: position of the first appended row
+        k: number of neighbours per row
+    """
+    graph_file = f'{FAISS_PATH}/{name}_knn{k}.npz'
+    graph_index_file = f'{FAISS_PATH}/{name}_graph.faiss'
+    if not os.path.isfile(graph_file):
+        return
+    embeddings = load_embeddings(name)
+    if os.path.isfile(graph_index_file):
+        search_index = faiss.read_index(graph_index_file)
+        search_index.nprobe = GRAPH_NPROBE
+        fill_faiss_index(search_index, embeddings[search_index.ntotal:])
+        write_faiss_index(search_index, graph_index_file)
+    else:
+        search_index = load_faiss_index(name)
+    graph = sparse.load_npz(graph_file).tocsr()
+    graph.resize((start, search_index.ntotal))
+    new_rows = knn_graph_rows(search_index, embeddings, start, k)
+    with storage.atomic_path(graph_file) as temporary:
+        sparse.save_npz(temporary, sparse.vstack([graph, new_rows], format='csr'))
+
+
+def load_clusters(name):
+    """Loads the near-duplicate groups of a dataset, or creates them.
+
+    Two rows are in the same group if they are connected by a path of kNN
+    graph edges with a similarity of at least `DUPLICATE_THRESHOLD`. Every row
+    without near-duplicates is a group on its own.
+
+    Args:
+        name: name of the dataset
+
+    Returns:
+        array with the group id of every row.
+    """
+    cluster_file = f'{FAISS_PATH}/{name}_clusters.npy'
+    if os.path.isfile(cluster_file):
+        return np.load(cluster_file)
+    graph = load_knn_graph(name).copy()
+    graph.data[graph.data < DUPLICATE_THRESHOLD] = 0
+    graph.eliminate_zeros()
+    _, clusters = csgraph.connected_components(graph, directed=False)
+    clusters = clusters.astype('int32')
+    with storage.atomic_path(cluster_file) as temporary:
+        np.save(temporary, clusters)
+    return clusters
+
+
+def fit_projection(embeddings):
+    """Fits the 2-D projection of the map on a sample of MAP_SAMPLE_SIZE
+    embeddings, with UMAP if it is installed and PCA otherwise.
+
+    Returns:
+        the fitted UMAP model, or a dict with the `mean` and the two
+        `components` of the PCA.
+    """
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(
+        len(embeddings), min(len(embeddings), MAP_SAMPLE_SIZE), replace=False))
+    sample = np.asarray(embeddings[sample], dtype='float32')
+    if umap is not None and len(sample) > 2:
+        return umap.UMAP(n_components=2, metric='cosine', random_state=0).fit(sample)
+    mean = sample.mean(axis=0)
+    # the two directions of largest variance of the sample
+    _, vectors = np.linalg.eigh(np.cov(sample - mean, rowvar=False))
+    return {'mean': mean, 'components': vectors[:, [-1, -2]].astype('float32')}
+
+
+def project_embeddings(model, embeddings, start=0):
+    """Projects the embeddings from position `start` on chunk by chunk."""
+    projection = np.empty((len(embeddings) - start, 2), dtype='float32')
+    for chunk_start in range(start, len(embeddings), SEARCH_BATCH_SIZE):
+        chunk_end = min(chunk_start + SEARCH_BATCH_SIZE, len(embeddings))
+        chunk = np.asarray(embeddings[chunk_start:chunk_end], dtype='float32')
+        if isinstance(model, dict):
+            chunk = (chunk - model['mean']) @ model['components']
+        else:
+            chunk = model.transform(chunk)
+        projection[chunk_start - start:chunk_end - start] = chunk
+    return projection
+
+
+def load_projection(name):
+    """Loads the 2-D map of the embeddings of a dataset, or creates it.
+
+    The projection is fitted once (see `fit_projection`) and stored next to
+    the map, so that appended rows are placed on the same map, see
+    `extend_projection`.
+
+    Args:
+        name: name of the dataset
+
+    Returns:
+        float32 array of shape (rows, 2) with the position of every row.
+    """
+    map_file = f'{FAISS_PATH}/{name}_map.npy'
+    if os.path.isfile(map_file):
+        return np.load(map_file)
+    embeddings = load_embeddings(name)
+    model = fit_projection(embeddings)
+    with storage.atomic_path(f'{FAISS_PATH}/{name}_map_model.pkl') as temporary:
+        with open(temporary, 'wb') as f:
+            pickle.dump(model, f)
+    projection = project_embeddings(model, embeddings)
+    with storage.atomic_path(map_file) as temporary:
+        np.save(temporary, projection)
+    return projection
+
+
+def extend_projection(name, start):
+    """Adds the positions of appended rows to a stored map.
+
+    Only the new rows are projected, with the stored projection, so the map
+    keeps its layout. Maps without a stored projection are created again.
+    If there is no stored map, nothing happens, it is created on first use.
+
+    Args:
+        name: name of the dataset
+        start: position of the first appended row
+    """
+    map_file = f'{FAISS_PATH}/{name}_map.npy'
+    model_file = f'{FAISS_PATH}/{name}_map_model.pkl'
+    if not os.path.isfile(map_file):
+        return
+    if not os.path.isfile(model_file):
+        os.remove(map_file)
+        load_projection(name)
+        return
+    with open(model_file, 'rb') as f:
+        model = pickle.load(f)
+    projection = np.concatenate([
+        np.load(map_file)[:start], project_embeddings(model, load_embeddings(name), start)])
+    with storage.atomic_path(map_file) as temporary:
+        np.save(temporary, projection)
+
+
+def search_faiss_with_string(text, index_name, k, exclude=None, threshold=None):
     """ searches a faiss index with the model and returns the indices of the k
     most similar entries in the index as a list.
+
+    Args:
+        text: text to search for
+        index_name: name of the dataset
+        k: maximum number of results
+        exclude: optional boolean array marking rows that must not be returned,
+            e.g. the row of the text itself and rows that are already labeled.
+        threshold: optional minimum cosine similarity of the results.
+
+    Returns:
+        list of row positions, most similar first.
     """
-    if os.path.isfile(f'{FAISS_PATH}/{index_name}.faiss'):
-        search_index = faiss.read_index(f'{FAISS_PATH}/{index_name}.faiss')
-    else:
-        raise FileNotFoundError(f'no faiss index for name {index_name}')
-    _, index = search_index.search(model.encode([text]), k=k + 1)
-    return index.tolist()[0][1:]
+    search_index, query = index_and_query(index_name, text)
+    return search_index_filtered(search_index, query, k, exclude, threshold)
+
+
+def index_and_query(index_name, text):
+    """Encodes a text and returns it with the faiss index of a dataset.
+
+    If a search service is configured, both are done by the service, which
+    batches the requests of all workers, otherwise here. The text is encoded
+    with the same encoder backend as the dataset.
+    """
+    encoder = dataset_encoder(index_name)
+    if _search_client:
+        return (search_client.RemoteIndex(_search_client, index_name),
+                _search_client.encode([text], encoder))
+    return load_faiss_index(index_name), encoders.encode([text], encoder)
+
+
+def dataset_encoder(name):
+    """The encoder backend of a dataset, datasets from before there was a choice
+    use the default."""
+    return load_meta_file('datasets_meta.yaml').get(name, {}).get(
+        'encoder', encoders.DEFAULT_BACKEND)
+
+
+def search_index_filtered(search_index, query, k, exclude=None, threshold=None):
+    """Searches an index for one query vector, skipping excluded rows.
+
+    With a threshold, all rows above it are collected with a range search.
+    Without one, more results than needed are fetched and the excluded ones are
+    filtered out; if that leaves less than k results, the search is repeated
+    with more results until there are enough or the index is exhausted.
+
+    Args:
+        search_index: faiss index
+        query: array of shape (1, dimensions)
+        k: maximum number of results
+        exclude: optional boolean array marking rows that must not be returned
+        threshold: optional minimum cosine similarity of the results
+
+    Returns:
+        list of row positions, most similar first.
+    """
+    if threshold is not None:
+        try:
+            _, similarities, ids = search_index.range_search(query, threshold)
+        except RuntimeError:
+            # not every index type has a range search (e.g. IndexPQ), the
+            # threshold is then applied to the results of the normal search
+            pass
+        else:
+            ids = ids[np.argsort(-similarities, kind='stable')]
+            if exclude is not None:
+                ids = ids[~exclude[ids]]
+            return ids[:k].tolist()
+    n_fetch = min(k if exclude is None else k * OVERFETCH_FACTOR, search_index.ntotal)
+    while True:
+        similarities, ids = search_index.search(query, n_fetch)
+        similarities, ids = similarities[0], ids[0]
+        keep = ids >= 0
+        exhausted = n_fetch >= search_index.ntotal
+        if threshold is not None:
+            keep &= similarities >= threshold
+            # results are sorted, everything after a miss is below as well
+            exhausted = exhausted or not keep[-1]
+        ids = ids[keep]
+        if exclude is not None:
+            ids = ids[~exclude[ids]]
+        if len(ids) >= k or exhausted:
+            return ids[:k].tolist()
+        n_fetch = min(n_fetch * OVERFETCH_FACTOR, search_index.ntotal)
+
+
+def hybrid_search(query, index_name, k, exclude=None, semantic_weight=SEMANTIC_WEIGHT):
+    """Searches a dataset by keywords and by meaning at the same time.
+
+    The best matches of the full text index (BM25) and of the faiss index are
+    fused: both scores are scaled to [0, 1] and summed with the given weights.
+    Rows that only one of both searches found get 0 for the other score.
+    If excluded rows leave less than k results, both searches are repeated with
+    more candidates until there are enough or both are exhausted, like in
+    `search_index_filtered`.
+
+    Args:
+        query: search input of the user
+        index_name: name of the dataset
+        k: maximum number of results
+        exclude: optional boolean array marking rows that must not be returned
+        semantic_weight: weight of the semantic similarity, 0 for a pure keyword
+            search and 1 for a pure semantic search.
+
+    Returns:
+        list of row positions, best first.
+    """
+    lexical_file = f'{FAISS_PATH}/{index_name}_fts.sqlite'
+    use_lexical = semantic_weight < 1 and os.path.isfile(lexical_file)
+    if semantic_weight > 0:
+        search_index, query_vector = index_and_query(index_name, query)
+    n_fetch = max(HYBRID_CANDIDATES, k)
+    while True:
+        scores = {}
+        exhausted = True
+        if use_lexical:
+            rows, lexical_scores = lexical.search(lexical_file, query, n_fetch)
+            exhausted = len(rows) < n_fetch
+            if rows:
+                top_score = max(max(lexical_scores), 1e-9)
+                for row, score in zip(rows, lexical_scores):
+                    scores[row] = (1 - semantic_weight) * score / top_score
+        if semantic_weight > 0:
+            similarities, rows = search_index.search(
+                query_vector, min(n_fetch, search_index.ntotal))
+            exhausted = exhausted and n_fetch >= search_index.ntotal
+            for row, similarity in zip(rows[0], similarities[0]):
+                if row >= 0:
+                    scores[row] = scores.get(row, 0) + semantic_weight * max(similarity, 0)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        if exclude is not None:
+            ranked = [row for row in ranked if not exclude[row]]
+        if len(ranked) >= k or exhausted:
+            return [int(row) for row in ranked[:k]]
+        n_fetch *= OVERFETCH_FACTOR
+
+
+def apply_label_delta(dataset_name, project_name, rows, label, annotator=None):
+    """Sets the project label of many rows at once.
+
+    Args:
+        dataset_name: name of the dataset
+        project_name: name of the project
+        rows: positions of the rows in the dataset
+        label: new label of the rows
+        annotator: annotator whose labels are set, the final labels if `None`
+    """
+    def set_label(columns):
+        columns.loc[columns.index[rows], annotator_column(project_name, annotator)] = label
+    update_project_file(project_name, dataset_name, set_label)
+
+
+def store_predictions(dataset_name, project_name, predictions, confidences):
+    """Stores automatically assigned labels of a project in the dataset.
+
+    They are kept in their own columns of the project, so they never overwrite
+    the labels of the annotator.
+
+    Args:
+        dataset_name: name of the dataset
+        project_name: name of the project
+        predictions: predicted label for every row, `None` if there is none
+        confidences: confidence for every prediction
+    """
+    def set_predictions(columns):
+        columns[f'{project_name}_prediction'] = predictions
+        columns[f'{project_name}_confidence'] = confidences
+    update_project_file(project_name, dataset_name, set_predictions)
 
 
 def parse_contents(contents, filename):
@@ -171,22 +1584,52 @@ def parse_contents(contents, filename):
     return df
 
 
-def add_ds_metadata(dataframe, name, description, text_column):
+def add_ds_metadata(
+        dataframe, name, description, text_column, index_type='flat', index_stats=None,
+        encoder=encoders.DEFAULT_BACKEND, columns=None, size=None):
     """writes and gathers metadata from dataset.
 
     Args:
-        dataframe: data for which metadata is gathered
+        dataframe: data for which metadata is gathered, may be `None` if the
+            `size` is given
         name: name of the dataset
+        index_type: type of the faiss index
+        index_stats: optional recall and memory of the index, see
+            `evaluate_index_types`
+        encoder: encoder backend of the dataset
+        columns: optional statistics of the columns, see `column_stats`
+        size: number of rows, taken from the dataframe if not given
     """
     meta_dict = {
         name: {
-            'size': dataframe.shape[0],
+            'size': dataframe.shape[0] if size is None else size,
             'description': description,
             'text column': text_column,
+            'index type': index_type,
+            'encoder': encoder,
         }
     }
-    with open(f'{DATA_PATH}/datasets_meta.yaml', 'a') as f:
-        f.write(yaml.dump(meta_dict))
+    if index_stats:
+        meta_dict[name]['index stats'] = index_stats
+    if columns:
+        meta_dict[name]['columns'] = columns
+    with storage.locked(DATA_PATH, 'meta'):
+        meta = load_meta_file('datasets_meta.yaml') or {}
+        meta.update(meta_dict)
+        storage.write_text(f'{DATA_PATH}/datasets_meta.yaml', yaml.dump(meta, sort_keys=False))
+
+
+def update_ds_metadata(name, **values):
+    """Changes values in the metadata of a dataset.
+
+    Keyword arguments are the keys of the metadata, with spaces written as
+    underscores (e.g. `text_column`).
+    """
+    with storage.locked(DATA_PATH, 'meta'):
+        meta = load_meta_file('datasets_meta.yaml')
+        for key, value in values.items():
+            meta[name][key.replace('_', ' ')] = value
+        storage.write_text(f'{DATA_PATH}/datasets_meta.yaml', yaml.dump(meta, sort_keys=False))
 
 
 def load_meta_file(name):
@@ -199,12 +1642,15 @@ def load_meta_file(name):
         dictionary of the file or an empty dictionary if file not present.
         Could probably log something when logging is there.
     """
-    if os.path.isfile(f'{DATA_PATH}/{name}'):
-        with open(f'{DATA_PATH}/{name}', 'r') as f:
-            meta = yaml.safe_load(f)
-        return meta
-    else:
+    path = f'{DATA_PATH}/{name}'
+    version = file_version(path)
+    if version is None:
         return {}
+    if name not in _meta_cache or _meta_cache[name][0] != version:
+        with open(path, 'r') as f:
+            _meta_cache[name] = (version, yaml.safe_load(f))
+    # callers change the dictionary before they write it back
+    return copy.deepcopy(_meta_cache[name][1])
 
 
 def check_name_exists(name, dataset='True'):
@@ -232,19 +1678,42 @@ def check_name_exists(name, dataset='True'):
         return False
 
 
-def update_project_columns(data, project_name, dataset_name):
+def update_project_columns(data, project_name, dataset_name, annotator=None):
+    """Stores the project columns of the rows of a table.
+
+    The rows are matched by id, not by position, since the table may hold
+    other rows than the dataset file: rows can be appended to the dataset
+    while the project is open, and a project may only show its working set.
+    Rows that are not in the table keep their values, rows of the table that
+    are no longer in the dataset are left out.
+    """
     new_df = pd.DataFrame(data)
-    old_df = pd.read_csv(f'{DATA_PATH}/{dataset_name}.csv')
-    for column in new_df:
-        if column.startswith(project_name):
-            old_df[column] = new_df[column]
-    old_df.to_csv(f'{DATA_PATH}/{dataset_name}.csv', index=False)
+
+    def set_columns(columns):
+        positions = columns.index.get_indexer(new_df['id'].values)
+        known = positions >= 0
+        aligned = len(positions) == len(columns) and np.array_equal(
+            positions, np.arange(len(columns)))
+        for column in new_df:
+            if column == f'{project_name}_label':
+                target = annotator_column(project_name, annotator)
+            elif column.startswith(project_name):
+                target = column
+            else:
+                continue
+            if aligned:
+                columns[target] = new_df[column].values
+                continue
+            values = (columns[target].to_numpy(dtype=object) if target in columns
+                      else np.full(len(columns), None, dtype=object))
+            values[positions[known]] = new_df[column].to_numpy(dtype=object)[known]
+            columns[target] = values
+    update_project_file(project_name, dataset_name, set_columns)
 
 
 def save_labels(project_name, labels):
-    with open(f'{DATA_PATH}/{project_name}_labels.txt', 'w') as f:
-        for label in labels:
-            f.write(label + '\n')
+    storage.write_text(
+        f'{DATA_PATH}/{project_name}_labels.txt', ''.join(label + '\n' for label in labels))
 
 
 def load_labels(project_name):
@@ -0,0 +1,194 @@
+"""2-D map of the embeddings of a dataset, colored by label.
+
+The map has a position for every row (see `datasets.load_projection`), which
+is far too many points for the browser with large datasets. Instead, the rows
+in the visible part of the map are binned into a grid of MAP_BINS x MAP_BINS
+cells, and every cell with rows is drawn as one marker. The size of a marker
+grows with the number of rows in its cell. Its color is the most frequent
+label of the cell, or grey if no row of the cell is labeled, so unlabeled
+regions stand out. Zooming in bins the visible part again, so the map gets
+more detailed the further one zooms in. Lasso and box selections are mapped
+to the rows in the selected area on the server, not only to the drawn cells.
+"""
+import os
+import numpy as np
+import plotly.graph_objects as go
+from plotly.colors import qualitative
+from matplotlib.path import Path
+
+import datasets
+import memory
+from active_learning import labeled_mask
+
+MAP_BINS = 200
+MIN_MARKER_SIZE = 4
+MAX_MARKER_SIZE = 16
+UNLABELED_COLOR = 'lightgrey'
+
+# loaded maps by dataset name, with the modification time of their file
+_projections = {}
+
+
+def load_map(dataset_name):
+    """The 2-D positions of the rows of a dataset, kept in memory until the
+    map file changes."""
+    map_file = f'{datasets.FAISS_PATH}/{dataset_name}_map.npy'
+    version = os.path.getmtime(map_file) if os.path.isfile(map_file) else None
+    if dataset_name not in _projections or _projections[dataset_name][0] != version:
+        projection = datasets.load_projection(dataset_name)
+        _projections[dataset_name] = (os.path.getmtime(map_file), projection)
+    return _projections[dataset_name][1]
+
+
+memory.register(
+    'maps',
+    lambda: {name: projection.nbytes for name, (_, projection) in list(_projections.items())},
+    lambda name: _projections.pop(name, None))
+
+
+def visible_range(relayout_data, view=None):
+    """The visible part of the map after a zoom or pan.
+
+    Args:
+        relayout_data: relayout event of the graph
+        view: the visible part before the event
+
+    Returns:
+        dict with the `x` and `y` range, `None` for the full extent of an axis.
+    """
+    view = dict(view or {'x': None, 'y': None})
+    for axis in ['x', 'y']:
+        if (relayout_data or {}).get(f'{axis}axis.autorange'):
+            view[axis] = None
+        elif f'{axis}axis.range[0]' in (relayout_data or {}):
+            view[axis] = [relayout_data[f'{axis}axis.range[0]'],
+                          relayout_data[f'{axis}axis.range[1]']]
+        elif f'{axis}axis.range' in (relayout_data or {}):
+            view[axis] = list(relayout_data[f'{axis}axis.range'])
+    return view
+
+
+def bin_map(projection, labels, view=None, bins=MAP_BINS):
+    """Bins the rows in the visible part of the map into a grid of cells.
+
+    Args:
+        projection: float array of shape (rows, 2), see `load_map`
+        labels: label of every row, empty for unlabeled rows
+        view: visible part of the map, see `visible_range`
+        bins: number of cells per axis
+
+    Returns:
+        dict with the center (`x`, `y`), the number of rows (`count`), the
+        number of labeled rows (`labeled`) and the most frequent label (`label`,
+        `None` without labeled rows) of every cell with rows.
+    """
+    view = view or {}
+    x, y = projection[:, 0], projection[:, 1]
+    visible = np.ones(len(projection), dtype=bool)
+    for values, value_range in [(x, view.get('x')), (y, view.get('y'))]:
+        if value_range:
+            visible &= (values >= min(value_range)) & (values <= max(value_range))
+    rows = np.flatnonzero(visible)
+    empty = {key: np.empty(0) for key in ['x', 'y', 'count', 'labeled', 'label']}
+    if not len(rows):
+        return empty
+    cell_positions = []
+    edges = []
+    for values, value_range in [(x[rows], view.get('x')), (y[rows], view.get('y'))]:
+        low, high = (min(value_range), max(value_range)) if value_range else (
+            values.min(), values.max())
+        width = (high - low) / bins or 1.0
+        cell_positions.append(np.clip(((values - low) / width).astype(np.int64), 0, bins - 1))
+        edges.append((low, width))
+    cells = cell_positions[0] * bins + cell_positions[1]
+    labels = np.asarray(labels, dtype=object)[rows]
+    labeled = labeled_mask(labels)
+    categories, codes = np.unique(labels[labeled].astype(str), return_inverse=True)
+    counts = np.bincount(cells, minlength=bins * bins)
+    label_counts = np.bincount(
+        cells[labeled] * len(categories) + codes, minlength=bins * bins * len(categories)
+    ).reshape(bins * bins, len(categories))
+    occupied = np.flatnonzero(counts)
+    n_labeled = label_counts[occupied].sum(axis=1)
+    label = np.full(len(occupied), None, dtype=object)
+    if len(categories):
+        label[n_labeled > 0] = categories[label_counts[occupied][n_labeled > 0].argmax(axis=1)]
+    (x_low, x_width), (y_low, y_width) = edges
+    return {
+        'x': x_low + (occupied // bins + 0.5) * x_width,
+        'y': y_low + (occupied % bins + 0.5) * y_width,
+        'count': counts[occupied],
+        'labeled': n_labeled,
+        'label': label,
+    }
+
+
+def map_figure(cells, revision=None):
+    """Plotly figure of the binned map, one trace per label.
+
+    Args:
+        cells: cells of `bin_map`
+        revision: zoom and selection are kept while it stays the same, e.g.
+            the name of the project
+    """
+    figure = go.Figure()
+    largest = np.log1p(cells['count'].max()) if len(cells['count']) else 1
+    categories = sorted({label for label in cells['label'] if label is not None})
+    for number, label in enumerate([None] + categories):
+        in_trace = np.array([cell_label == label for cell_label in cells['label']], dtype=bool)
+        if not in_trace.any():
+            continue
+        scale = np.log1p(cells['count'][in_trace]) / largest
+        figure.add_trace(go.Scattergl(
+            x=cells['x'][in_trace],
+            y=cells['y'][in_trace],
+            mode='markers',
+            name=label if label is not None else 'unlabeled',
+            marker={
+                'size': MIN_MARKER_SIZE + (MAX_MARKER_SIZE - MIN_MARKER_SIZE) * scale,
+                'color': UNLABELED_COLOR if label is None
+                else qualitative.Plotly[(number - 1) % len(qualitative.Plotly)],
+                'opacity': 0.8,
+            },
+            customdata=np.column_stack([cells['count'][in_trace], cells['labeled'][in_trace]]),
+            hovertemplate=('%{customdata[0]} rows, %{customdata[1]} labeled'
+                           '<extra>%{fullData.name}</extra>'),
+        ))
+    figure.update_layout(
+        dragmode='lasso',
+        uirevision=revision,
+        template='plotly_white',
+        margin={'l': 10, 'r': 10, 't': 10, 'b': 10},
+        xaxis={'showticklabels': False, 'zeroline': False},
+        yaxis={'showticklabels': False, 'zeroline': False},
+        legend={'itemsizing': 'constant'},
+    )
+    return figure
+
+
+def selected_rows(projection, selected_data):
+    """The rows in a lasso or box selection of the map.
+
+    Args:
+        projection: float array of shape (rows, 2), see `load_map`
+        selected_data: selection event of the graph
+
+    Returns:
+        array with the positions of the selected rows.
+    """
+    if not selected_data:
+        return np.empty(0, dtype=np.int64)
+    if selected_data.get('lassoPoints'):
+        polygon = np.column_stack(
+            [selected_data['lassoPoints']['x'], selected_data['lassoPoints']['y']])
+    elif selected_data.get('range'):
+        (x_low, x_high), (y_low, y_high) = selected_data['range']['x'], selected_data['range']['y']
+        polygon = np.array([[x_low, y_low], [x_high, y_low], [x_high, y_high], [x_low, y_high]])
+    else:
+        return np.empty(0, dtype=np.int64)
+    # only the rows within the bounding box are tested against the polygon
+    above = (projection >= polygon.min(axis=0)).all(axis=1)
+    below = (projection <= polygon.max(axis=0)).all(axis=1)
+    candidates = np.flatnonzero(above & below)
+    inside = Path(polygon).contains_points(projection[candidates])
+    return candidates[inside]
@@ -0,0 +1,293 @@
+"""Sentence encoders that turn text units into normalized embeddings.
+
+There are two backends:
+- torch: the sentence transformers model in float32, as it is downloaded
+- onnx-int8: the same model exported to ONNX and quantized to int8 weights,
+  for faster encoding on CPUs. It is exported once and then loaded from
+  `ONNX_PATH`, so only the export needs torch.
+Encoders are loaded on first use and then kept, one per backend. Which backend
+a dataset uses is stored in its metadata, since queries must be encoded with
+the same backend as the dataset.
+"""
+import os
+import argparse
+import time
+import numpy as np
+
+import memory
+
+MODEL_NAME = 'paraphrase-mpnet-base-v2'
+ONNX_PATH = './onnx_models'
+BATCH_SIZE = 32
+DEFAULT_BACKEND = 'torch'
+# batches for encoding are filled with texts of similar length, up to this
+# number of (padded) tokens or the memory limit, whatever comes first
+TOKEN_BUDGET = 16384
+MAX_BATCH_SIZE = 512
+MEMORY_LIMIT = 2**30
+# rough activation memory of one transformer layer (without gradients, only one
+# layer is alive at a time) in float32: per token, mostly the feed forward
+# expansion of the hidden states, and per pair of tokens, the attention scores
+# of all heads
+BYTES_PER_TOKEN = 768 * 4 * 8
+BYTES_PER_TOKEN_PAIR = 12 * 4 * 2
+
+_encoders = {}
+
+
+class TorchEncoder:
+    """The sentence transformers model with a normalization layer."""
+
+    def __init__(self, model_name=MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize
+        embedding_model = SentenceTransformer(model_name)
+        self.model = SentenceTransformer(modules=[embedding_model, Normalize()])
+        self.tokenizer = embedding_model.tokenizer
+        self.max_seq_length = embedding_model.max_seq_length
+
+    def encode(self, texts, batch_size=BATCH_SIZE):
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True)
+
+
+class OnnxEncoder:
+    """The model as int8 quantized ONNX graph, run with onnxruntime.
+
+    Mean pooling and normalization, which are part of the sentence transformers
+    model, are done with numpy on the token embeddings of the graph.
+    """
+
+    def __init__(self, model_name=MODEL_NAME):
+        try:
+            import onnxruntime
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError('the onnx-int8 backend needs onnxruntime and transformers') from e
+        directory = f'{ONNX_PATH}/{model_name}'
+        if not os.path.isfile(f'{directory}/model-int8.onnx'):
+            export_onnx(model_name, directory)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.model_file = f'{directory}/model-int8.onnx'
+        self.session = onnxruntime.InferenceSession(
+            self.model_file, options, providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        with open(f'{directory}/max_seq_length.txt', 'r') as f:
+            self.max_seq_length = int(f.read())
+
+    def encode(self, texts, batch_size=BATCH_SIZE):
+        texts = [str(text) for text in texts]
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                texts[start:start + batch_size], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors='np')
+            token_embeddings = self.session.run(None, {
+                'input_ids': tokens['input_ids'].astype('int64'),
+                'attention_mask': tokens['attention_mask'].astype('int64'),
+            })[0]
+            mask = tokens['attention_mask'][:, :, None].astype('float32')
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled / np.linalg.norm(pooled, axis=1, keepdims=True))
+        if not batches:
+            return np.zeros((0, self.session.get_outputs()[0].shape[2]), dtype='float32')
+        return np.vstack(batches).astype('float32')
+
+
+def export_onnx(model_name, directory):
+    """Exports the transformer of a sentence transformers model to ONNX and
+    quantizes its weights to int8 (dynamic quantization).
+
+    Args:
+        model_name: name of the sentence transformers model
+        directory: directory for the ONNX files and the tokenizer
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask):
+            return self.transformer(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    model = SentenceTransformer(model_name, device='cpu')
+    os.makedirs(directory, exist_ok=True)
+    dummy = model.tokenizer(['an example sentence'], return_tensors='pt')
+    torch.onnx.export(
+        TokenEmbeddings(model[0].auto_model).eval(),
+        (dummy['input_ids'], dummy['attention_mask']),
+        f'{directory}/model.onnx',
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['token_embeddings'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'token_embeddings': {0: 'batch', 1: 'sequence'},
+        },
+        opset_version=13,
+    )
+    quantize_dynamic(
+        f'{directory}/model.onnx', f'{directory}/model-int8.onnx', weight_type=QuantType.QInt8)
+    model.tokenizer.save_pretrained(directory)
+    with open(f'{directory}/max_seq_length.txt', 'w') as f:
+        f.write(str(model.max_seq_length))
+
+
+BACKENDS = {
+    'torch': TorchEncoder,
+    'onnx-int8': OnnxEncoder,
+}
+
+
+def get_encoder(backend=DEFAULT_BACKEND):
+    """Returns the encoder of a backend, loading it on first use."""
+    if backend not in _encoders:
+        _encoders[backend] = BACKENDS[backend]()
+    return _encoders[backend]
+
+
+def encoder_memory(encoder):
+    """Estimated bytes of the weights of an encoder."""
+    model = getattr(encoder, 'model', None)
+    if hasattr(model, 'parameters'):
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    if hasattr(encoder, 'model_file'):
+        return os.path.getsize(encoder.model_file)
+    return sum(
+        value.nbytes for value in vars(encoder).values() if isinstance(value, np.ndarray))
+
+
+# the models are needed for every query, they are reported but not evicted
+memory.register('encoders', lambda: {
+    backend: encoder_memory(encoder) for backend, encoder in list(_encoders.items())})
+
+
+def token_lengths(encoder, texts):
+    """Number of tokens of every text, as the encoder will see it.
+
+    Encoders without a tokenizer get an estimate from the number of characters.
+    """
+    tokenizer = getattr(encoder, 'tokenizer', None)
+    if tokenizer is None:
+        return np.array([len(text) // 4 + 2 for text in texts])
+    tokens = tokenizer(texts, truncation=True, max_length=encoder.max_seq_length)['input_ids']
+    return np.array([len(ids) for ids in tokens])
+
+
+def batch_memory(batch_size, sequence_length):
+    """Estimated memory to encode a batch of texts padded to the same length."""
+    return batch_size * (
+        sequence_length * BYTES_PER_TOKEN + sequence_length ** 2 * BYTES_PER_TOKEN_PAIR)
+
+
+def length_batches(
+        lengths, token_budget=TOKEN_BUDGET, max_batch_size=MAX_BATCH_SIZE,
+        memory_limit=MEMORY_LIMIT):
+    """Groups texts of similar length into batches.
+
+    The texts are sorted by length, longest first, so the largest batches come
+    first and a too small memory limit shows up right away. A batch is full
+    when it would exceed the token budget or the memory limit with all its
+    texts padded to the longest one, or when it has `max_batch_size` texts.
+    Short texts thus end up in large batches and long texts in small ones,
+    and hardly any padding is computed.
+
+    Args:
+        lengths: array with the number of tokens of every text
+        token_budget: maximum number of padded tokens per batch
+        max_batch_size: maximum number of texts per batch
+        memory_limit: maximum estimated memory per batch in bytes
+
+    Returns:
+        list of arrays with the positions of the texts of each batch.
+    """
+    order = np.argsort(-np.asarray(lengths), kind='stable')
+    batches, start = [], 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = min(max_batch_size, max(token_budget // longest, 1))
+        while size > 1 and batch_memory(size, longest) > memory_limit:
+            size //= 2
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def encode(texts, backend=DEFAULT_BACKEND):
+    """Encodes texts into normalized float32 embeddings.
+
+    The texts are encoded in batches of similar length (see `length_batches`),
+    and the embeddings are put back into the original order.
+    """
+    encoder = get_encoder(backend)
+    texts = ['' if text is None else str(text) for text in texts]
+    if len(texts) <= 1:
+        return encoder.encode(texts)
+    embeddings = None
+    for batch in length_batches(token_lengths(encoder, texts)):
+        batch_embeddings = encoder.encode([texts[i] for i in batch], batch_size=len(batch))
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype='float32')
+        embeddings[batch] = batch_embeddings
+    return embeddings
+
+
+def parity_check(texts, backend, reference=DEFAULT_BACKEND):
+    """Compares the embeddings of a backend with the ones of the reference.
+
+    Args:
+        texts: sample of text units
+        backend: backend to check
+        reference: backend to compare with
+
+    Returns:
+        dict with the mean and minimum cosine similarity between the embeddings
+        of the same text, and the largest difference between the cosine
+        similarities of all pairs of texts (which is what the search uses).
+    """
+    expected = encode(texts, reference)
+    actual = encode(texts, backend)
+    same_text = (expected * actual).sum(axis=1)
+    pair_difference = np.abs(expected @ expected.T - actual @ actual.T)
+    return {
+        'mean similarity': float(same_text.mean()),
+        'min similarity': float(same_text.min()),
+        'max pair difference': float(pair_difference.max()),
+    }
+
+
+def benchmark(texts, backends=tuple(BACKENDS), repeat=3):
+    """Measures the encoding throughput of backends in texts per second.
+
+    The backends are loaded (and exported, if necessary) before timing.
+    """
+    results = {}
+    for backend in backends:
+        get_encoder(backend).encode(texts[:BATCH_SIZE])
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            get_encoder(backend).encode(texts)
+            timings.append(time.perf_counter() - start)
+        results[backend] = len(texts) / min(timings)
+    return results
+
+
+if __name__ == '__main__':
+    import pandas as pd
+    parser = argparse.ArgumentParser(
+        description='compare the encoder backends on the texts of a csv file')
+    parser.add_argument('file', help='csv file with text units')
+    parser.add_argument('column', help='column with the text units')
+    parser.add_argument('--sample', type=int, default=1000, help='number of texts to use')
+    args = parser.parse_args()
+    sample = pd.read_csv(args.file)[args.column].dropna().astype(str).head(args.sample).tolist()
+    for backend in BACKENDS:
+        if backend != DEFAULT_BACKEND:
+            print(backend, parity_check(sample, backend))
+    for backend, throughput in benchmark(sample).items():
+        print(f'{backend}: {throughput:.1f} texts/s')
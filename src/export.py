@@ -0,0 +1,245 @@
+"""Streaming export of the labels and predictions of a project.
+
+The dataset file and the project file are read side by side in chunks of rows,
+so the memory used does not grow with the size of the dataset. Every chunk is
+filtered before anything is serialized (only labeled rows, only predictions
+above a confidence), and written as CSV, JSONL or Parquet (one row group per
+chunk, needs pyarrow). Both files are opened before the first chunk is read,
+and since they are only ever replaced, never rewritten in place (see
+`storage`), an export sees one version of them even if the project is saved
+meanwhile.
+
+The exports are served by the app under `/export/<project>`, e.g.
+`/export/stance?format=parquet&labeled=1&min_confidence=0.9`, and written to
+files by `python src/cli.py export`.
+"""
+import io
+import os
+import itertools
+import contextlib
+import flask
+import pandas as pd
+
+import datasets
+import storage
+from active_learning import labeled_mask
+
+CHUNK_SIZE = 50000
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+FORMATS = list(MIMETYPES)
+EXPORT_COLUMNS = ['id', 'text', 'label', 'prediction', 'confidence']
+
+
+class _ByteSink(io.RawIOBase):
+    """File object that keeps what is written until it is taken out, so the
+    parquet writer can be streamed."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def project_chunks(project_name, annotator=None, labeled_only=False, min_confidence=None,
+                   chunk_size=CHUNK_SIZE):
+    """Reads the rows of a project chunk by chunk.
+
+    Args:
+        project_name: name of the project
+        annotator: export the labels of this annotator instead of the final
+            labels
+        labeled_only: only rows with a label
+        min_confidence: only rows with a prediction of a higher confidence
+        chunk_size: number of rows read at once
+
+    Yields:
+        dataframes with the columns of `EXPORT_COLUMNS`, empty chunks are
+        skipped.
+
+    Raises:
+        KeyError: if there is no such project
+    """
+    dataset_name = datasets.load_meta_file('projects_meta.yaml')[project_name]['dataset']
+    text_column = datasets.load_meta_file('datasets_meta.yaml')[dataset_name]['text column']
+    columns = {
+        datasets.annotator_column(project_name, annotator): 'label',
+        f'{project_name}_prediction': 'prediction',
+        f'{project_name}_confidence': 'confidence',
+    }
+    dataset_file = f'{datasets.DATA_PATH}/{dataset_name}.csv'
+    with contextlib.ExitStack() as stack:
+        texts_file = stack.enter_context(open(dataset_file, 'r'))
+        try:
+            columns_file = stack.enter_context(open(datasets.project_file(project_name), 'r'))
+        except FileNotFoundError:
+            # projects that were never saved have their columns in the dataset
+            columns_file = None
+        text_columns = ['id', text_column] + (list(columns) if columns_file is None else [])
+        texts = stack.enter_context(pd.read_csv(
+            texts_file, chunksize=chunk_size, usecols=lambda column: column in text_columns))
+        project_columns = stack.enter_context(pd.read_csv(
+            columns_file, usecols=lambda column: column == 'id' or column in columns,
+            chunksize=chunk_size)) if columns_file is not None else []
+        for chunk, chunk_columns in itertools.zip_longest(texts, project_columns):
+            if chunk is None:
+                break
+            if chunk_columns is not None:
+                # rows appended after the last save have no project values
+                chunk = chunk.merge(chunk_columns, on='id', how='left')
+            chunk = chunk.rename(columns={text_column: 'text', **columns})
+            for column in EXPORT_COLUMNS:
+                if column not in chunk:
+                    chunk[column] = None
+            keep = pd.Series(True, index=chunk.index)
+            if labeled_only:
+                keep &= labeled_mask(chunk['label'].to_numpy(dtype=object))
+            if min_confidence is not None:
+                keep &= pd.to_numeric(chunk['confidence'], errors='coerce') > min_confidence
+            if keep.any():
+                yield chunk.loc[keep, EXPORT_COLUMNS]
+
+
+def parquet_table(chunk):
+    """A chunk as pyarrow table with a fixed schema, since a chunk without any
+    label would get another type for the label column."""
+    import pyarrow as pa
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('text', pa.string()),
+        ('label', pa.string()),
+        ('prediction', pa.string()),
+        ('confidence', pa.float64()),
+    ])
+    chunk = chunk.copy()
+    for column in ['text', 'label', 'prediction']:
+        values = chunk[column]
+        chunk[column] = values.astype(str).astype(object).where(values.notna(), None)
+    chunk['confidence'] = pd.to_numeric(chunk['confidence'], errors='coerce')
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def serialize(chunks, export_format):
+    """Serializes chunks of rows piece by piece.
+
+    Args:
+        chunks: iterable of dataframes, e.g. of `project_chunks`
+        export_format: one of `FORMATS`
+
+    Yields:
+        the bytes of the file, one piece per chunk.
+
+    Raises:
+        ValueError: for an unknown format, or parquet without pyarrow
+    """
+    if export_format == 'csv':
+        header = True
+        for chunk in chunks:
+            yield chunk.to_csv(index=False, header=header).encode('utf-8')
+            header = False
+        if header:
+            yield (','.join(EXPORT_COLUMNS) + '\n').encode('utf-8')
+    elif export_format == 'jsonl':
+        for chunk in chunks:
+            lines = chunk.to_json(orient='records', lines=True, force_ascii=False)
+            yield (lines if lines.endswith('\n') else lines + '\n').encode('utf-8')
+    elif export_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError('the parquet export needs pyarrow')
+        sink = _ByteSink()
+        writer = None
+        for chunk in chunks:
+            table = parquet_table(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            writer.write_table(table)
+            yield sink.take()
+        if writer is None:
+            table = parquet_table(pd.DataFrame(columns=EXPORT_COLUMNS))
+            writer = pq.ParquetWriter(sink, table.schema)
+            writer.write_table(table)
+        writer.close()
+        yield sink.take()
+    else:
+        raise ValueError(f'unknown export format {export_format}, use one of {FORMATS}')
+
+
+def export_project(project_name, path, export_format=None, **filters):
+    """Writes the export of a project to a file.
+
+    Args:
+        project_name: name of the project
+        path: output file, written atomically
+        export_format: one of `FORMATS`, from the suffix of `path` if not given
+        filters: keyword arguments of `project_chunks`
+
+    Returns:
+        the number of exported rows.
+    """
+    export_format = export_format or os.path.splitext(path)[1].lstrip('.').lower()
+    if export_format not in FORMATS:
+        raise ValueError(f'unknown export format {export_format}, use one of {FORMATS}')
+    rows = 0
+
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+
+    with storage.atomic_path(path) as temporary:
+        with open(temporary, 'wb') as f:
+            for data in serialize(counted(project_chunks(project_name, **filters)), export_format):
+                f.write(data)
+    return rows
+
+
+def download(project_name):
+    """Streams the export of a project, with the format and the filters from
+    the query: `format`, `annotator`, `labeled`, `min_confidence`."""
+    args = flask.request.args
+    export_format = args.get('format', 'csv')
+    if export_format not in FORMATS:
+        flask.abort(400, f'unknown export format {export_format}, use one of {FORMATS}')
+    if project_name not in (datasets.load_meta_file('projects_meta.yaml') or {}):
+        flask.abort(404, f'no project {project_name}')
+    try:
+        min_confidence = float(args['min_confidence']) if args.get('min_confidence') else None
+    except ValueError:
+        flask.abort(400, 'min_confidence must be a number')
+    chunks = project_chunks(
+        project_name,
+        annotator=args.get('annotator') or None,
+        labeled_only=args.get('labeled', '').lower() in ['1', 'true', 'yes'],
+        min_confidence=min_confidence)
+    return flask.Response(
+        flask.stream_with_context(serialize(chunks, export_format)),
+        mimetype=MIMETYPES[export_format],
+        headers={'Content-Disposition':
+                 f'attachment; filename="{project_name}.{export_format}"'})
+
+
+def register(server):
+    """Adds the export endpoint to a flask server."""
+    server.add_url_rule('/export/<project_name>', 'export', download)
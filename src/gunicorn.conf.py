@@ -0,0 +1,34 @@
+"""gunicorn settings for the annotation tool, see `wsgi.py`.
+
+Settings can be changed with the environment variables ANNO_BIND, ANNO_WORKERS,
+ANNO_THREADS and ANNO_FAISS_THREADS.
+"""
+import os
+import multiprocessing
+
+bind = os.environ.get('ANNO_BIND', '127.0.0.1:8050')
+workers = int(os.environ.get('ANNO_WORKERS', multiprocessing.cpu_count()))
+# threads per worker, requests that wait for I/O don't block the worker
+threads = int(os.environ.get('ANNO_THREADS', 4))
+worker_class = 'gthread'
+pythonpath = 'src'
+# import the app before forking the workers
+preload_app = True
+# dataset creation encodes all rows within one request
+timeout = 600
+
+
+def when_ready(server):
+    """Loads all faiss indexes and encoder models, and the projects of
+    ANNO_PRELOAD_PROJECTS, in the master process, before the workers are
+    forked, so that they share them."""
+    import datasets
+    datasets.preload_indexes()
+    datasets.preload_projects()
+
+
+def post_fork(server, worker):
+    """Limits the threads faiss uses per search, the workers already search in
+    parallel."""
+    import faiss
+    faiss.omp_set_num_threads(int(os.environ.get('ANNO_FAISS_THREADS', 1)))
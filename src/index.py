@@ -4,8 +4,11 @@ from layout import layout
 import callbacks
 import cb_datatables
 import cb_open_modal
+import cb_tools
+import datasets
 
 app.layout = layout
 
 if __name__ == '__main__':
+    datasets.preload_projects()
     app.run_server(debug=True)
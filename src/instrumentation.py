@@ -0,0 +1,173 @@
+"""Latency and payload size metrics for all Dash callbacks.
+
+`instrument` replaces `app.callback`, so that every callback registered
+afterwards is timed. Per callback, the wall time, the size of the request and
+response JSON and the raised exceptions are counted in histograms, which are
+served in the Prometheus text format at `/metrics`. The metrics are kept per
+process, with several gunicorn workers every worker has its own.
+
+Optionally (ANNO_PROFILE_RATE > 0), a fraction of the calls is run with
+cProfile and the profiles of the slowest ones are served at `/metrics/profiles`.
+"""
+import os
+import io
+import time
+import heapq
+import random
+import cProfile
+import pstats
+import threading
+import functools
+import flask
+import dash
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [2**10, 2**12, 2**14, 2**16, 2**18, 2**20, 2**22, 2**24, 2**26]
+PROFILE_RATE = float(os.environ.get('ANNO_PROFILE_RATE', 0))
+PROFILES_KEPT = 10
+DASH_UPDATE_PATH = '/_dash-update-component'
+
+
+class Histogram:
+    """Cumulative histogram in the way Prometheus expects it."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, metric, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield f'{metric}_bucket{{{labels},le="{bound}"}} {count}'
+        yield f'{metric}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{metric}_sum{{{labels}}} {self.sum}'
+        yield f'{metric}_count{{{labels}}} {self.count}'
+
+
+_lock = threading.Lock()
+_latency = {}
+_request_size = {}
+_response_size = {}
+_exceptions = {}
+# the slowest profiled calls as (seconds, counter, callback, stats text)
+_profiles = []
+_profile_counter = 0
+
+
+def observe(histograms, name, value, buckets):
+    with _lock:
+        if name not in histograms:
+            histograms[name] = Histogram(buckets)
+        histograms[name].observe(value)
+
+
+def keep_profile(seconds, name, profile):
+    """Keeps the stats of a profiled call, if it is among the slowest."""
+    global _profile_counter
+    text = io.StringIO()
+    pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(30)
+    with _lock:
+        _profile_counter += 1
+        entry = (seconds, _profile_counter, name, text.getvalue())
+        if len(_profiles) < PROFILES_KEPT:
+            heapq.heappush(_profiles, entry)
+        else:
+            heapq.heappushpop(_profiles, entry)
+
+
+def timed(function):
+    """Wraps a callback function to record its wall time and exceptions."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if flask.has_request_context():
+            flask.g.callback_name = name
+        profile = cProfile.Profile() if PROFILE_RATE and random.random() < PROFILE_RATE else None
+        start = time.perf_counter()
+        try:
+            if profile:
+                return profile.runcall(function, *args, **kwargs)
+            return function(*args, **kwargs)
+        except dash.exceptions.PreventUpdate:
+            raise
+        except Exception as e:
+            with _lock:
+                key = (name, type(e).__name__)
+                _exceptions[key] = _exceptions.get(key, 0) + 1
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            observe(_latency, name, seconds, LATENCY_BUCKETS)
+            if profile:
+                keep_profile(seconds, name, profile)
+    return wrapper
+
+
+def record_request_size():
+    if flask.request.path == DASH_UPDATE_PATH:
+        flask.g.request_size = flask.request.content_length or 0
+
+
+def record_response_size(response):
+    name = flask.g.get('callback_name')
+    if flask.request.path == DASH_UPDATE_PATH and name:
+        observe(_request_size, name, flask.g.get('request_size', 0), SIZE_BUCKETS)
+        observe(_response_size, name, response.calculate_content_length() or 0, SIZE_BUCKETS)
+    return response
+
+
+def metrics():
+    """All metrics in the Prometheus text format."""
+    lines = []
+    with _lock:
+        for metric, histograms, description in [
+                ('dash_callback_duration_seconds', _latency, 'wall time of callbacks'),
+                ('dash_callback_request_bytes', _request_size, 'size of callback requests'),
+                ('dash_callback_response_bytes', _response_size, 'size of callback responses')]:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} histogram')
+            for name, histogram in sorted(histograms.items()):
+                lines.extend(histogram.lines(metric, f'callback="{name}"'))
+        lines.append('# HELP dash_callback_exceptions_total exceptions raised in callbacks')
+        lines.append('# TYPE dash_callback_exceptions_total counter')
+        for (name, exception), count in sorted(_exceptions.items()):
+            labels = f'callback="{name}",exception="{exception}"'
+            lines.append(f'dash_callback_exceptions_total{{{labels}}} {count}')
+    return flask.Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def profiles():
+    """The profiles of the slowest sampled calls, slowest first."""
+    with _lock:
+        entries = sorted(_profiles, reverse=True)
+    text = '\n'.join(
+        f'==== {name}: {seconds:.3f}s ====\n{stats}' for seconds, _, name, stats in entries)
+    return flask.Response(text or 'no profiles (set ANNO_PROFILE_RATE)\n', mimetype='text/plain')
+
+
+def instrument(app):
+    """Times all callbacks registered on the app from now on and adds the
+    `/metrics` endpoints to its server."""
+    register = app.callback
+
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+
+        def decorate(function):
+            return decorator(timed(function))
+        return decorate
+
+    app.callback = callback
+    app.server.before_request(record_request_size)
+    app.server.after_request(record_response_size)
+    app.server.add_url_rule('/metrics', 'metrics', metrics)
+    app.server.add_url_rule('/metrics/profiles', 'profiles', profiles)
@@ -10,7 +10,7 @@ The header has two columns, one for the buttons/menu and one for the title
 The content has three columns:
 1. the labels
 2. the text data. (consisting of two rows, one for text data, one for algorithm output)
-3. the third that, uhm, I like. (yes, yes, it will go if I don't find use.)
+3. the tools for the annotator, e.g. the queue of the next best rows to label.
 """
 
 from dash import dash_table
@@ -25,7 +25,8 @@ header = dbc.Row([
         dbc.Button("Save!", color='danger', id='btn-save-data', disabled=True),
         html.Div(hidden=True, id='clean-bit', **{'data-saved': 0}),
         dcc.Store(id='current_dataset'),
-        dcc.Store(id='new_data')
+        dcc.Store(id='new_data'),
+        dcc.Store(id='label-delta')
     ],
         align="end",
         width=4,
@@ -83,9 +84,37 @@ text_unit_box = dbc.Col(
 )
 
 
+suggestion_controls = dbc.Row([
+    dbc.Col(
+        dbc.Input(
+            id='search-input', type='search', debounce=True,
+            placeholder='Search keywords or #hashtags (enter)', size='sm'
+        ),
+        width=5
+    ),
+    dbc.Col(
+        dbc.Checkbox(
+            id='suggest-hide-labeled',
+            value=False,
+            label='Hide labeled rows',
+        ),
+        width='auto'
+    ),
+    dbc.Col(
+        dbc.Input(
+            id='suggest-threshold', type='number', min=0, max=1, step=0.05,
+            placeholder='Min. similarity', size='sm'
+        ),
+        width=3
+    )],
+    id='suggestion-controls',
+    className="g-2"
+)
+
 algo_result_box = dbc.Col(
     id='algo-box', children=[
         html.Div('Similar Arguments', id="algo-box-header"),
+        suggestion_controls,
         dash_table.DataTable(
             id='algo-table',
             columns=[
@@ -116,6 +145,139 @@ algo_result_box = dbc.Col(
         )]
 )
 
+queue_box = html.Div([
+    html.Div('Next best rows', id='queue-box-header'),
+    dbc.RadioItems(
+        id='queue-kind',
+        options=[
+            {'label': 'Suggestions', 'value': 'suggestions'},
+            {'label': 'Disagreements', 'value': 'disagreements'},
+        ],
+        value='suggestions',
+        inline=True
+    ),
+    dbc.Button(
+        'Refresh queue', id='btn-refresh-queue', size='sm',
+        color='primary', style={'width': '100%'}),
+    dash_table.DataTable(
+        id='queue-table',
+        columns=[
+            {'name': 'Argument', 'id': 'text'},
+            {'name': 'Score', 'id': 'uncertainty'},
+        ],
+        data=[],
+        page_size=15,
+        style_header={
+            'text_Align': 'center',
+        },
+        style_data={
+            'whiteSpace': 'normal',
+            'height': 'auto',
+        },
+        style_data_conditional=[
+            {
+                'if': {'column_id': 'text'},
+                'textOverflow': 'ellipsis',
+                'maxWidth': 0,
+                'width': '75%',
+                'textAlign': 'left'
+            }
+        ]
+    )],
+    id='queue-box',
+    className="mb-2"
+)
+
+propagation_box = html.Div([
+    html.Div('Label propagation', id='propagation-box-header'),
+    dbc.Button(
+        dbc.Spinner(html.Div('Propagate labels', id='propagation-spinner'), size='sm'),
+        id='btn-propagate', size='sm', color='primary', style={'width': '100%'}),
+    html.Div(id='propagation-result')],
+    id='propagation-box',
+    className="mb-2"
+)
+
+agreement_box = html.Div([
+    html.Div('Annotator agreement', id='agreement-box-header'),
+    dbc.Button(
+        'Show agreement', id='btn-agreement', size='sm',
+        color='primary', style={'width': '100%'}),
+    html.Div(id='agreement-info')],
+    id='agreement-box',
+    className="mb-2"
+)
+
+cluster_box = html.Div([
+    html.Div('Near duplicates', id='cluster-box-header'),
+    html.Div('Select a row to see its group.', id='cluster-info'),
+    dbc.Select(id='cluster-label-dd', placeholder='Label for the group', size='sm'),
+    dbc.Button(
+        'Label group', id='btn-label-cluster', size='sm',
+        color='primary', style={'width': '100%'})],
+    id='cluster-box',
+    className="mb-2"
+)
+
+rule_box = html.Div([
+    html.Div('Rule labeling', id='rule-box-header'),
+    dbc.Input(id='rule-pattern', placeholder='Pattern, e.g. #stopthe\\w+', size='sm'),
+    dbc.RadioItems(
+        id='rule-kind',
+        options=[
+            {'label': 'Regex', 'value': 'regex'},
+            {'label': 'Keywords', 'value': 'keywords'},
+        ],
+        value='regex',
+        inline=True
+    ),
+    dbc.Checkbox(id='rule-case', value=False, label='Case sensitive'),
+    dbc.Checkbox(id='rule-overwrite', value=False, label='Overwrite existing labels'),
+    dbc.Select(id='rule-label-dd', placeholder='Label for the matches', size='sm'),
+    dbc.ButtonGroup([
+        dbc.Button('Preview', id='btn-rule-preview', size='sm', color='secondary'),
+        dbc.Button('Apply', id='btn-rule-apply', size='sm', color='primary')],
+        style={'width': '100%'}
+    ),
+    html.Div(id='rule-info')],
+    id='rule-box',
+    className="mb-2"
+)
+
+map_box = html.Div([
+    html.Div('Embedding map', id='map-box-header'),
+    dbc.Button(
+        'Show map', id='btn-map', size='sm',
+        color='primary', style={'width': '100%'})],
+    id='map-box',
+    className="mb-2"
+)
+
+map_modal = dbc.Modal([
+    dbc.ModalHeader("Embedding map"),
+    dbc.ModalBody([
+        dcc.Graph(id='map-graph', style={'height': '70vh'}, config={'displaylogo': False}),
+        dcc.Store(id='map-view'),
+        html.Div('Draw a lasso around a region to select its rows.', id='map-info')
+    ]),
+    dbc.ModalFooter([
+        dbc.Select(
+            id='map-label-dd', placeholder='Label for the unlabeled selected rows', size='sm',
+            style={'width': '40%'}),
+        dbc.Button('Label selection', id='btn-label-map', size='sm', color='primary')
+    ])],
+    id='map-modal',
+    size='xl',
+    is_open=False
+)
+
+tools_column = dbc.Col(
+    [queue_box, agreement_box, propagation_box, map_box, cluster_box, rule_box],
+    width=2,
+    style={'height': '100%'},
+    class_name="overflow-auto"
+)
+
 label_list_header = html.H6("Labels", className="border-2 text-center text-white bg-info mt-0 mb-2")
 
 label_column = dbc.Col(
@@ -145,6 +307,7 @@ label_column = dbc.Col(
 
 layout = dbc.Container([
     html.Div(hidden=True, id='modal-container'),
+    map_modal,
     header,
     dbc.Row([
         label_column,
@@ -163,7 +326,7 @@ layout = dbc.Container([
             style={'height': '100%'},
             className="border-end border-3 border-danger"
         ),
-        dbc.Col([dbc.Button("row 1 col 3", style={"width": "100%"})], width=2)],
+        tools_column],
         style={'height': '90%'},
 
     )],
@@ -0,0 +1,71 @@
+"""Keyword search on the text units of a dataset with SQLite FTS5.
+
+The full text index lives next to the faiss index of the dataset. The row id
+of every entry in the index is the position of the text in the dataset, just
+like the ids of the faiss index, so that results of both can be combined.
+"""
+import re
+import sqlite3
+
+# '#' and '@' are part of the tokens, so hashtags and mentions can be searched
+# for exactly.
+TOKENIZER = "unicode61 tokenchars '#@_'"
+INSERT_BATCH_SIZE = 10000
+
+
+def create_index(path, texts, start=0):
+    """Creates a full text index or adds texts to an existing one.
+
+    Args:
+        path: file of the sqlite database
+        texts: iterable of texts to index
+        start: row position of the first text, an index that starts at 0
+            replaces the texts already in the database
+    """
+    with sqlite3.connect(path) as connection:
+        if start == 0:
+            connection.execute('DROP TABLE IF EXISTS texts')
+        connection.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5(text, tokenize="{TOKENIZER}")')
+        batch = []
+        for row, text in enumerate(texts, start=start):
+            batch.append((row, '' if text is None else str(text)))
+            if len(batch) == INSERT_BATCH_SIZE:
+                connection.executemany('INSERT INTO texts(rowid, text) VALUES (?, ?)', batch)
+                batch = []
+        connection.executemany('INSERT INTO texts(rowid, text) VALUES (?, ?)', batch)
+
+
+def to_match_expression(query):
+    """Turns user input into an FTS5 query, where all terms have to match.
+
+    Every term is quoted, so characters with a meaning in the FTS5 query syntax
+    (e.g. '-' or ':') are searched for literally.
+    """
+    terms = re.findall(r'[\w#@]+', query)
+    return ' '.join('"{}"'.format(term) for term in terms)
+
+
+def search(path, query, k):
+    """Searches the full text index with BM25 ranking.
+
+    Args:
+        path: file of the sqlite database
+        query: keywords to search for
+        k: maximum number of results
+
+    Returns:
+        list of row positions and list of their scores (higher is better),
+        best first.
+    """
+    expression = to_match_expression(query)
+    if not expression:
+        return [], []
+    with sqlite3.connect(path) as connection:
+        # sqlite's bm25() is smaller for better matches
+        results = connection.execute(
+            'SELECT rowid, -bm25(texts) FROM texts WHERE texts MATCH ? '
+            'ORDER BY bm25(texts) LIMIT ?',
+            (expression, k)
+        ).fetchall()
+    return [row for row, _ in results], [score for _, score in results]
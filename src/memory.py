@@ -0,0 +1,230 @@
+"""Accounting of the memory held by the app, with budgets.
+
+Everything that keeps large objects alive between requests (the faiss index
+cache, the encoders, the annotation queues) registers itself as a holder with
+a function that reports the bytes held per entry. The callback requests
+themselves are accounted as well while they are processed, since the JSON of
+the data tables is parsed into python objects that are several times its size.
+
+Budgets are set with environment variables, in bytes or with a K/M/G suffix:
+- ANNO_MEMORY_BUDGET: for everything accounted, in total
+- ANNO_MEMORY_BUDGETS: per kind of holder, e.g. `indexes=4G,requests=1G`
+Before something big is loaded, `reserve` evicts the least recently used
+entries of evictable holders until it fits. If it still doesn't fit, it raises
+`MemoryBudgetError`, and requests that don't fit are answered with 503, before
+the process runs out of memory.
+
+`/metrics/memory` reports the accounted memory as JSON.
+`/metrics/memory/snapshot` takes a tracemalloc snapshot and reports the top
+allocations, and the difference to the previous snapshot. Tracing starts with
+the first snapshot (or at start with ANNO_TRACEMALLOC=1) and is stopped with
+`?stop=1`, since it slows down every allocation.
+"""
+import os
+import resource
+import threading
+import tracemalloc
+import flask
+
+# parsed JSON takes several times the bytes of the JSON text
+PAYLOAD_FACTOR = 8
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+
+class MemoryBudgetError(MemoryError):
+    """Raised when something does not fit into the memory budget."""
+
+
+def parse_bytes(value):
+    """Parses a number of bytes like `512M` or `4G`, `None` stays `None`."""
+    if value is None or value == '':
+        return None
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def parse_budgets(value):
+    """Parses per kind budgets like `indexes=4G,requests=1G`."""
+    budgets = {}
+    for item in (value or '').split(','):
+        if item.strip():
+            kind, size = item.split('=')
+            budgets[kind.strip()] = parse_bytes(size)
+    return budgets
+
+
+BUDGET = parse_bytes(os.environ.get('ANNO_MEMORY_BUDGET'))
+BUDGETS = parse_budgets(os.environ.get('ANNO_MEMORY_BUDGETS'))
+
+_lock = threading.RLock()
+# kind -> (function returning {name: bytes}, least recently used first,
+#          function evicting an entry by name or None)
+_holders = {}
+_requests = {}
+_last_snapshot = None
+
+
+def register(kind, sizes, evict=None):
+    """Registers a holder of memory.
+
+    Args:
+        kind: name of the kind of memory, e.g. `indexes`
+        sizes: function returning a dict with the bytes held per entry, with
+            the least recently used entry first
+        evict: function removing an entry by name, `None` if the entries can't
+            be evicted
+    """
+    _holders[kind] = (sizes, evict)
+
+
+def usage():
+    """Bytes held per kind and entry."""
+    with _lock:
+        return {kind: dict(sizes()) for kind, (sizes, _) in _holders.items()}
+
+
+def accounted(kind=None):
+    """Total bytes held by all holders, or by the holders of one kind."""
+    return sum(
+        sum(entries.values()) for holder, entries in usage().items()
+        if kind is None or holder == kind)
+
+
+def process_memory():
+    """Resident and peak resident memory of the process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        resident = None
+    return {'resident': resident, 'peak': peak}
+
+
+def evict_until(budget, kind, keep, needed):
+    """Evicts least recently used entries until `needed` more bytes fit into
+    the budget of a kind (all kinds for `None`). Returns whether they fit,
+    nothing is evicted if they wouldn't fit anyway."""
+    evictable = sum(
+        size
+        for holder, (sizes, evict) in _holders.items()
+        if evict is not None and (kind is None or holder == kind)
+        for name, size in sizes().items()
+        if (holder, name) != keep
+    )
+    if accounted(kind) - evictable + needed > budget:
+        return False
+    while accounted(kind) + needed > budget:
+        candidates = [
+            (holder, name)
+            for holder, (sizes, evict) in _holders.items()
+            if evict is not None and (kind is None or holder == kind)
+            for name in sizes()
+            if (holder, name) != keep
+        ]
+        if not candidates:
+            return False
+        # the least recently used entry of the holder with the most memory
+        holder, name = max(
+            candidates, key=lambda candidate: sum(_holders[candidate[0]][0]().values()))
+        _holders[holder][1](name)
+    return True
+
+
+def reserve(kind, name, nbytes):
+    """Makes room for `nbytes` more bytes of a kind.
+
+    Entries of evictable holders are evicted, least recently used first, until
+    the new bytes fit into the budget of the kind and into the total budget.
+    The entry `name` itself is never evicted.
+
+    Raises:
+        MemoryBudgetError: if the bytes don't fit even after evicting.
+    """
+    with _lock:
+        keep = (kind, name)
+        if kind in BUDGETS and not evict_until(BUDGETS[kind], kind, keep, nbytes):
+            raise MemoryBudgetError(
+                f'{nbytes} bytes for {kind} {name} exceed the budget of '
+                f'{BUDGETS[kind]} bytes for {kind}')
+        if BUDGET is not None and not evict_until(BUDGET, None, keep, nbytes):
+            raise MemoryBudgetError(
+                f'{nbytes} bytes for {kind} {name} exceed the memory budget of {BUDGET} bytes')
+
+
+def start_request():
+    """Accounts the payload of a callback request, or refuses it."""
+    nbytes = (flask.request.content_length or 0) * PAYLOAD_FACTOR
+    if not nbytes:
+        return None
+    key = id(flask.request._get_current_object())
+    try:
+        reserve('requests', key, nbytes)
+    except MemoryBudgetError as e:
+        return flask.Response(str(e), status=503, mimetype='text/plain')
+    with _lock:
+        _requests[key] = nbytes
+    return None
+
+
+def end_request(error=None):
+    with _lock:
+        _requests.pop(id(flask.request._get_current_object()), None)
+
+
+def memory_report():
+    """The accounted memory and the budgets as JSON."""
+    held = usage()
+    return flask.jsonify({
+        'process': process_memory(),
+        'accounted': sum(sum(entries.values()) for entries in held.values()),
+        'budget': BUDGET,
+        'budgets': BUDGETS,
+        'kinds': {
+            kind: {'total': sum(entries.values()), 'entries': {
+                str(name): size for name, size in entries.items()}}
+            for kind, entries in held.items()
+        },
+    })
+
+
+def snapshot():
+    """Top allocations of a tracemalloc snapshot, and the growth since the
+    previous one."""
+    global _last_snapshot
+    if flask.request.args.get('stop'):
+        tracemalloc.stop()
+        _last_snapshot = None
+        return flask.Response('tracing stopped\n', mimetype='text/plain')
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        return flask.Response(
+            'tracing started, request a snapshot again to see allocations\n',
+            mimetype='text/plain')
+    current = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    lines = ['==== top allocations ====']
+    lines.extend(str(stat) for stat in current.statistics('lineno')[:TOP_ALLOCATIONS])
+    if _last_snapshot is not None:
+        lines.append('==== growth since the previous snapshot ====')
+        lines.extend(
+            str(stat) for stat in current.compare_to(_last_snapshot, 'lineno')[:TOP_ALLOCATIONS])
+    _last_snapshot = current
+    return flask.Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+
+def instrument(server):
+    """Accounts the requests of a flask server and adds the memory endpoints."""
+    register('requests', lambda: dict(_requests))
+    server.before_request(start_request)
+    server.teardown_request(end_request)
+    server.add_url_rule('/metrics/memory', 'memory', memory_report)
+    server.add_url_rule('/metrics/memory/snapshot', 'memory_snapshot', snapshot)
+    if os.environ.get('ANNO_TRACEMALLOC'):
+        tracemalloc.start(TRACEMALLOC_FRAMES)
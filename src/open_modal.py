@@ -37,6 +37,33 @@ text_unit_dropdown = dbc.Select(
 )
 
 
+index_type_dropdown = html.Div([
+    dbc.Select(
+        id='ds-index-type-dd',
+        options=[
+            {'label': 'Exact search (4 bytes per dimension)', 'value': 'flat'},
+            {'label': '8 bit quantized (1 byte per dimension)', 'value': 'sq8'},
+            {'label': 'Product quantized (smallest)', 'value': 'pq'},
+        ],
+        value='flat'
+    ),
+    dbc.FormText("compressed indexes need less memory but find slightly less similar texts")
+])
+
+
+encoder_dropdown = html.Div([
+    dbc.Select(
+        id='ds-encoder-dd',
+        options=[
+            {'label': 'Sentence transformer (torch)', 'value': 'torch'},
+            {'label': 'Quantized ONNX (faster on CPU)', 'value': 'onnx-int8'},
+        ],
+        value='torch'
+    ),
+    dbc.FormText("model backend for the embeddings of the dataset and its searches")
+])
+
+
 dataset_description_input = html.Div([
     dbc.Textarea(placeholder='Dataset description', id='ds-description-input'),
     dbc.FormText("""short description of the dataset,
@@ -65,6 +92,8 @@ dataset_submit_button = html.Div([
 create_dataset_form = dbc.Form([dataset_name_input,
                                dataset_upload,
                                text_unit_dropdown,
+                               index_type_dropdown,
+                               encoder_dropdown,
                                dataset_description_input,
                                dataset_submit_button],
                                style={'width': '55%', 'display': 'inline-block'},
@@ -150,11 +179,17 @@ def open_project_modal(current_project):
         placeholder="Select a project to open",
         disabled=not existing_projects
     )
+    open_annotator_input = dbc.Input(
+        id='open-annotator-input',
+        placeholder='Annotator id (leave empty to adjudicate)',
+        type='text',
+        disabled=not existing_projects
+    )
     open_button = dbc.Button(
         "Open Project", color="success", id='open-project-btn', disabled=not existing_projects
     )
     open_form = dbc.Form(
-        [open_error, open_dropdown, open_button],
+        [open_error, open_dropdown, open_annotator_input, open_button],
         style={'width': '45%', 'float': 'left'}
     )
 
@@ -186,6 +221,34 @@ def open_project_modal(current_project):
         disabled=True
     )
 
+    create_sample_method_dropdown = dbc.Select(
+        id='create-sample-method-dd',
+        options=[
+            {'label': 'Annotate all rows', 'value': 'all'},
+            {'label': 'Annotate a random sample', 'value': 'random'},
+            {'label': 'Annotate a sample stratified by a column', 'value': 'stratified'},
+            {'label': 'Annotate a diverse sample (spread over topics)', 'value': 'diverse'},
+        ],
+        value='all',
+        disabled=not existing_datasets
+    )
+
+    create_sample_size_input = html.Div([
+        dbc.Input(
+            id='create-sample-size',
+            placeholder="Sample size, e.g. 5000, 0.05 or 5%",
+            type='text',
+            disabled=not existing_datasets
+        ),
+        dbc.FormText("The rest of the dataset can be labeled by label propagation"),
+    ])
+
+    create_sample_column_dropdown = dbc.Select(
+        id='create-sample-column-dd',
+        placeholder="Select a dataset column to stratify the sample by",
+        disabled=not existing_datasets
+    )
+
     create_button = html.Div([
         dbc.Button(
             "Create Project", color="success", id='create-project-btn',
@@ -196,9 +259,36 @@ def open_project_modal(current_project):
     create_form = dbc.Form([
         create_error, create_dropdown,
         create_project_name_input('create-proj-name', existing_datasets),
-        create_label_input, create_label_selection_dropdown, create_button],
+        create_label_input, create_label_selection_dropdown,
+        create_sample_method_dropdown, create_sample_size_input, create_sample_column_dropdown,
+        create_button],
         style={'width': '45%', 'float': 'left'})
 
+    append_form = dbc.Form([
+        dbc.Select(
+            id='append-dataset-dd',
+            options=[{'label': dataset, 'value': dataset} for dataset in existing_datasets],
+            placeholder="Select a Dataset to add rows to",
+            disabled=not existing_datasets
+        ),
+        dcc.Upload(
+            dbc.Button('Upload new rows', color="primary", id='append-upload-button'),
+            id='append-file-input',
+        ),
+        dbc.FormText("must be a .csv, .tsv or .xls file with the text column of the dataset"),
+        html.Div([
+            dbc.Button(
+                dbc.Spinner(html.Div('Append rows!', id="append-spinner"), size="sm"),
+                color="success",
+                id='append-dataset-btn',
+                disabled=not existing_datasets
+            ),
+            dbc.FormText("Only the new rows are embedded and indexed", id='append-text')
+        ])],
+        style={'width': '55%'},
+        className="gy-5"
+    )
+
     modal = dbc.Modal([
         dbc.ModalHeader("Open or create a new project"),
         dbc.ModalBody(
@@ -237,6 +327,15 @@ def open_project_modal(current_project):
                         ]),
                     ),
                     label="Add New Dataset"
+                ),
+                dbc.Tab(
+                    dbc.Card(
+                        dbc.CardBody([
+                            html.H4("Append rows to a Dataset", className="card-title"),
+                            append_form
+                        ]),
+                    ),
+                    label="Append to Dataset"
                 )
             ])
         ),
@@ -0,0 +1,90 @@
+"""Label propagation over the kNN graph of a dataset.
+
+Instead of training a classifier, the labels of the annotated rows are spread
+to their neighbours in the kNN graph of the faiss index (Zhou et al., "Learning
+with Local and Global Consistency"). Every iteration is one sparse matrix
+product, so this scales to datasets with millions of rows.
+"""
+import numpy as np
+from scipy import sparse
+
+import datasets
+from active_learning import labeled_mask
+
+# how much of the label mass is passed on in each iteration, the rest is pulled
+# back to the annotated labels
+ALPHA = 0.9
+MAX_ITERATIONS = 30
+TOLERANCE = 1e-4
+
+
+def normalized_graph(graph):
+    """Symmetrizes the kNN graph and normalizes it with D^-1/2 W D^-1/2.
+
+    Negative similarities are dropped, they would otherwise push label mass
+    into the wrong direction.
+    """
+    graph = graph.maximum(graph.T).tocsr()
+    graph.data = np.clip(graph.data, 0, None)
+    graph.eliminate_zeros()
+    degrees = np.asarray(graph.sum(axis=1)).ravel()
+    degrees[degrees == 0] = 1
+    inv_sqrt = sparse.diags(1 / np.sqrt(degrees)).astype('float32')
+    return (inv_sqrt @ graph @ inv_sqrt).tocsr()
+
+
+def propagate(graph, labels, alpha=ALPHA, max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    """Propagates labels over a graph.
+
+    Args:
+        graph: kNN graph as sparse matrix of shape (rows, rows)
+        labels: label of every row, `None` for unlabeled rows
+        alpha: fraction of the label mass that is propagated per iteration
+        max_iterations: maximum number of iterations
+        tolerance: stop when the label scores change less than this
+
+    Returns:
+        list of predicted labels (`None` where no label arrived) and an array
+        with the confidence of every prediction.
+    """
+    labels = np.asarray(labels, dtype=object)
+    labeled = labeled_mask(labels)
+    classes = sorted(set(labels[labeled]))
+    if not classes:
+        return [None] * len(labels), np.zeros(len(labels), dtype='float32')
+    class_index = {lbl: i for i, lbl in enumerate(classes)}
+    seeds = np.zeros((len(labels), len(classes)), dtype='float32')
+    rows = np.flatnonzero(labeled)
+    seeds[rows, [class_index[lbl] for lbl in labels[rows]]] = 1
+    transition = normalized_graph(graph)
+    scores = seeds.copy()
+    for _ in range(max_iterations):
+        new_scores = alpha * (transition @ scores) + (1 - alpha) * seeds
+        change = np.abs(new_scores - scores).max()
+        scores = new_scores
+        if change < tolerance:
+            break
+    totals = scores.sum(axis=1)
+    best = scores.argmax(axis=1)
+    reached = totals > 0
+    confidences = np.zeros(len(labels), dtype='float32')
+    confidences[reached] = scores[reached, best[reached]] / totals[reached]
+    predictions = [classes[b] if r else None for b, r in zip(best, reached)]
+    return predictions, confidences
+
+
+def propagate_project(project_name, dataset_name, labels):
+    """Propagates the labels of a project and stores the result in the dataset.
+
+    Args:
+        project_name: name of the project
+        dataset_name: name of the dataset of the project
+        labels: current label of every row, `None` for unlabeled rows
+
+    Returns:
+        the predictions and their confidences, see `propagate`.
+    """
+    graph = datasets.load_knn_graph(dataset_name)
+    predictions, confidences = propagate(graph, labels)
+    datasets.store_predictions(dataset_name, project_name, predictions, confidences)
+    return predictions, confidences
@@ -0,0 +1,94 @@
+"""Rule based labeling of many rows at once.
+
+A rule is a regular expression or a list of keywords that is matched against
+the whole text column with the vectorized string methods of pandas (backed by
+pyarrow, if it is installed), so seeding labels for 100k rows takes seconds.
+"""
+import re
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+
+def rule_expression(pattern, kind='regex'):
+    """Creates the regular expression of a rule.
+
+    Args:
+        pattern: a regular expression or comma separated keywords
+        kind: 'regex' or 'keywords'. Keywords match whole words only (hashtags
+            and mentions included) and any of them is enough for a match.
+
+    Returns:
+        regular expression as string
+
+    Raises:
+        re.error: if the pattern is not a valid regular expression
+        ValueError: if there are no keywords in the pattern
+    """
+    if kind == 'keywords':
+        keywords = [keyword.strip() for keyword in pattern.split(',') if keyword.strip()]
+        if not keywords:
+            raise ValueError('no keywords given')
+        # no lookarounds, pyarrow's regex engine (RE2) does not support them
+        pattern = r'(?:^|[^\w#@])(?:{})(?:$|\W)'.format('|'.join(map(re.escape, keywords)))
+    re.compile(pattern)
+    return pattern
+
+
+def match_rule(texts, pattern, kind='regex', case=False):
+    """Finds all texts that match a rule.
+
+    Args:
+        texts: pandas Series with the text units
+        pattern: a regular expression or comma separated keywords
+        kind: 'regex' or 'keywords', see `rule_expression`
+        case: whether matching is case sensitive
+
+    Returns:
+        boolean array marking the matching rows.
+    """
+    expression = rule_expression(pattern, kind)
+    if texts.dtype != STRING_DTYPE:
+        texts = texts.astype(STRING_DTYPE)
+    try:
+        matches = texts.str.contains(expression, case=case, regex=True)
+    except ValueError:
+        # the pattern uses syntax pyarrow does not know, python's re does
+        matches = texts.astype(object).str.contains(expression, case=case, regex=True)
+    return matches.fillna(False).to_numpy(bool)
+
+
+def rule_rows(texts, labeled, pattern, kind='regex', case=False, overwrite=False):
+    """Rows a rule would label.
+
+    Args:
+        texts: pandas Series with the text units
+        labeled: boolean array marking rows that already have a label
+        pattern: a regular expression or comma separated keywords
+        kind: 'regex' or 'keywords', see `rule_expression`
+        case: whether matching is case sensitive
+        overwrite: whether rows with a label get the label of the rule too
+
+    Returns:
+        dict with the positions of the rows to label (`rows`), the number of
+        matches (`matches`) and the number of matching rows that already have a
+        label (`labeled`).
+    """
+    matches = match_rule(texts, pattern, kind, case)
+    labeled_matches = matches & labeled
+    rows = np.flatnonzero(matches if overwrite else matches & ~labeled)
+    return {
+        'rows': rows,
+        'matches': int(matches.sum()),
+        'labeled': int(labeled_matches.sum()),
+    }
+
+
+def load_texts(path, text_column):
+    """Loads only the text column of a dataset file."""
+    return pd.read_csv(path, usecols=[text_column], dtype={text_column: STRING_DTYPE})[text_column]
@@ -0,0 +1,273 @@
+"""Working sets of projects, samples of the rows of their dataset.
+
+Only a part of a large dataset is annotated by hand, the rest is labeled
+automatically later (see `propagation`). A project can therefore be restricted
+to a sample of its dataset, its working set, and then only opens these rows in
+the tables. Samples are drawn
+- at random
+- stratified by a column of the dataset: every value of the column gets its
+  share of the sample
+- for diversity: the embeddings are clustered with k-means and the sample is
+  spread evenly over the clusters, starting with the row closest to every
+  centroid, so that rare topics are part of it as well
+
+The ids of the rows stay their positions in the dataset, so everything that is
+computed on the whole dataset (search, queue, propagation, ...) still returns
+dataset positions. `table_rows` and `dataset_rows` translate between these and
+the rows of a table, and `full_labels` turns the labels of a table into labels
+of the whole dataset. They go by the ids of the rows the table holds, not by
+the stored sample, so a table that was opened before the sample changed (or
+before rows were appended) stays consistent until it is opened again.
+"""
+import math
+import yaml
+import numpy as np
+import pandas as pd
+import faiss
+
+import datasets
+import storage
+
+SAMPLE_METHODS = ['random', 'stratified', 'diverse']
+# the diversity sample clusters the embeddings into at most this many clusters,
+# after reducing them to KMEANS_DIMENSIONS with a PCA
+MAX_CLUSTERS = 256
+KMEANS_DIMENSIONS = 64
+KMEANS_ITERATIONS = 20
+# rows per cluster the k-means is trained on, faiss warns below 39
+KMEANS_POINTS_PER_CLUSTER = 40
+
+
+def parse_size(value, n_rows):
+    """Parses the size of a sample, a number of rows (`5000`), a share (`0.05`)
+    or a percentage (`5%`).
+
+    Raises:
+        ValueError: if the value is no valid size
+    """
+    value = str(value).strip()
+    if value.endswith('%'):
+        size = math.ceil(float(value[:-1]) / 100 * n_rows)
+    elif float(value) < 1:
+        size = math.ceil(float(value) * n_rows)
+    else:
+        size = int(float(value))
+    if size < 1:
+        raise ValueError(f'sample size {value} is less than one row')
+    return min(size, n_rows)
+
+
+def allocate(group_sizes, size, weights):
+    """Splits a sample size between groups.
+
+    Every group gets a share of the size according to its weight, but never
+    more rows than it has; what is left over goes to the other groups.
+
+    Args:
+        group_sizes: number of rows of every group
+        size: number of rows to split
+        weights: weight of every group, e.g. its size for a proportional split
+
+    Returns:
+        int array with the number of rows of every group.
+    """
+    group_sizes = np.asarray(group_sizes, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    counts = np.zeros(len(group_sizes), dtype=np.int64)
+    size = min(size, int(group_sizes.sum()))
+    while counts.sum() < size:
+        remaining = size - counts.sum()
+        open_groups = counts < group_sizes
+        shares = np.where(open_groups, weights, 0)
+        shares = shares / shares.sum() * remaining
+        added = np.minimum(np.floor(shares).astype(np.int64), group_sizes - counts)
+        if not added.any():
+            # less rows left than open groups, largest remainders first
+            order = np.argsort(-(shares - np.floor(shares)), kind='stable')
+            added[order[open_groups[order]][:remaining]] = 1
+        counts += added
+    return counts
+
+
+def random_sample(n_rows, size, rng):
+    return rng.choice(n_rows, size, replace=False)
+
+
+def stratified_sample(values, size, rng):
+    """Rows drawn at random from every value of a column, proportionally to
+    its frequency. Missing values are a stratum of their own."""
+    codes, _ = pd.factorize(pd.Series(values).astype(object).fillna('').astype(str))
+    group_sizes = np.bincount(codes)
+    counts = allocate(group_sizes, size, group_sizes)
+    return np.concatenate([
+        rng.choice(np.flatnonzero(codes == code), count, replace=False)
+        for code, count in enumerate(counts) if count
+    ])
+
+
+def diverse_sample(embeddings, size, rng):
+    """Rows spread evenly over the k-means clusters of the embeddings.
+
+    Every cluster gets the same share of the sample (as far as it has rows),
+    first the row closest to its centroid and then rows at random.
+    """
+    n_rows, dimensions = embeddings.shape
+    n_clusters = min(size, MAX_CLUSTERS, n_rows)
+    train = np.sort(rng.choice(
+        n_rows, min(n_rows, n_clusters * KMEANS_POINTS_PER_CLUSTER), replace=False))
+    train_embeddings = np.asarray(embeddings[train], dtype='float32')
+    pca = faiss.PCAMatrix(dimensions, min(KMEANS_DIMENSIONS, dimensions))
+    pca.train(train_embeddings)
+
+    def reduce(vectors):
+        vectors = pca.apply(np.ascontiguousarray(vectors, dtype='float32'))
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    kmeans = faiss.Kmeans(
+        pca.d_out, n_clusters, niter=KMEANS_ITERATIONS, spherical=True,
+        seed=int(rng.integers(2**31)))
+    kmeans.train(reduce(train_embeddings))
+    clusters = np.empty(n_rows, dtype=np.int64)
+    similarities = np.empty(n_rows, dtype='float32')
+    for start in range(0, n_rows, datasets.SEARCH_BATCH_SIZE):
+        end = min(start + datasets.SEARCH_BATCH_SIZE, n_rows)
+        chunk_similarities, chunk_clusters = kmeans.index.search(
+            reduce(embeddings[start:end]), 1)
+        clusters[start:end] = chunk_clusters[:, 0]
+        similarities[start:end] = chunk_similarities[:, 0]
+    counts = allocate(
+        np.bincount(clusters, minlength=n_clusters), size, np.ones(n_clusters))
+    # random order within every cluster, the row closest to the centroid first
+    priority = rng.random(n_rows)
+    by_similarity = np.lexsort((-similarities, clusters))
+    cluster_starts = np.flatnonzero(np.r_[True, np.diff(clusters[by_similarity]) != 0])
+    priority[by_similarity[cluster_starts]] = -1
+    order = np.lexsort((priority, clusters))
+    sorted_clusters = clusters[order]
+    first = np.searchsorted(sorted_clusters, sorted_clusters)
+    rank = np.arange(n_rows) - first
+    return order[rank < counts[sorted_clusters]]
+
+
+def draw_sample(dataset_name, method, size, column=None, seed=0):
+    """Draws a sample of the rows of a dataset.
+
+    Args:
+        dataset_name: name of the dataset
+        method: one of `SAMPLE_METHODS`
+        size: number of rows
+        column: column to stratify by, for stratified samples
+        seed: seed of the random numbers, the same seed gives the same sample
+
+    Returns:
+        sorted array with the positions of the sampled rows.
+
+    Raises:
+        ValueError: for an unknown method or a stratified sample without column
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = datasets.load_meta_file('datasets_meta.yaml')[dataset_name]['size']
+    size = min(size, n_rows)
+    if method == 'random':
+        rows = random_sample(n_rows, size, rng)
+    elif method == 'stratified':
+        if not column:
+            raise ValueError('a stratified sample needs a column')
+        values = pd.read_csv(
+            f'{datasets.DATA_PATH}/{dataset_name}.csv', usecols=[column])[column]
+        rows = stratified_sample(values, size, rng)
+    elif method == 'diverse':
+        rows = diverse_sample(datasets.load_embeddings(dataset_name), size, rng)
+    else:
+        raise ValueError(f'unknown sample method {method}, use one of {SAMPLE_METHODS}')
+    return np.sort(rows)
+
+
+def create_sample(project_name, method, size, column=None, seed=0):
+    """Restricts a project to a new sample of its dataset.
+
+    Labels of rows outside of the new sample are kept, they are just not shown
+    any more. The sample is noted in the meta data of the project.
+
+    Args:
+        project_name: name of the project
+        method: one of `SAMPLE_METHODS`
+        size: number of rows
+        column: column to stratify by, for stratified samples
+        seed: seed of the random numbers
+
+    Returns:
+        the number of rows of the working set.
+    """
+    dataset_name = datasets.load_meta_file('projects_meta.yaml')[project_name]['dataset']
+    rows = draw_sample(dataset_name, method, size, column, seed)
+    datasets.save_sample(project_name, rows)
+    note_sample(project_name, {'method': method, 'size': len(rows), 'column': column, 'seed': seed})
+    return len(rows)
+
+
+def remove_sample(project_name):
+    """Lets a project work on all rows of its dataset again."""
+    datasets.save_sample(project_name, None)
+    note_sample(project_name, None)
+
+
+def note_sample(project_name, sample):
+    with storage.locked(datasets.DATA_PATH, 'meta'):
+        meta = datasets.load_meta_file('projects_meta.yaml')
+        if sample is None:
+            meta[project_name].pop('sample', None)
+        else:
+            meta[project_name]['sample'] = sample
+        storage.write_text(f'{datasets.DATA_PATH}/projects_meta.yaml', yaml.dump(meta))
+
+
+def table_ids(arg_data):
+    """The ids of the rows of a table, which are their dataset positions."""
+    return np.fromiter((row['id'] for row in arg_data), dtype=np.int64, count=len(arg_data))
+
+
+def table_rows(ids, rows):
+    """Positions in a table of rows given by their dataset positions. Rows
+    that are not in the table are left out.
+
+    Args:
+        ids: ids of the rows of the table, see `table_ids`
+        rows: dataset positions
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    if not len(ids):
+        return np.empty(0, dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    positions = np.minimum(np.searchsorted(ids, rows, sorter=order), len(ids) - 1)
+    inside = ids[order[positions]] == rows
+    return order[positions[inside]]
+
+
+def dataset_rows(ids, rows):
+    """Dataset positions of rows given by their positions in a table."""
+    return np.asarray(ids, dtype=np.int64)[np.asarray(rows, dtype=np.int64)]
+
+
+def outside_mask(ids, dataset_name):
+    """Boolean array marking the rows of the dataset that are not in a table,
+    `None` if the table holds all rows."""
+    n_rows = datasets.load_meta_file('datasets_meta.yaml')[dataset_name]['size']
+    if len(ids) == n_rows:
+        return None
+    outside = np.ones(n_rows, dtype=bool)
+    outside[np.asarray(ids, dtype=np.int64)] = False
+    return outside
+
+
+def full_labels(ids, dataset_name, labels):
+    """Labels of all rows of the dataset from the labels of the rows of a
+    table, rows that are not in the table are unlabeled."""
+    n_rows = datasets.load_meta_file('datasets_meta.yaml')[dataset_name]['size']
+    if len(ids) == n_rows:
+        return labels
+    full = np.full(n_rows, None, dtype=object)
+    full[np.asarray(ids, dtype=np.int64)] = labels
+    return full
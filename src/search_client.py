@@ -0,0 +1,122 @@
+"""Client for the search service, see `search_service.py`.
+
+The client keeps a pool of HTTP keep-alive connections to the service, so that
+concurrent callbacks don't open a new connection for every request.
+`RemoteIndex` looks like a faiss index to `datasets.search_index_filtered`, so
+filtering and over-fetching work the same for local and remote indexes. The
+size and dimension of every index are asked for once and then kept up to date
+by the answers to searches, so a search costs no extra round-trip.
+"""
+import base64
+import json
+import queue
+import http.client
+import numpy as np
+
+POOL_SIZE = 16
+TIMEOUT = 30
+
+
+def encode_array(array, dtype='float32'):
+    """Encodes an array for a JSON message."""
+    array = np.ascontiguousarray(array, dtype=dtype)
+    return {'shape': list(array.shape), 'data': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def decode_array(message, dtype='float32'):
+    """Decodes an array encoded with `encode_array`."""
+    return np.frombuffer(base64.b64decode(message['data']), dtype=dtype).reshape(message['shape'])
+
+
+class SearchClient:
+    """Connection pool for one search service."""
+
+    def __init__(self, address, pool_size=POOL_SIZE):
+        """
+        Args:
+            address: host:port of the service
+            pool_size: maximum number of idle connections kept open
+        """
+        self.host, port = address.rsplit(':', 1)
+        self.port = int(port)
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        # ntotal and d of every index, by index name
+        self.index_info = {}
+
+    def request(self, path, payload):
+        """Posts a JSON payload to the service and returns the JSON answer.
+
+        A pooled connection may have been closed by the service in the
+        meantime, so the request is retried once on a fresh connection.
+        """
+        body = json.dumps(payload).encode('utf-8')
+        for attempt in range(2):
+            try:
+                connection = self.pool.get_nowait()
+            except queue.Empty:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=TIMEOUT)
+            try:
+                connection.request(
+                    'POST', path, body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                answer = json.loads(response.read())
+            except (http.client.HTTPException, OSError):
+                # OSError covers ConnectionError and TimeoutError, the
+                # connection is in an unknown state and is not reused
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            try:
+                self.pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+            if response.status != 200:
+                raise RuntimeError(f'search service error: {answer.get("error")}')
+            return answer
+
+    def encode(self, texts, encoder):
+        """Encodes texts with an encoder backend of the service."""
+        answer = self.request('/encode', {'texts': list(texts), 'encoder': encoder})
+        return decode_array(answer['embeddings'])
+
+    def info(self, name):
+        """Size (`ntotal`) and dimension (`d`) of an index of the service."""
+        if name not in self.index_info:
+            self.update_info(name, self.request('/info', {'index': name}))
+        return self.index_info[name]
+
+    def update_info(self, name, answer):
+        """Keeps the size and dimension an answer of the service reports."""
+        if 'ntotal' in answer:
+            self.index_info[name] = {'ntotal': answer['ntotal'], 'd': answer['d']}
+
+
+class RemoteIndex:
+    """The faiss index of a dataset in the search service."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    @property
+    def ntotal(self):
+        return self.client.info(self.name)['ntotal']
+
+    @property
+    def d(self):
+        return self.client.info(self.name)['d']
+
+    def search(self, queries, k):
+        answer = self.client.request(
+            '/search', {'index': self.name, 'queries': encode_array(queries), 'k': int(k)})
+        self.client.update_info(self.name, answer)
+        return decode_array(answer['similarities']), decode_array(answer['ids'], 'int64')
+
+    def range_search(self, queries, threshold):
+        answer = self.client.request('/range_search', {
+            'index': self.name, 'queries': encode_array(queries), 'threshold': float(threshold)})
+        self.client.update_info(self.name, answer)
+        return (decode_array(answer['lims'], 'int64'),
+                decode_array(answer['similarities']),
+                decode_array(answer['ids'], 'int64'))
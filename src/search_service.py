@@ -0,0 +1,173 @@
+"""Search service that owns the embedding model and the faiss indexes.
+
+Without the service, every Dash worker encodes and searches on its own, one
+text at a time. The service collects the requests that arrive within a few
+milliseconds and handles them with one call to the model or the index, which is
+much faster than the same number of single calls. Start it from the repository
+root with
+
+    python src/search_service.py --port 8765
+
+and set ANNO_SEARCH_SERVICE=127.0.0.1:8765 for the app.
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+import datasets
+import encoders
+from search_client import encode_array, decode_array
+
+# how long a batch waits for more requests after the first one arrived
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = 64
+
+
+class MicroBatcher:
+    """Collects single requests and handles them in batches.
+
+    `function` gets a list of items and has to return a list with one result per
+    item. Requests arriving within `window` seconds of the first request of a
+    batch are handled together.
+    """
+
+    def __init__(self, function, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.function = function
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.pending = []
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, item):
+        """Adds an item to the next batch and waits for its result."""
+        future = Future()
+        with self.condition:
+            self.pending.append((item, future))
+            self.condition.notify()
+        return future.result()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            deadline = time.monotonic() + self.window
+            with self.condition:
+                while len(self.pending) < self.max_batch_size and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                batch = self.pending[:self.max_batch_size]
+                self.pending = self.pending[self.max_batch_size:]
+            try:
+                results = self.function([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+def encode_batch(requests):
+    """Encodes the texts of several requests with one call per encoder backend.
+
+    Requests are (encoder backend, texts) tuples.
+    """
+    results = [None] * len(requests)
+    for encoder in {encoder for encoder, _ in requests}:
+        positions = [i for i, request in enumerate(requests) if request[0] == encoder]
+        texts = [text for i in positions for text in requests[i][1]]
+        embeddings = encoders.encode(texts, encoder)
+        start = 0
+        for i in positions:
+            results[i] = embeddings[start:start + len(requests[i][1])]
+            start += len(requests[i][1])
+    return results
+
+
+def search_batch(requests):
+    """Searches the queries of several requests with one index call per index.
+
+    Requests are (index name, queries, k) tuples, all are searched with the
+    largest k and the results are cut to the k of each request.
+    """
+    results = [None] * len(requests)
+    for name in {name for name, _, _ in requests}:
+        positions = [i for i, request in enumerate(requests) if request[0] == name]
+        k = max(requests[i][2] for i in positions)
+        queries = np.vstack([requests[i][1] for i in positions])
+        similarities, ids = datasets.load_faiss_index(name).search(queries, k)
+        start = 0
+        for i in positions:
+            n_queries, request_k = len(requests[i][1]), requests[i][2]
+            results[i] = (similarities[start:start + n_queries, :request_k],
+                          ids[start:start + n_queries, :request_k])
+            start += n_queries
+    return results
+
+
+def index_info(name):
+    """Size and dimension of an index, also sent with every search answer so
+    that clients notice when an index grows."""
+    search_index = datasets.load_faiss_index(name)
+    return {'ntotal': int(search_index.ntotal), 'd': int(search_index.d)}
+
+
+encode_batcher = MicroBatcher(encode_batch)
+search_batcher = MicroBatcher(search_batch)
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP: every endpoint takes a POST with a JSON object."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if self.path == '/encode':
+                embeddings = encode_batcher.submit((payload['encoder'], payload['texts']))
+                answer = {'embeddings': encode_array(embeddings)}
+            elif self.path == '/search':
+                similarities, ids = search_batcher.submit(
+                    (payload['index'], decode_array(payload['queries']), payload['k']))
+                answer = {'similarities': encode_array(similarities),
+                          'ids': encode_array(ids, 'int64'),
+                          **index_info(payload['index'])}
+            elif self.path == '/range_search':
+                lims, similarities, ids = datasets.load_faiss_index(payload['index']).range_search(
+                    decode_array(payload['queries']), payload['threshold'])
+                answer = {'lims': encode_array(lims, 'int64'),
+                          'similarities': encode_array(similarities),
+                          'ids': encode_array(ids, 'int64'),
+                          **index_info(payload['index'])}
+            elif self.path == '/info':
+                answer = index_info(payload['index'])
+            else:
+                self.respond(404, {'error': f'unknown endpoint {self.path}'})
+                return
+        except Exception as e:
+            self.respond(500, {'error': repr(e)})
+            return
+        self.respond(200, answer)
+
+    def respond(self, status, answer):
+        body = json.dumps(answer).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    ThreadingHTTPServer((args.host, args.port), SearchHandler).serve_forever()
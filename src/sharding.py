@@ -0,0 +1,160 @@
+"""Faiss indexes that are split into shards of a fixed number of rows.
+
+A sharded index is a directory with one faiss index per shard and a manifest
+with the files and row counts of the shards. Shards are only read when they are
+searched for the first time, and new data is added as a new shard, so existing
+shards never have to be rebuilt. Searches fan out over the shards in a thread
+pool (faiss releases the GIL) and the top results are merged.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+
+MANIFEST = 'manifest.json'
+TEMPLATE = 'template.faiss'
+ADD_BATCH_SIZE = 4096
+SEARCH_THREADS = 8
+
+_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS)
+
+
+class ShardedIndex:
+    """A faiss-like index over a directory of shards.
+
+    Supports the parts of the faiss index interface that the app uses: `d`,
+    `ntotal`, `is_trained`, `search`, `range_search` and `reconstruct_n`.
+    The ids of the results are positions in the whole dataset, i.e. the ids in
+    a shard are offset by the rows of all shards before it.
+    """
+
+    def __init__(self, directory, read_index=faiss.read_index):
+        """Opens a sharded index, without reading any of the shards yet.
+
+        Args:
+            directory: directory of the sharded index
+            read_index: function to read a faiss index file
+        """
+        self.directory = directory
+        self.read_index = read_index
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            self.manifest = json.load(f)
+        self.shards = [None] * len(self.manifest['shards'])
+
+    @classmethod
+    def create(cls, directory, template):
+        """Creates an empty sharded index.
+
+        Args:
+            directory: directory for the shards
+            template: empty and trained faiss index, every shard is a copy of it
+
+        Returns:
+            the new ShardedIndex
+        """
+        os.makedirs(directory, exist_ok=True)
+        faiss.write_index(template, os.path.join(directory, TEMPLATE))
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            json.dump({'d': template.d, 'shards': []}, f)
+        return cls(directory)
+
+    @property
+    def d(self):
+        return self.manifest['d']
+
+    @property
+    def ntotal(self):
+        return sum(shard['rows'] for shard in self.manifest['shards'])
+
+    @property
+    def is_trained(self):
+        return True
+
+    def offsets(self):
+        """Position of the first row of every shard in the whole dataset."""
+        return np.cumsum([0] + [shard['rows'] for shard in self.manifest['shards']])[:-1]
+
+    def shard(self, number):
+        """Returns a shard, reading it on first use."""
+        if self.shards[number] is None:
+            self.shards[number] = self.read_index(
+                os.path.join(self.directory, self.manifest['shards'][number]['file']))
+        return self.shards[number]
+
+    def add_shard(self, embeddings):
+        """Adds embeddings as a new shard and stores it.
+
+        Args:
+            embeddings: array with the embeddings of the new rows, may be
+                memory mapped or half precision
+        """
+        index = faiss.read_index(os.path.join(self.directory, TEMPLATE))
+        for start in range(0, len(embeddings), ADD_BATCH_SIZE):
+            index.add(np.asarray(embeddings[start:start + ADD_BATCH_SIZE], dtype='float32'))
+        filename = f'shard_{len(self.shards):05d}.faiss'
+        faiss.write_index(index, os.path.join(self.directory, filename))
+        self.manifest['shards'].append({'file': filename, 'rows': int(index.ntotal)})
+        self.shards.append(index)
+        manifest_file = os.path.join(self.directory, MANIFEST)
+        with open(f'{manifest_file}.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(f'{manifest_file}.tmp', manifest_file)
+
+    def search(self, queries, k):
+        """Searches all shards and merges their top k results.
+
+        Args:
+            queries: float32 array of shape (queries, d)
+            k: number of results per query
+
+        Returns:
+            similarities and ids, like `faiss.Index.search`
+        """
+        def search_shard(number):
+            return self.shard(number).search(queries, k)
+
+        results = list(_executor.map(search_shard, range(len(self.shards))))
+        if not results:
+            return (np.full((len(queries), k), -np.inf, dtype='float32'),
+                    np.full((len(queries), k), -1, dtype='int64'))
+        similarities = np.hstack([sims for sims, _ in results])
+        ids = np.hstack([
+            np.where(shard_ids >= 0, shard_ids + offset, -1)
+            for (_, shard_ids), offset in zip(results, self.offsets())
+        ])
+        similarities[ids < 0] = -np.inf
+        best = np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+        return (np.take_along_axis(similarities, best, axis=1),
+                np.take_along_axis(ids, best, axis=1))
+
+    def range_search(self, queries, threshold):
+        """Finds all rows above a similarity threshold in all shards.
+
+        Returns:
+            lims, similarities and ids, like `faiss.Index.range_search`
+        """
+        def search_shard(number):
+            return self.shard(number).range_search(queries, threshold)
+
+        results = list(_executor.map(search_shard, range(len(self.shards))))
+        lims, similarities, ids = [0], [], []
+        for query in range(len(queries)):
+            for (shard_lims, shard_sims, shard_ids), offset in zip(results, self.offsets()):
+                similarities.append(shard_sims[shard_lims[query]:shard_lims[query + 1]])
+                ids.append(shard_ids[shard_lims[query]:shard_lims[query + 1]] + offset)
+            lims.append(sum(len(part) for part in ids))
+        if not ids:
+            return np.array(lims), np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64')
+        return np.array(lims), np.concatenate(similarities), np.concatenate(ids)
+
+    def reconstruct_n(self, start, n):
+        """Reconstructs the embeddings of `n` rows starting at `start`."""
+        parts = []
+        for number, offset in enumerate(self.offsets()):
+            rows = self.manifest['shards'][number]['rows']
+            first, last = max(start, offset), min(start + n, offset + rows)
+            if first < last:
+                parts.append(
+                    self.shard(number).reconstruct_n(int(first - offset), int(last - first)))
+        return np.vstack(parts) if parts else np.zeros((0, self.d), dtype='float32')
@@ -0,0 +1,77 @@
+"""Locks and atomic writes for the files in the data folders.
+
+Files are never rewritten in place. They are written to a temporary file next
+to them and then renamed over the old one, so readers always see either the
+old or the new version, never a half written file, and don't need locks.
+Read-modify-write cycles (e.g. saving the labels of a project) hold a lock,
+so concurrent writers can't drop each other's changes. The locks are file
+locks, so they work across the worker processes of gunicorn as well as across
+threads.
+"""
+import os
+import tempfile
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks on windows, locks only work within one process there
+    fcntl = None
+
+LOCK_DIRECTORY = '.locks'
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def locked(directory, name):
+    """Holds the exclusive lock `name` of a data folder.
+
+    Args:
+        directory: the data folder, the lock files are kept in a subfolder
+        name: name of the lock, e.g. the name of a dataset or project
+    """
+    if fcntl is None:
+        with _thread_locks_lock:
+            lock = _thread_locks.setdefault((directory, name), threading.Lock())
+        with lock:
+            yield
+        return
+    lock_directory = os.path.join(directory, LOCK_DIRECTORY)
+    os.makedirs(lock_directory, exist_ok=True)
+    with open(os.path.join(lock_directory, f'{name}.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Gives a temporary path to write to, which replaces `path` at the end.
+
+    If writing fails, the temporary file is removed and `path` is unchanged.
+    The suffix of `path` is kept, since some writers (numpy, faiss) look at
+    it.
+    """
+    directory, filename = os.path.split(path)
+    handle, temporary = tempfile.mkstemp(
+        dir=directory or '.', prefix=f'.{filename}.', suffix=os.path.splitext(filename)[1])
+    os.close(handle)
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def write_text(path, text):
+    """Writes a text file atomically."""
+    with atomic_path(path) as temporary:
+        with open(temporary, 'w') as f:
+            f.write(text)
@@ -0,0 +1,15 @@
+"""Entry point for running the app with a production server.
+
+The dev server in `index.py` is a single process. With gunicorn, several worker
+processes serve the annotators at the same time:
+
+    gunicorn --config src/gunicorn.conf.py wsgi:server
+
+(run from the repository root, like `python src/index.py`, so that the data
+folders are found.) The config preloads the app, the sentence embedding model
+and the faiss indexes in the master process. The workers are forked from it and
+share that memory, so it does not grow with the number of workers.
+"""
+from index import app
+
+server = app.server